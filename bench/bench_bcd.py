@@ -0,0 +1,64 @@
+from radioctl.utils.bcd import (
+    bcd_to_integer, decode_many, encode_many, integer_to_bcd)
+
+import itertools
+import random
+import timeit
+
+
+NUMBER = 100000
+SAMPLES = 1000
+
+
+def legacy_bcd_to_integer(bcd):
+    result = 0
+    mult = 1
+    for byteval in bcd:
+        lower = byteval & 0xF
+        upper = (byteval & 0xF0) >> 4
+        result += (upper * 10 + lower) * mult
+        mult *= 100
+    return result
+
+
+def legacy_integer_to_bcd(i):
+    result = b''
+    while i > 0:
+        a = i % 10
+        i //= 10
+        a |= (i % 10) << 4
+        i //= 10
+        result += bytes([a])
+    return result.ljust(5, b'\x00')
+
+
+def rate(stmt):
+    elapsed = min(timeit.repeat(stmt, number=NUMBER, repeat=3))
+    return NUMBER / elapsed
+
+
+def batch_rate(stmt):
+    elapsed = min(timeit.repeat(stmt, number=NUMBER // 100, repeat=3))
+    return NUMBER / elapsed
+
+
+def main():
+    rng = random.Random(7300)
+    freqs = [rng.randrange(30000, 74800000) for _ in range(SAMPLES)]
+    encoded = [integer_to_bcd(f, 5) for f in freqs]
+    frames = itertools.cycle(encoded)
+    values = itertools.cycle(freqs)
+
+    print('Decode 5 byte frequency:')
+    print(f'  legacy:  {rate(lambda: legacy_bcd_to_integer(next(frames))):12,.0f}/sec')
+    print(f'  table:   {rate(lambda: bcd_to_integer(next(frames))):12,.0f}/sec')
+    print('Encode 5 byte frequency:')
+    print(f'  legacy:  {rate(lambda: legacy_integer_to_bcd(next(values))):12,.0f}/sec')
+    print(f'  table:   {rate(lambda: integer_to_bcd(next(values), 5)):12,.0f}/sec')
+
+    # a 100 channel memory dump
+    channels = freqs[0:100]
+    dump = encode_many(channels, 5)
+    print('Batch of 100 channels:')
+    print(f'  encode:  {batch_rate(lambda: encode_many(channels, 5)):12,.0f} values/sec')
+    print(f'  decode:  {batch_rate(lambda: decode_many(dump, 5)):12,.0f} values/sec')
@@ -0,0 +1,95 @@
+from radioctl.hamlib.server import Server
+from radioctl.msgbus import MsgType
+from radioctl.radio_registry import load_all, radio_definition
+from radioctl.rigfactory import create_rig
+from radioctl.simulator import create_simulator
+
+import asyncio
+import statistics
+import time
+
+
+ROUND_TRIPS = 300
+FRAMES = 20000
+
+
+async def connect(loop, name, **kwargs):
+    sim = create_simulator(radio_definition(name), **kwargs)
+    sim.start(loop)
+    rig = create_rig(name, {}, itu_region=2)
+    # no polling, which would compete with the measured traffic
+    closed = await rig.connect_serial(loop, sim.port, 38400, poll=False)
+    return (sim, rig, closed)
+
+
+async def disconnect(sim, rig, closed):
+    rig.protocol._transport.close()
+    await closed
+    sim.close()
+
+
+async def round_trips(loop, name, baudrate):
+    (sim, rig, closed) = await connect(loop, name, baudrate=baudrate)
+    server = await Server(rig, max_age=0).start('127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    (reader, writer) = await asyncio.open_connection('127.0.0.1', port)
+    samples = []
+    for _ in range(ROUND_TRIPS):
+        start = time.perf_counter()
+        writer.write(b'f\n')
+        await reader.readline()
+        samples.append(time.perf_counter() - start)
+    writer.close()
+    server.close()
+    await server.wait_closed()
+    await disconnect(sim, rig, closed)
+    return samples
+
+
+async def frame_rate(loop):
+    (sim, rig, closed) = await connect(loop, 'K3')
+    await asyncio.sleep(0.01)
+    done = loop.create_future()
+    count = 0
+
+    def received(index, freq):
+        nonlocal count
+        count += 1
+        if count == FRAMES and not done.done():
+            done.set_result(None)
+    rig.msgbus[MsgType.VFO_FREQUENCY_RESULT].connect(received)
+
+    start = time.perf_counter()
+    for i in range(FRAMES):
+        sim.set('vfo_0', 'freq', 14000000 + i)
+        sim.report('vfo_0')
+        if i % 100 == 99:
+            # let the host drain the pty
+            await asyncio.sleep(0)
+    await done
+    elapsed = time.perf_counter() - start
+    await disconnect(sim, rig, closed)
+    return FRAMES / elapsed
+
+
+def percentiles(samples):
+    cuts = statistics.quantiles(samples, n=100)
+    return '  '.join(f'p{p} {cuts[p - 1] * 1000:6.2f}ms' for p in (50, 90, 99))
+
+
+def main():
+    load_all()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        print(f'rigctld "f" round trip, {ROUND_TRIPS} commands:')
+        for (name, baudrate) in (('K3', None), ('K3', 38400), ('IC-7300', None),
+                                 ('IC-7300', 19200)):
+            samples = loop.run_until_complete(round_trips(loop, name, baudrate))
+            line = f'{baudrate} baud' if baudrate else 'unpaced'
+            print(f'  {name:8} {line:11} {percentiles(samples)}')
+        rate = loop.run_until_complete(frame_rate(loop))
+        print(f'Auto-info frames through pty, transport and model: {rate:,.0f} frames/sec')
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
@@ -0,0 +1,75 @@
+from radioctl.msgbus import MsgBus
+from radioctl.protocol.kenwood.protocol import Protocol
+from radioctl.radio_registry import load_all, radio_definition
+
+import asyncio
+import time
+import tracemalloc
+
+
+# An AI2 burst while tuning, delivered in serial sized reads
+STREAM = b'FA00014074000;FB00007074000;MD2;FA00014074010;MD$6;FR0;FT1;' * 64
+CHUNK = 64
+ROUNDS = 200
+
+
+def chunks():
+    return [STREAM[i:i + CHUNK] for i in range(0, len(STREAM), CHUNK)]
+
+
+def stream_reader_path(dispatch):
+    # The previous path: StreamReader.readuntil() per frame
+    async def run(data):
+        reader = asyncio.StreamReader()
+        for chunk in data:
+            reader.feed_data(chunk)
+        reader.feed_eof()
+        try:
+            while True:
+                pkt = await reader.readuntil(b';')
+                dispatch(pkt)
+        except asyncio.IncompleteReadError:
+            pass
+
+    loop = asyncio.new_event_loop()
+    data = chunks()
+
+    def run_once():
+        loop.run_until_complete(run(data))
+    return run_once
+
+
+def frame_protocol_path(protocol):
+    framer = protocol.create_frame_protocol()
+    data = chunks()
+
+    def run_once():
+        for chunk in data:
+            framer.data_received(chunk)
+    return run_once
+
+
+def measure(run_once):
+    frames = STREAM.count(b';') * ROUNDS
+    tracemalloc.start()
+    run_once()
+    (_, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    start = time.perf_counter()
+    for _ in range(ROUNDS):
+        run_once()
+    elapsed = time.perf_counter() - start
+    return (frames / elapsed, peak)
+
+
+def main():
+    load_all()
+    rig_def = radio_definition('K3')
+    protocol = Protocol(rig_def['dialect'], {}, MsgBus(), rig_def)
+
+    # Both paths end in the same dispatcher and handlers
+    (before, before_peak) = measure(stream_reader_path(protocol._dispatch))
+    (after, after_peak) = measure(frame_protocol_path(protocol))
+
+    print(f'StreamReader.readuntil: {before:12,.0f} frames/sec, peak {before_peak:,} bytes')
+    print(f'FrameProtocol:          {after:12,.0f} frames/sec, peak {after_peak:,} bytes')
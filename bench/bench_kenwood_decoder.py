@@ -0,0 +1,75 @@
+from radioctl.msgbus import MsgBus
+from radioctl.protocol.kenwood.protocol import Protocol
+from radioctl.radio_registry import load_all, radio_definition
+
+import re
+import timeit
+
+
+FRAMES = (
+    b'FA00014074000;',
+    b'FB00007074000;',
+    b'MD2;',
+    b'MD$6;',
+    b'FR0;',
+    b'FT1;',
+    b'KS025;',
+)
+
+
+def legacy_decode(protocol_config):
+    # The previous path: decode to str, slice the command and run the
+    # YAML regex against the whole message.
+    patterns = {}
+    for item in protocol_config.values():
+        if isinstance(item, dict) and 'response' in item:
+            resp = item['response']
+            cmd = resp[0:2]
+            if resp[2] == '\\' and resp[3] == '$':
+                cmd += '$'
+            patterns[cmd] = re.compile(resp)
+
+    def decode(pkt):
+        msg = pkt.decode()
+        if msg[2] == '$':
+            cmd = msg[0:3]
+        else:
+            cmd = msg[0:2]
+        match = patterns[cmd].match(msg)
+        if match:
+            return match.groupdict()
+    return decode
+
+
+def compiled_decode(handlers):
+    decoders = {cmd: handler._decoder for (cmd, handler) in handlers.items()}
+
+    def decode(frame):
+        if frame[2] == 0x24:
+            cmd = frame[0:3]
+        else:
+            cmd = frame[0:2]
+        return decoders[cmd].decode(frame)
+    return decode
+
+
+def measure(dispatch, repeat=5, number=20000):
+    def run():
+        for frame in FRAMES:
+            dispatch(frame)
+    best = min(timeit.repeat(run, repeat=repeat, number=number))
+    return (number * len(FRAMES)) / best
+
+
+def main():
+    load_all()
+    rig_def = radio_definition('K3')
+    protocol = Protocol(rig_def['dialect'], {}, MsgBus(), rig_def)
+
+    before = measure(legacy_decode(rig_def['protocol_config']))
+    after = measure(compiled_decode(protocol._handlers))
+    dispatch = measure(protocol._dispatch)
+
+    print(f'regex per frame:  {before:12,.0f} frames/sec')
+    print(f'compiled decoder: {after:12,.0f} frames/sec ({after / before:.2f}x)')
+    print(f'full dispatch:    {dispatch:12,.0f} frames/sec')
@@ -0,0 +1,69 @@
+from radioctl.hamlib.server import (
+    _cmd_args, _cmd_map, parse_command, Session, split_response_mode)
+
+import itertools
+import timeit
+
+
+NUMBER = 100000
+
+# Command lines as logged from typical clients
+STREAMS = {
+    # polls with short commands, one per line; sets while transmitting
+    'WSJT-X': ['f', 'm', 's', 't', 'v', 'f', 'm', 'F 14074000', 'T 1', 'T 0'],
+    # long names, extended responses
+    'N1MM': ['+\\get_freq', '+\\get_mode', '+\\get_vfo', '+\\get_split_vfo',
+             '+\\set_freq 7012500', '+\\get_ptt'],
+    # several commands per line
+    'logger': ['fmv', 'F 7074000 mv', 'fmvs', '\\get_freq \\get_mode'],
+}
+
+
+def legacy_parse_command(cmdline):
+    if cmdline.startswith('b'): # special case for morse code
+        yield ('send_morse', cmdline[1:].strip())
+        return
+
+    cmdfields = cmdline.split()
+
+    while cmdfields:
+        if cmdfields[0][0] == '\\':
+            cmd = cmdfields.pop(0).lstrip('\\')
+        else:
+            cmds = []
+            for c in cmdfields.pop(0): # each char
+                cmds.append(_cmd_map.get(c, 'unknown'))
+            while cmds:
+                cmd = cmds.pop(0)
+                if len(cmds) > 0:
+                    yield (cmd,)
+
+        argcount = _cmd_args.get(cmd, 0)
+        args = cmdfields[0:argcount]
+        yield (cmd, *args)
+        cmdfields = cmdfields[argcount:]
+
+
+def legacy_dispatch(session, line):
+    for cmd in legacy_parse_command(line.lstrip('+;|,')):
+        getattr(session, 'cmd_{}'.format(cmd[0]), None)
+
+
+def dispatch(session, line):
+    (separator, line) = split_response_mode(line)
+    for cmd in parse_command(line):
+        session._handlers.get(cmd[0])
+
+
+def rate(stmt):
+    elapsed = min(timeit.repeat(stmt, number=NUMBER, repeat=3))
+    return NUMBER / elapsed
+
+
+def main():
+    session = Session.__new__(Session)
+    for (name, stream) in STREAMS.items():
+        lines = itertools.cycle(stream)
+        print(f'{name}:')
+        print(f'  legacy:  {rate(lambda: legacy_dispatch(session, next(lines))):12,.0f} lines/sec')
+        print(f'  table:   {rate(lambda: dispatch(session, next(lines))):12,.0f} lines/sec')
@@ -0,0 +1,31 @@
+from radioctl.utils.signal_slots import Signal
+
+import timeit
+
+
+class Receiver:
+    def slot(self, index, value):
+        pass
+
+
+def function_slot(index, value):
+    pass
+
+
+def measure(signal, repeat=5, number=100000):
+    best = min(timeit.repeat(lambda: signal(0, 7074000), repeat=repeat, number=number))
+    return best / number * 1e9
+
+
+def main():
+    receivers = []
+    for count in (1, 10, 100):
+        methods = Signal()
+        functions = Signal()
+        for _ in range(count):
+            receiver = Receiver()
+            receivers.append(receiver)
+            methods.connect(receiver.slot)
+            functions.connect(lambda index, value: None)
+        print(f'{count:3d} method slots:   {measure(methods):10,.0f} ns/emit')
+        print(f'{count:3d} function slots: {measure(functions):10,.0f} ns/emit')
@@ -0,0 +1,86 @@
+from radioctl import radio_registry
+from radioctl.radio_registry import load_all, radio_definition
+from radioctl.rigfactory import create_rig
+
+import os
+import re
+import shutil
+import tempfile
+import time
+import yaml
+
+
+# Copies of each definition in the simulated rig database
+COPIES = 200
+REPEAT = 5
+
+
+def make_rigsdb(path):
+    # COPIES renamed copies of every definition shipped in RIGSDB
+    source = os.getenv('RIGSDB')
+    os.makedirs(path)
+    for item in os.listdir(source):
+        if not item.endswith('.yaml'):
+            continue
+        with open(os.path.join(source, item)) as f:
+            text = f.read()
+        for i in range(COPIES):
+            renamed = re.sub(r'^aliases:\n(\s+- .*\n)+', lambda m: re.sub(
+                r'^(\s+- )', rf'\g<1>Copy{i}-', m.group(0), flags=re.M), text, flags=re.M)
+            renamed = renamed.replace("name: '", f"name: 'Copy {i} ", 1)
+            with open(os.path.join(path, f'{i:03d}_{item}'), 'w') as f:
+                f.write(renamed)
+        shutil.copy(os.path.join(source, item), path)
+
+
+def legacy_load_all(rigsdb):
+    # The previous path: every file parsed with the pure Python loader
+    for item in os.listdir(rigsdb):
+        if item.endswith('.yaml'):
+            with open(os.path.join(rigsdb, item)) as f:
+                rig_definition = yaml.full_load(f)
+            for name in (rig_definition['name'], *rig_definition['aliases']):
+                radio_registry.register_radio(name, rig_definition)
+
+
+def timed(func):
+    best = None
+    for _ in range(REPEAT):
+        radio_registry.clear()
+        start = time.perf_counter()
+        func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main():
+    saved = os.environ['RIGSDB']
+    with tempfile.TemporaryDirectory() as tmp:
+        rigsdb = os.path.join(tmp, 'rigs')
+        cache_dir = os.path.join(tmp, 'cache')
+        make_rigsdb(rigsdb)
+        os.environ['RIGSDB'] = rigsdb
+        try:
+            count = len(os.listdir(rigsdb))
+
+            def startup(load):
+                def run():
+                    load()
+                    create_rig('K3', {}, itu_region=2)
+                return run
+
+            def cold():
+                shutil.rmtree(cache_dir, ignore_errors=True)
+                load_all(cache_dir)
+                create_rig('K3', {}, itu_region=2)
+
+            print(f'{count} rig definitions, load and create a K3:')
+            print(f'  legacy:      {timed(startup(lambda: legacy_load_all(rigsdb))) * 1000:8.1f} ms')
+            print(f'  no cache:    {timed(startup(lambda: load_all(""))) * 1000:8.1f} ms')
+            print(f'  cold cache:  {timed(cold) * 1000:8.1f} ms')
+            print(f'  warm cache:  {timed(startup(lambda: load_all(cache_dir))) * 1000:8.1f} ms')
+        finally:
+            os.environ['RIGSDB'] = saved
+            radio_registry.clear()
+            load_all()
@@ -1,3 +1,6 @@
+import bisect
+
+
 class Band:
     def __init__(self):
         self._freq_range = (None, None)
@@ -32,3 +35,36 @@ class Band:
     @property
     def high_power(self):
         return self._power_levels[1]
+
+
+class BandIndex:
+    """
+    The bands of a frozen Capabilities sorted by frequency, answering
+    which band a frequency falls in with a binary search. Band ranges
+    include both ends and must not overlap.
+    """
+    __slots__ = ['_starts', '_ends', '_bands']
+
+    def __init__(self, bands):
+        bands = sorted(bands, key=lambda band: band.freq_range)
+        for (below, above) in zip(bands, bands[1:]):
+            if above.freq_range[0] <= below.freq_range[1]:
+                raise ValueError(f'Overlapping bands: {below.freq_range} {above.freq_range}')
+        self._starts = tuple(band.freq_range[0] for band in bands)
+        self._ends = tuple(band.freq_range[1] for band in bands)
+        self._bands = tuple(bands)
+
+    def __len__(self):
+        return len(self._bands)
+
+    def __iter__(self):
+        return iter(self._bands)
+
+    def find(self, freq):
+        """
+        The band containing freq, or None.
+        """
+        i = bisect.bisect_right(self._starts, freq) - 1
+        if i >= 0 and freq <= self._ends[i]:
+            return self._bands[i]
+        return None
@@ -1,11 +1,26 @@
+from radioctl.msgbus import MsgType
+from radioctl.utils import logging
+
 import asyncio
-import logging
 
 
+_logger = logging.getLogger('cwdaemon')
+
 ESC = '\x1b'
 
 
-class CWDaemonListenerProtocol(asyncio.Protocol):
+class CWDaemonListenerProtocol(asyncio.DatagramProtocol):
+    """
+    The cwdaemon UDP protocol, spoken by contest loggers, on top of a
+    rig's CW pipeline (see MorseTask).
+
+    Text datagrams are keyed by the rig; those received during one event
+    loop iteration are batched into a single MORSE_SEND. ESC commands
+    change the speed, abort, key PTT or request an echo: the reply set
+    with ESC h is sent back once the text which follows it has been
+    keyed, i.e. when the rig reports MORSE_COMPLETE, as cwdaemon does
+    when its tone queue empties. An abort sends any waiting echo at once.
+    """
     ESC_CMDS = {
         '0' : 'not_implemented', #'reset_to_default_values',
         '2' : 'set_keying_speed',
@@ -18,62 +33,117 @@ class CWDaemonListenerProtocol(asyncio.Protocol):
         'h' : 'set_data_reply',
     }
 
-    def __init__(self, hamlib_protocol, is_complete):
+    def __init__(self, msgbus):
+        self._msgbus = msgbus
+        self._transport = None
+        self._text = []
+        self._flush_handle = None
         self._data_reply = None
-        self._hamlib_protocol = hamlib_protocol
+        self._echoes = []
+        msgbus[MsgType.MORSE_COMPLETE].connect(self._complete)
 
     def connection_made(self, transport):
         self._transport = transport
 
+    def connection_lost(self, exc):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._msgbus[MsgType.MORSE_COMPLETE].disconnect(self._complete)
+
     def datagram_received(self, data, addr):
-        message = data.decode()
+        message = data.decode(errors='replace')
         if message.startswith(ESC):
+            if len(message) < 2:
+                return
+            # commands apply in order with the text around them
+            self._flush()
             cmd = message[1]
-            data = None
-
-            if len(message) > 2:
-                message = message[2:]
-
             mapped_cmd = self.ESC_CMDS.get(cmd, 'not_implemented')
-            func = getattr(self, mapped_cmd)
-            assert(func)
-            func(cmd, message)
+            getattr(self, mapped_cmd)(cmd, message[2:], addr)
         else:
-            self.send_cw(message)
-            if self._data_reply:
-                self._transport.sendto(self._data_reply.encode(), addr)
+            self.send_cw(message, addr)
 
-    def abort_message(self, cmd, message):
-        self._hamlib_protocol.cancel_morse()
+    def abort_message(self, cmd, message, addr):
+        self._text.clear()
+        self._data_reply = None
+        self._msgbus[MsgType.MORSE_CANCEL]()
+        self._complete()
 
-    def not_implemented(self, cmd, message):
-        logging.warn('Unhandled command %s with data: %s', cmd, message)
+    def not_implemented(self, cmd, message, addr):
+        _logger.warning('Unhandled command {} with data: {!r}', cmd, message)
 
-    def set_data_reply(self, cmd, message):
-        self._data_reply = cmd + message
+    def set_data_reply(self, cmd, message, addr):
+        self._data_reply = (cmd + message, addr)
 
-    def set_keying_speed(self, cmd, message):
-        self._hamlib_protocol.morse_speed(message.rstrip('\x00'))
+    def set_keying_speed(self, cmd, message, addr):
+        try:
+            speed = int(message.rstrip('\x00'))
+        except ValueError:
+            _logger.warning('Invalid keying speed: {!r}', message)
+            return
+        self._msgbus[MsgType.KEYER_SPEED_SET](speed)
 
-    def set_ptt(self, cmd, message):
-        if len(message) == 0:
+    def set_ptt(self, cmd, message, addr):
+        message = message.strip()
+        if not message:
             return
-        elif message.strip()[0] == '0':
-            self._hamlib_protocol.set_ptt(0)
+        if message[0] == '0':
+            self._msgbus[MsgType.RECEIVE_SET]()
         else:
-            self._hamlib_protocol.set_ptt(1)
+            self._msgbus[MsgType.TRANSMIT_SET]()
 
-    def send_cw(self, message):
-        logging.info('Sending: %s', message)
-        self._hamlib_protocol.send_morse(message.replace('\x00', '').replace('~', ' '))
+    def send_cw(self, message, addr):
+        text = message.replace('\x00', '').replace('~', ' ')
+        if not text:
+            return
+        _logger.info('Sending: {}', text)
+        self._text.append(text)
+        if self._data_reply is not None:
+            self._echoes.append(self._data_reply)
+            self._data_reply = None
+        if self._flush_handle is None:
+            self._flush_handle = asyncio.get_event_loop().call_soon(self._flush)
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if self._text:
+            text = ''.join(self._text)
+            self._text.clear()
+            self._msgbus[MsgType.MORSE_SEND](text)
+
+    def _complete(self):
+        if self._text:
+            # keyed all that was sent, but more is on its way
+            return
+        echoes = self._echoes
+        self._echoes = []
+        for (reply, addr) in echoes:
+            _logger.debug('Echo: {}', reply)
+            if self._transport is not None:
+                self._transport.sendto(reply.encode() + b'\r\n', addr)
 
 
 class CWDaemonListener:
-    async def start(self, hamlib_protocol, loop, bindaddr, port):
-        logging.info('Starting CWDaemonListener on %s:%d', bindaddr, port)
-        is_complete = loop.create_future()
-        transport, protocol = \
-            await loop.create_datagram_endpoint(
-                lambda: CWDaemonListenerProtocol(hamlib_protocol, is_complete),
-                local_addr=(bindaddr, port))
-        await is_complete
+    """
+    Serves cwdaemon clients for a rig, e.g.
+
+        listener = CWDaemonListener()
+        await listener.start(rig, loop, '127.0.0.1', 6789)
+    """
+    def __init__(self):
+        self._transport = None
+
+    async def start(self, rig, loop, bindaddr, port):
+        _logger.info('Starting CWDaemonListener on {}:{}', bindaddr, port)
+        (self._transport, _) = await loop.create_datagram_endpoint(
+            lambda: CWDaemonListenerProtocol(rig.msgbus),
+            local_addr=(bindaddr, port))
+        return self._transport
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
@@ -1,4 +1,4 @@
-from .bands import Band
+from .bands import Band, BandIndex
 
 def khz(x):
     return 1000*x
@@ -30,6 +30,13 @@ _bands_by_itu = {
 }
 
 
+def band_names():
+    """
+    The names of the bands of every ITU region, e.g. '20m'.
+    """
+    return frozenset(name for bands in _bands_by_itu.values() for name in bands)
+
+
 class Capabilities:
     def __init__(self, itu_region):
         self._itu_region = itu_region
@@ -37,7 +44,15 @@ class Capabilities:
         self._vfos = set()
         self._rx_bands = []
         self._tx_bands = []
+        self._rx_index = None
+        self._tx_index = None
         self._rf_power = (0, 0)
+        self._get_levels = set()
+        self._set_levels = set()
+        self._get_funcs = set()
+        self._set_funcs = set()
+        self._get_parms = set()
+        self._set_parms = set()
 
     def add_modes(self, *modes):
         self._modes.update(set(modes))
@@ -62,14 +77,68 @@ class Capabilities:
     def set_rf_power(self, low, high):
         self._rf_power = (low, high)
 
+    def add_levels(self, *levels, getit=True, setit=True):
+        if getit:
+            self._get_levels.update(levels)
+        if setit:
+            self._set_levels.update(levels)
+
+    def add_funcs(self, *funcs, getit=True, setit=True):
+        if getit:
+            self._get_funcs.update(funcs)
+        if setit:
+            self._set_funcs.update(funcs)
+
+    def add_parms(self, *parms, getit=True, setit=True):
+        if getit:
+            self._get_parms.update(parms)
+        if setit:
+            self._set_parms.update(parms)
+
     def freeze(self):
         self._modes = frozenset(self._modes)
         self._vfos = frozenset(self._vfos)
-        self._rx_bands = tuple(self._rx_bands)
+        self._rx_bands = self._merge_bands(self._rx_bands)
         self._tx_bands = tuple(self._tx_bands)
+        self._get_levels = frozenset(self._get_levels)
+        self._set_levels = frozenset(self._set_levels)
+        self._get_funcs = frozenset(self._get_funcs)
+        self._set_funcs = frozenset(self._set_funcs)
+        self._get_parms = frozenset(self._get_parms)
+        self._set_parms = frozenset(self._set_parms)
 
         for band in self._tx_bands:
             band.freeze()
+        self._rx_index = BandIndex(self._rx_bands)
+        self._tx_index = BandIndex(self._tx_bands)
+
+    def _merge_bands(self, bands):
+        # Receive ranges may overlap or touch, e.g. general coverage plus
+        # a wider range on some VFO; each frequency is in one band.
+        merged = []
+        for band in sorted(bands, key=lambda band: band.freq_range):
+            (start, end) = band.freq_range
+            if merged and start <= merged[-1].freq_range[1]:
+                last = merged[-1]
+                (last_start, last_end) = last.freq_range
+                last.set_freq_range(last_start, max(last_end, end))
+                last.add_vfos(*band.vfos)
+            else:
+                merged.append(band)
+        return tuple(merged)
+
+    def rx_band(self, freq):
+        """
+        The receive band containing freq, or None. Only once frozen.
+        """
+        return self._rx_index.find(freq)
+
+    def tx_band(self, freq):
+        """
+        The transmit band, with its power limits, containing freq, or
+        None. Only once frozen.
+        """
+        return self._tx_index.find(freq)
 
     @property
     def itu_region(self):
@@ -95,6 +164,30 @@ class Capabilities:
     def vfos(self):
         return self._vfos
 
+    @property
+    def get_levels(self):
+        return self._get_levels
+
+    @property
+    def set_levels(self):
+        return self._set_levels
+
+    @property
+    def get_funcs(self):
+        return self._get_funcs
+
+    @property
+    def set_funcs(self):
+        return self._set_funcs
+
+    @property
+    def get_parms(self):
+        return self._get_parms
+
+    @property
+    def set_parms(self):
+        return self._set_parms
+
 
 def load_rig_definition(rig_def, itu_region):
     cap = Capabilities(itu_region)
@@ -116,6 +209,17 @@ def load_rig_definition(rig_def, itu_region):
     for band in rig_def['tx_bands']:
         cap.add_tx_band(band)
 
+    # Optional, each a list of the names of those the rig can both get
+    # and set, or a dict of 'get' and 'set' lists
+    for (key, add) in (('levels', cap.add_levels), ('funcs', cap.add_funcs),
+                       ('parms', cap.add_parms)):
+        names = rig_def.get(key, ())
+        if isinstance(names, dict):
+            add(*names.get('get', ()), setit=False)
+            add(*names.get('set', ()), getit=False)
+        else:
+            add(*names)
+
     cap.freeze()
     return cap
 
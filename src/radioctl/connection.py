@@ -0,0 +1,120 @@
+from .utils import logging
+
+import asyncio
+
+
+_logger = logging.getLogger('connection')
+
+# Seconds to wait before retrying a port which could not be opened or
+# whose connection was lost; the delay grows by BACKOFF on every failure
+# up to the maximum, and starts over once a connection has stayed up for
+# DEFAULT_STABLE_TIME.
+DEFAULT_MIN_DELAY = 0.5
+DEFAULT_MAX_DELAY = 30.0
+DEFAULT_STABLE_TIME = 10.0
+BACKOFF = 2.0
+
+
+class SerialConnection:
+    """
+    Keeps a rig connected to its serial port.
+
+    When the connection is lost (e.g. the USB adapter drops off the bus)
+    the model is marked offline, which invalidates it, and the port is
+    opened again with exponential backoff until it succeeds. A port which
+    keeps dropping straight after it opens (e.g. a rig switched off
+    behind a live USB adapter) backs off too. Opening the protocol replays the rig's startup commands;
+    once connected the whole model is queried again and marked online.
+    """
+    def __init__(self, rig, serial_port, baudrate, low_latency=False, poll=True,
+                 min_delay=DEFAULT_MIN_DELAY, max_delay=DEFAULT_MAX_DELAY,
+                 stable_time=DEFAULT_STABLE_TIME):
+        self._rig = rig
+        self._serial_port = serial_port
+        self._baudrate = baudrate
+        self._low_latency = low_latency
+        self._poll = poll
+        self._min_delay = min_delay
+        self._max_delay = max_delay
+        self._stable_time = stable_time
+        self._task = None
+        self._closed = None
+        self._connected = None
+        self._started = None
+        self.connects = 0
+        self.failures = 0
+
+    @property
+    def connected(self):
+        return self._closed is not None and not self._closed.done()
+
+    async def wait_connected(self):
+        await self._connected.wait()
+
+    async def wait_started(self):
+        """
+        Wait until the first attempt to open the port has succeeded or
+        failed.
+        """
+        await self._started.wait()
+
+    def start(self, loop):
+        if self._task is None:
+            self._connected = asyncio.Event()
+            self._started = asyncio.Event()
+            self._task = loop.create_task(self._run(loop))
+
+    async def stop(self):
+        """
+        Stop reconnecting and close the connection.
+        """
+        task = self._task
+        if task is None:
+            return
+        self._task = None
+        task.cancel()
+        await asyncio.wait([task])
+        closed = self._closed
+        self._rig.close()
+        if closed is not None:
+            await asyncio.wait([closed])
+            self._closed = None
+
+    async def _run(self, loop):
+        rig = self._rig
+        delay = self._min_delay
+        while True:
+            try:
+                closed = await rig.connect_serial(
+                    loop, self._serial_port, self._baudrate, self._low_latency,
+                    self._poll)
+            except Exception as exc:
+                self.failures += 1
+                rig.model.set_online(False)
+                self._started.set()
+                _logger.warning('Cannot open {}: {}; retrying in {:.1f}s',
+                                self._serial_port, exc, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * BACKOFF, self._max_delay)
+                continue
+
+            self.connects += 1
+            connected_at = loop.time()
+            self._closed = closed
+            _logger.info('Connected to {}', self._serial_port)
+            rig.model.set_online(True)
+            rig.model.query_all()
+            self._connected.set()
+            self._started.set()
+
+            # wait() rather than await, which would cancel the future
+            # along with this task
+            await asyncio.wait([closed])
+            self._connected.clear()
+            rig.model.set_online(False)
+            if loop.time() - connected_at >= self._stable_time:
+                delay = self._min_delay
+            _logger.warning('Lost connection to {}, reconnecting in {:.1f}s',
+                            self._serial_port, delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * BACKOFF, self._max_delay)
@@ -0,0 +1,25 @@
+from enum import IntEnum
+
+
+class Error(IntEnum):
+    OK = 0
+    EINVAL = 1
+    ECONF = 2
+    ENOMEM = 3
+    ENIMPL = 4
+    ETIMEOUT = 5
+    EIO = 6
+    EINTERNAL = 7
+    EPROTO = 8
+    ERJCTED = 9
+    ETRUNC = 10
+    ENAVAIL = 11
+    ENTARGET = 12
+    BUSERROR = 13
+    BUSBUSY = 14
+    EARG = 15
+    EVFO = 16
+    EDOM = 17
+
+    def __str__(self):
+        return self.name
@@ -1,10 +1,23 @@
 from .modes import Mode
+from .rigfunctions import Function
+from .riglevels import Level
+from .rigparms import Parm
 from .vfos import VFO
 from ..utils.bitwise import bit_or
 
+import weakref
+
 
 _rigctld_prot_ver = 0
 
+# Capabilities -> {protocol version: rendered dump_state}. Capabilities
+# are frozen once loaded, so each is rendered at most once per version.
+_dump_state_cache = weakref.WeakKeyDictionary()
+
+
+def _flags(flag_type, names):
+    return bit_or(flag_type[name] for name in names)
+
 
 class BandFormatter:
     def __init__(self, band, modes):
@@ -15,19 +28,15 @@ class BandFormatter:
         return getattr(self._band, name)
 
     def __str__(self):
-        # TODO f-string
         antennas = 0
-        vfos = 0
-        for vfo in self.vfos:
-            vfos |= getattr(VFO, f'VFO{vfo}')
+        vfos = bit_or(VFO[f'VFO{vfo}'] for vfo in self.vfos)
 
         rf_low = int(self.low_power * 1000) # milliwatts
         rf_high = int(self.high_power * 1000) # milliwatts
 
-        return '{:d} {:d} 0x{:x} {:d} {:d} 0x{:x} 0x{:x}'.format(
-            self.freq_range[0], self.freq_range[1], self._modes.value,
-            rf_low, rf_high, vfos.value, antennas)
-    
+        (low, high) = self.freq_range
+        return f'{low:d} {high:d} 0x{self._modes:x} {rf_low:d} {rf_high:d} 0x{vfos:x} 0x{antennas:x}'
+
 
 class CapabilitiesFormatter:
     def __init__(self, caps):
@@ -37,51 +46,85 @@ class CapabilitiesFormatter:
         return getattr(self._caps, name)
 
     def __str__(self):
-        modes = 0
-        for mode in self.modes:
-            modes |= getattr(Mode, mode)
+        modes = _flags(Mode, self.modes)
 
         rxbands = '\n'.join((str(BandFormatter(band, modes)) for band in self.rx_bands))
         txbands = '\n'.join((str(BandFormatter(band, modes)) for band in self.tx_bands))
-        # TODO f-string
+        # TODO filters, tuning steps, rit, xit, ifshift, announces,
+        # preamps and attenuators
         return (
-            '{}\n'
+            f'{_rigctld_prot_ver}\n'
             '2\n' # rigctld
-            '{}\n'
-            '{}\n'
+            f'{self.itu_region}\n'
+            f'{rxbands}\n'
             '0 0 0 0 0 0 0\n'
-            '{}\n'
+            f'{txbands}\n'
             '0 0 0 0 0 0 0\n'
-            #'{}\n' filters
-            '0 0\n'
-            #'{}\n' tuning steps
-            '0 0\n'
-            '{}\n'
-            '{}\n'
-            '{}\n'
-            '{}\n'
-            '{}\n'
-            '{}\n'
-            '0x{:x}\n'
-            '0x{:x}\n'
-            '0x{:x}\n'
-            '0x{:x}\n'
-            '0x{:x}\n'
-            '0x{:x}\n'
-            ).format(
-                _rigctld_prot_ver,
-                self._itu_region,
-                rxbands,
-                txbands,
-                0, #self._max_rit,
-                0, #self._max_xit,
-                0, #self._max_ifshift,
-                0, #self._announces,
-                0, #preamps,
-                0, #attenuators,
-                0, #bit_or(self._get_funcs),
-                0, #bit_or(self._set_funcs),
-                0, #bit_or(self._get_levels),
-                0, #bit_or(self._set_levels),
-                0, #bit_or(self._get_parms),
-                0) #bit_or(self._set_parms))
+            '0 0\n' # tuning steps
+            '0 0\n' # filters
+            '0\n' # max rit
+            '0\n' # max xit
+            '0\n' # max ifshift
+            '0\n' # announces
+            '0\n' # preamps
+            '0\n' # attenuators
+            f'0x{_flags(Function, self.get_funcs):x}\n'
+            f'0x{_flags(Function, self.set_funcs):x}\n'
+            f'0x{_flags(Level, self.get_levels):x}\n'
+            f'0x{_flags(Level, self.set_levels):x}\n'
+            f'0x{_flags(Parm, self.get_parms):x}\n'
+            f'0x{_flags(Parm, self.set_parms):x}\n')
+
+
+class CapsDumpFormatter(CapabilitiesFormatter):
+    """
+    The human readable capabilities of dump_caps.
+    """
+    def __str__(self):
+        def names(values):
+            return ' '.join(sorted(values)) or 'None'
+
+        lines = [
+            f'Mode list: {names(self.modes)}',
+            f'VFO list: {names(f"VFO{vfo}" for vfo in self.vfos)}',
+            'RX ranges:',
+            *(f'\t{band.freq_range[0]} Hz - {band.freq_range[1]} Hz'
+              for band in self.rx_bands),
+            'TX ranges:',
+            *(f'\t{band.freq_range[0]} Hz - {band.freq_range[1]} Hz, '
+              f'{band.low_power} W - {band.high_power} W'
+              for band in self.tx_bands),
+            f'Get functions: {names(self.get_funcs)}',
+            f'Set functions: {names(self.set_funcs)}',
+            f'Get level: {names(self.get_levels)}',
+            f'Set level: {names(self.set_levels)}',
+            f'Get parameters: {names(self.get_parms)}',
+            f'Set parameters: {names(self.set_parms)}',
+        ]
+        return '\n'.join(lines) + '\n'
+
+
+def dump_state(caps, version=_rigctld_prot_ver):
+    """
+    The rigctld dump_state of caps, rendered once and cached.
+    """
+    if version != _rigctld_prot_ver:
+        raise ValueError(f'Unsupported rigctld protocol version: {version}')
+    rendered = _dump_state_cache.setdefault(caps, {})
+    text = rendered.get(version)
+    if text is None:
+        text = rendered[version] = str(CapabilitiesFormatter(caps))
+    return text
+
+
+_dump_caps_cache = weakref.WeakKeyDictionary()
+
+
+def dump_caps(caps):
+    """
+    The dump_caps text of caps, rendered once and cached.
+    """
+    text = _dump_caps_cache.get(caps)
+    if text is None:
+        text = _dump_caps_cache[caps] = str(CapsDumpFormatter(caps))
+    return text
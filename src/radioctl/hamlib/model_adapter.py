@@ -1,8 +1,53 @@
 from .vfos import VFO
+from ..model import DEFAULT_QUERY_TIMEOUT
+
+import asyncio
+import itertools
+
+
+# Model field names -> hamlib names of the values pushed to subscribers
+_PUSH_NAMES = {
+    'frequency': 'freq',
+    'mode': 'mode',
+    'primary_rx_vfo': 'vfo',
+    'primary_tx_vfo': 'split_vfo',
+    'tx': 'ptt',
+    'online': 'online',
+}
+
 
 class HamlibModelAdapter:
-    def __init__(self, model):
+    def __init__(self, model, max_age=0, timeout=DEFAULT_QUERY_TIMEOUT):
         self._model = model
+        self._max_age = max_age
+        self._timeout = timeout
+
+    async def refresh_primary_rx_vfo(self, *fields):
+        await self._refresh_vfo('primary_rx_vfo', fields)
+
+    async def refresh_primary_tx_vfo(self, *fields):
+        await self._refresh_vfo('primary_tx_vfo', fields)
+
+    def check_online(self):
+        if not self._model.online:
+            raise ConnectionError('Rig not connected')
+
+    async def _refresh_vfo(self, selector, fields):
+        # Refresh the VFO selection and the fields of the currently selected
+        # VFO together so both queries share a write; only if the selection
+        # changed does the newly selected VFO need a second round trip.
+        self.check_online()
+        model = self._model
+        if not fields:
+            await model.refresh(selector, max_age=self._max_age, timeout=self._timeout)
+            return
+        vfo = getattr(model, selector)
+        await asyncio.gather(
+            model.refresh(selector, max_age=self._max_age, timeout=self._timeout),
+            vfo.refresh(*fields, max_age=self._max_age, timeout=self._timeout))
+        selected = getattr(model, selector)
+        if selected is not vfo:
+            await selected.refresh(*fields, max_age=self._max_age, timeout=self._timeout)
 
     @property
     def primary_rx_vfo_frequency(self):
@@ -10,6 +55,7 @@ class HamlibModelAdapter:
 
     @primary_rx_vfo_frequency.setter
     def primary_rx_vfo_frequency(self, frequency):
+        self.check_online()
         self._model.primary_rx_vfo.frequency = frequency
 
     @property
@@ -18,18 +64,85 @@ class HamlibModelAdapter:
 
     @primary_rx_vfo_mode.setter
     def primary_rx_vfo_mode(self, mode):
+        self.check_online()
         self._model.primary_rx_vfo.mode = mode
 
     @property
     def primary_rx_vfo_name(self):
-        vfo_name = 'VFO{}'.format(self._model.primary_rx_vfo.name)
+        return self._vfo_name(self._model.primary_rx_vfo)
+
+    @primary_rx_vfo_name.setter
+    def primary_rx_vfo_name(self, value):
+        self.check_online()
+        self._model.primary_rx_vfo = self._model_vfo_name(value)
+
+    @property
+    def primary_tx_vfo_frequency(self):
+        return self._model.primary_tx_vfo.frequency
+
+    @primary_tx_vfo_frequency.setter
+    def primary_tx_vfo_frequency(self, frequency):
+        self.check_online()
+        self._model.primary_tx_vfo.frequency = frequency
+
+    @property
+    def primary_tx_vfo_mode(self):
+        return self._model.primary_tx_vfo.mode
+
+    @primary_tx_vfo_mode.setter
+    def primary_tx_vfo_mode(self, mode):
+        self.check_online()
+        self._model.primary_tx_vfo.mode = mode
+
+    @property
+    def primary_tx_vfo_name(self):
+        return self._vfo_name(self._model.primary_tx_vfo)
+
+    @primary_tx_vfo_name.setter
+    def primary_tx_vfo_name(self, value):
+        self.check_online()
+        self._model.primary_tx_vfo = self._model_vfo_name(value)
+
+    def push_values(self, diff=None):
+        """
+        Translate a MODEL_UPDATED diff, or the whole model if diff is
+        None, into (name, vfo, value) triples in hamlib terms, e.g.
+        ('freq', 'VFOA', 7074000) or ('ptt', None, 1).
+        """
+        model = self._model
+        if diff is None:
+            items = itertools.chain(
+                (('online', model.online),),
+                ((name, field.value) for (name, field, query) in model.fields()))
+        else:
+            items = ((name, new) for (name, (old, new)) in diff.items())
+        for (name, value) in items:
+            (vfo, _, field) = name.rpartition('.')
+            push_name = _PUSH_NAMES.get(field)
+            if push_name is None:
+                continue
+            if vfo:
+                vfo = self._vfo_name(model.get_vfo_by_name(vfo))
+            else:
+                vfo = None
+                if field in ('tx', 'online'):
+                    value = int(value)
+                else:
+                    value = self._vfo_name(model.get_vfo(value))
+            if field == 'mode':
+                value = str(value)
+            yield (push_name, vfo, value)
+
+    @staticmethod
+    def _vfo_name(vfo):
+        vfo_name = 'VFO{}'.format(vfo.name)
         if not hasattr(VFO, vfo_name):
             raise KeyError(f'No HamLib VFO named: {vfo_name}')
         return vfo_name
 
-    @primary_rx_vfo_name.setter
-    def primary_rx_vfo_name(self, value):
+    @staticmethod
+    def _model_vfo_name(value):
         value = value.upper()
         if len(value) > len('VFO') and value.startswith('VFO'):
             value = value[3:]
-        self._model.primary_rx_vfo = value
+        return value
@@ -0,0 +1,15 @@
+from enum import IntFlag
+
+
+class Parm(IntFlag):
+    ANN = (1<<0)
+    APO = (1<<1)
+    BACKLIGHT = (1<<2)
+    BEEP = (1<<4)
+    TIME = (1<<5)
+    BAT = (1<<6)
+    KEYLIGHT = (1<<7)
+    SCREENSAVER = (1<<8)
+
+    def __str__(self):
+        return self.name
@@ -1,15 +1,44 @@
-from .formatters import CapabilitiesFormatter
+from .errors import Error
+from .formatters import dump_caps, dump_state
 from .model_adapter import HamlibModelAdapter
 from .ptt import PTT
 from .vfos import VFO
 
+from radioctl.model import DEFAULT_QUERY_TIMEOUT
+from radioctl.msgbus import MsgType
 from radioctl.utils import logging
 
 import asyncio
+import contextvars
+import functools
+import inspect
+import itertools
+import json
 
 
 _logger = logging.getLogger('rigctld')
 
+# Values reported by the rig within this many seconds are answered from
+# the model without querying the rig again.
+DEFAULT_MAX_AGE = 0.5
+
+# Commands started ahead of the oldest one still waiting for the rig
+PIPELINE_DEPTH = 32
+
+# Formats of the \subscribe extension
+PUSH_FORMATS = ('hamlib', 'json')
+
+
+class NotAvailable(Exception):
+    """
+    The command does not apply to this session, answered with
+    -RIG_ENAVAIL.
+    """
+
+
+# The replies of the command running in the current task
+_output = contextvars.ContextVar('output', default=None)
+
 
 _cmd_map = {
     'F' : 'set_freq',
@@ -138,107 +167,373 @@ _cmd_args = {
     'recv_dtmf' : 0,
     'get_info' : 0,
     'dump_caps' : 0,
-    'power2mW' : 0,
-    'mW2power' : 0,
+    'power2mW' : 3,
+    'mW2power' : 3,
     'send_cmd' : 0,
+    'subscribe' : 1,
+    'unsubscribe' : 0,
+    'set_rig' : 1,
+    'get_rig' : 0,
+}
+
+
+# Short and long command names -> (long name, number of arguments)
+_commands = {name: (name, argcount) for (name, argcount) in _cmd_args.items()}
+_commands.update((char, (name, _cmd_args.get(name, 0)))
+                 for (char, name) in _cmd_map.items())
+
+_unknown = ('unknown', 0)
+
+# A line starting with one of these asks for extended responses, in which
+# each value is labelled and every command is answered with RPRT; the
+# character separates the lines of a response ('+' meaning newline).
+EXTENDED_SEPARATORS = {'+': '\n', ';': ';', '|': '|', ',': ','}
+
+# Commands which answer nothing but RPRT, besides the set_ ones
+_acknowledged = frozenset({'subscribe', 'unsubscribe', 'send_morse',
+                           'cancel_morse', 'morse_speed'})
+
+# Labels of the values in extended responses
+_value_labels = {
+    'get_freq': ('Frequency',),
+    'get_mode': ('Mode', 'Passband'),
+    'get_vfo': ('VFO',),
+    'get_split_freq': ('TX Frequency',),
+    'get_split_mode': ('TX Mode', 'TX Passband'),
+    'get_split_vfo': ('Split', 'TX VFO'),
+    'get_ptt': ('PTT',),
+    'power2mW': ('Power mW',),
+    'mW2power': ('Power [0.0..1.0]',),
 }
 
 
+def split_response_mode(cmdline):
+    """
+    Returns (separator, commands) for a command line, separator being
+    None unless the line asks for extended responses.
+    """
+    separator = EXTENDED_SEPARATORS.get(cmdline[0:1])
+    if separator is not None:
+        cmdline = cmdline[1:]
+    return (separator, cmdline)
+
+
 def parse_command(cmdline):
+    """
+    Yields (name, *args) for each command of a line, e.g. 'F 7074000 mv'
+    is set_freq 7074000, get_mode, get_vfo. Short commands without
+    arguments may be run together ('fmv'); only the last of a run takes
+    arguments.
+    """
     if cmdline.startswith('b'): # special case for morse code
         yield ('send_morse', cmdline[1:].strip())
         return
+    if cmdline.startswith('\\send_morse '):
+        yield ('send_morse', cmdline[len('\\send_morse '):].strip())
+        return
 
-    cmdfields = cmdline.split()
+    fields = cmdline.split()
+    count = len(fields)
+    pos = 0
 
-    while cmdfields:
-        if cmdfields[0][0] == '\\':
-            cmd = cmdfields.pop(0).lstrip('\\')
+    while pos < count:
+        token = fields[pos]
+        pos += 1
+        if token[0] == '\\':
+            name = token[1:]
+            (cmd, argcount) = _commands.get(name, (name, 0))
         else:
-            cmds = []
-            for c in cmdfields.pop(0): # each char
-                # TODO allow "F 7074000 mv"
-                cmds.append(_cmd_map.get(c, 'unknown'))
-            while cmds:
-                cmd = cmds.pop(0)
-                if len(cmds) > 0:
-                    yield (cmd,)
+            for c in token[:-1]:
+                yield (_commands.get(c, _unknown)[0],)
+            (cmd, argcount) = _commands.get(token[-1], _unknown)
+        yield (cmd, *fields[pos:pos + argcount])
+        pos += argcount
 
-        argcount = _cmd_args.get(cmd, 0)
-        args = cmdfields[0:argcount]
-        yield (cmd, *args)
-        cmdfields = cmdfields[argcount:]
+
+def _cancel_on_error(task, future):
+    if not future.cancelled() and future.exception() is not None:
+        task.cancel()
 
 
 class Session:
-    def __init__(self, rig, stream_reader, stream_writer):
-        self._capabilities = rig.capabilities
-        self._model = HamlibModelAdapter(rig.model)
+    """
+    One rigctld client.
+
+    Besides the hamlib commands a session accepts the extension
+    "\\subscribe [hamlib|json]", after which changes to the model are
+    pushed to the client as they are reported by the rig, starting with
+    the current state ahead of its RPRT, so the client need not poll. In hamlib format each
+    value is a line "!<name> [<vfo>] <value>", e.g. "!freq VFOA 7074000"
+    or "!ptt 1"; in json format each update is one line holding an
+    object, e.g. {"freq": {"VFOA": 7074000}, "ptt": 1}. Names are freq,
+    mode, vfo, split_vfo, ptt and online, which is 0 while the rig is
+    disconnected. "\\unsubscribe" stops the updates.
+
+    A session given several rigs (name -> Rig) starts on the first and
+    accepts "\\set_rig <name>" to direct the following commands, and
+    any subscription, to another; "\\get_rig" names the current one, and
+    answers -RIG_ENAVAIL when the session has a single, unnamed rig.
+    """
+    def __init__(self, rig, stream_reader, stream_writer,
+                 max_age=DEFAULT_MAX_AGE, timeout=DEFAULT_QUERY_TIMEOUT,
+                 rigs=None):
+        self._max_age = max_age
+        self._timeout = timeout
+        self._rigs = rigs or {}
+        self._rig_name = next((name for (name, r) in self._rigs.items()
+                               if r is rig), None)
+        self._push_format = None
         self._running = False
         self._stream_reader = stream_reader
         self._stream_writer = stream_writer
+        self._in_flight = set()
+        self._bind(rig)
+
+    def _bind(self, rig):
+        self._capabilities = rig.capabilities
+        self._model = HamlibModelAdapter(rig.model, self._max_age, self._timeout)
+        self._msgbus = rig.msgbus
+        self._model_updated = rig.msgbus[MsgType.MODEL_UPDATED]
 
     def _send(self, msg):
+        # Replies are collected per command and written in order by
+        # _write_replies(); outside a command they are written at once.
+        output = _output.get()
+        if output is None:
+            self._write(msg)
+        else:
+            output.append(msg)
+
+    def _write(self, msg):
         _logger.debug('Sending [{}]', msg.rstrip('\n'))
         self._stream_writer.write(msg.encode())
 
     async def run(self):
+        """
+        Serve the client until it disconnects or quits.
+
+        Commands are pipelined: each is started as soon as it is read,
+        up to PIPELINE_DEPTH ahead of the oldest unanswered one, so the
+        queries of a burst of commands reach the rig together. Replies
+        are written in command order, every reply that is ready in one
+        write, and the session waits for the client to drain them
+        before writing more.
+        """
         _logger.debug('New session')
         self._running = True
-        while self._running:
-            line = await self._stream_reader.readline()
-            if not line:
-                break
-
-            try:
-                line = line.decode('latin_1').strip()
-            except:
-                _logger.exception('Failed decoding while reading from rigctld')
-                continue
-
-            _logger.debug('Command(s) received: {}', line)
+        pending = asyncio.Queue(PIPELINE_DEPTH)
+        writer = asyncio.ensure_future(self._write_replies(pending))
+        # A writer that fails must not leave the reader waiting for room
+        writer.add_done_callback(functools.partial(_cancel_on_error,
+                                                   asyncio.current_task()))
+        try:
+            while self._running and not writer.done():
+                line = await self._stream_reader.readline()
+                if not line:
+                    break
 
-            for cmd in parse_command(line):
                 try:
-                    _logger.debug('Dispatch command: {}', cmd)
-                    cmd_func = getattr(self, 'cmd_{}'.format(cmd[0]), None)
-                    if cmd_func:
-                        await cmd_func(*cmd[1:])
-                    else:
-                        raise NotImplementedError
-
-                    if cmd[0].startswith('set'):
-                        self._send('RPRT 0\n')
-                except Exception:
-                    _logger.exception('Command Error:')
-                    self._send('RPRT -1\n')
-
+                    line = line.decode('latin_1').strip()
+                except:
+                    _logger.exception('Failed decoding while reading from rigctld')
+                    continue
+
+                _logger.debug('Command(s) received: {}', line)
+
+                (separator, line) = split_response_mode(line)
+                for cmd in parse_command(line):
+                    if cmd[0] == 'set_rig' and self._in_flight:
+                        # the commands before it finish on their rig
+                        await asyncio.wait(self._in_flight)
+                    output = []
+                    token = _output.set(output)
+                    task = asyncio.ensure_future(self._execute(cmd, separator))
+                    _output.reset(token)
+                    self._in_flight.add(task)
+                    task.add_done_callback(self._in_flight.discard)
+                    await pending.put((task, output))
+                    if cmd[0] == 'quit':
+                        self._running = False
+                        break
+            await pending.put((None, None))
+            await writer
+        except (ConnectionError, asyncio.CancelledError):
+            _logger.debug('Connection lost')
+        finally:
+            writer.cancel()
+            while not pending.empty():
+                (task, output) = pending.get_nowait()
+                if task is not None:
+                    task.cancel()
+            self._unsubscribe()
         _logger.debug('Disconnect')
 
+    async def _execute(self, cmd, separator=None):
+        (name, *args) = cmd
+        code = 0
+        try:
+            _logger.debug('Dispatch command: {}', cmd)
+            cmd_func = self._handlers.get(name)
+            if cmd_func is None:
+                raise NotImplementedError
+            await cmd_func(self, *args)
+        except asyncio.TimeoutError:
+            _logger.warning('Timed out waiting for rig: {}', cmd)
+            code = -Error.ETIMEOUT
+        except ValueError:
+            _logger.warning('Invalid arguments: {}', cmd)
+            code = -Error.EINVAL
+        except ConnectionError:
+            _logger.warning('Rig not connected: {}', cmd)
+            code = -Error.EIO
+        except NotAvailable as e:
+            _logger.warning('Not available: {}: {}', cmd, e)
+            code = -Error.ENAVAIL
+        except Exception:
+            _logger.exception('Command Error:')
+            code = -1
+
+        if separator is not None:
+            self._send_extended(name, args, separator, code)
+        elif code or name.startswith('set') or name in _acknowledged:
+            self._send(f'RPRT {code}\n')
+
+    def _send_extended(self, name, args, separator, code):
+        # Relabel the plain response the command produced
+        output = _output.get()
+        lines = ''.join(output).splitlines() if output else []
+        if output:
+            output.clear()
+        labels = _value_labels.get(name, ())
+        parts = [' '.join((f'{name}:', *args))]
+        for (label, line) in itertools.zip_longest(labels, lines):
+            if line is not None:
+                parts.append(f'{label}: {line}' if label else line)
+        parts.append(f'RPRT {code}')
+        self._send(separator.join(parts) + '\n')
+
+    async def _write_replies(self, pending):
+        replies = []
+        while True:
+            (task, output) = await pending.get()
+            if task is None:
+                break
+            if replies and not task.done():
+                await self._flush(replies)
+            await task
+            replies.extend(output)
+            if pending.empty():
+                await self._flush(replies)
+        await self._flush(replies)
+
+    async def _flush(self, replies):
+        if replies:
+            self._write(''.join(replies))
+            replies.clear()
+            await self._stream_writer.drain()
+
     async def cmd_quit(self):
-        self._running = False
+        pass
+
+    async def cmd_subscribe(self, push_format='hamlib'):
+        if push_format not in PUSH_FORMATS:
+            raise ValueError(f'Unknown push format: {push_format}')
+        self._subscribe(push_format)
+        # the current state, ahead of the RPRT
+        self._send(self._format_push(None))
+
+    async def cmd_unsubscribe(self):
+        self._unsubscribe()
+
+    def _subscribe(self, push_format):
+        self._push_format = push_format
+        self._model_updated.connect(self._push)
+
+    def _unsubscribe(self):
+        if self._push_format is not None:
+            self._model_updated.disconnect(self._push)
+            self._push_format = None
+
+    def _push(self, diff):
+        # Pushes bypass the replies of the running command, if any.
+        msg = self._format_push(diff)
+        if msg:
+            self._write(msg)
+
+    def _format_push(self, diff):
+        try:
+            values = list(self._model.push_values(diff))
+        except KeyError:
+            _logger.exception('Cannot push model update: {}', diff)
+            return ''
+        if self._push_format == 'json':
+            update = {}
+            for (name, vfo, value) in values:
+                if vfo is None:
+                    update[name] = value
+                else:
+                    update.setdefault(name, {})[vfo] = value
+            return json.dumps(update) + '\n' if update else ''
+        return ''.join(f'!{name} {vfo} {value}\n' if vfo else f'!{name} {value}\n'
+                       for (name, vfo, value) in values)
+
+    async def cmd_set_rig(self, name):
+        rig = self._rigs.get(name)
+        if rig is None:
+            raise ValueError(f'No rig named: {name}')
+        push_format = self._push_format
+        self._unsubscribe()
+        self._bind(rig)
+        self._rig_name = name
+        if push_format is not None:
+            # the state of the new rig, ahead of the RPRT
+            self._subscribe(push_format)
+            self._send(self._format_push(None))
+
+    async def cmd_get_rig(self):
+        if self._rig_name is None:
+            raise NotAvailable('rigs are not named on a single rig server')
+        self._send(f'{self._rig_name}\n')
 
     async def cmd_chk_vfo(self):
         self._send('CHKVFO 0\n')
 
     async def cmd_dump_state(self):
-        caps = CapabilitiesFormatter(self._capabilities)
-        self._send(str(caps))
+        self._send(dump_state(self._capabilities))
+
+    async def cmd_dump_caps(self):
+        self._send(dump_caps(self._capabilities))
 
     async def cmd_get_freq(self):
+        await self._model.refresh_primary_rx_vfo('frequency')
         freq = self._model.primary_rx_vfo_frequency
         self._send('{:d}\n'.format(freq))
 
     async def cmd_set_freq(self, freq):
-        self._model.primary_rx_vfo_frequency = int(float(freq))
+        self._model.primary_rx_vfo_frequency = self._tunable(freq)
+
+    def _tunable(self, freq):
+        # rejected here rather than sent for the rig to ignore
+        freq = int(float(freq))
+        if self._capabilities.rx_band(freq) is None:
+            raise ValueError(f'Frequency out of range: {freq}')
+        return freq
+
+    def _tx_band(self, freq):
+        freq = int(float(freq))
+        band = self._capabilities.tx_band(freq)
+        if band is None:
+            raise ValueError(f'Not a transmit frequency: {freq}')
+        return band
 
     async def cmd_get_mode(self):
+        await self._model.refresh_primary_rx_vfo('mode')
         mode = self._model.primary_rx_vfo_mode
         self._send(f'{mode}\n0\n')
 
     async def cmd_set_mode(self, mode, passband):
         if mode == '?':
-            modes = self.capabilities.modes
+            modes = self._capabilities.modes
             modes = ' '.join((str(mode) for mode in modes))
             self._send(f'{modes}\n')
         else:
@@ -247,19 +542,21 @@ class Session:
             #TODO passband
 
     async def cmd_get_split_freq(self):
+        await self._model.refresh_primary_tx_vfo('frequency')
         freq = self._model.primary_tx_vfo_frequency
         self._send('{:d}\n'.format(freq))
 
     async def cmd_set_split_freq(self, freq):
-        self._model.primary_tx_vfo_frequency = int(float(freq))
+        self._model.primary_tx_vfo_frequency = self._tunable(freq)
 
     async def cmd_get_split_mode(self):
+        await self._model.refresh_primary_tx_vfo('mode')
         mode = self._model.primary_tx_vfo_mode
         self._send(f'{mode}\n0\n')
 
     async def cmd_set_split_mode(self, mode, passband):
         if mode == '?':
-            modes = self.capabilities.modes
+            modes = self._capabilities.modes
             modes = ' '.join((str(mode) for mode in modes))
             self._send(f'{modes}\n')
         else:
@@ -268,13 +565,17 @@ class Session:
             #TODO passband
 
     async def cmd_get_split_vfo(self):
+        await asyncio.gather(self._model.refresh_primary_rx_vfo(),
+                             self._model.refresh_primary_tx_vfo())
         vfo = self._model.primary_tx_vfo_name
-        self._send(f'{vfo}\n')
+        split = int(vfo != self._model.primary_rx_vfo_name)
+        self._send(f'{split}\n{vfo}\n')
 
     async def cmd_set_split_vfo(self, onoff, vfo):
         self._model.primary_tx_vfo_name = vfo
 
     async def cmd_get_vfo(self):
+        await self._model.refresh_primary_rx_vfo()
         vfo = self._model.primary_rx_vfo_name
         self._send(f'{vfo}\n')
 
@@ -282,13 +583,30 @@ class Session:
         self._model.primary_rx_vfo_name = vfo
 
     async def cmd_send_morse(self, buf):
-        self.rigproto.send_morse(buf)
+        self._model.check_online()
+        self._msgbus[MsgType.MORSE_SEND](buf)
 
     async def cmd_cancel_morse(self):
-        self.rigproto.cancel_morse()
+        self._model.check_online()
+        self._msgbus[MsgType.MORSE_CANCEL]()
 
     async def cmd_morse_speed(self, speed):
-        self.rigproto.morse_speed(speed)
+        self._model.check_online()
+        self._msgbus[MsgType.KEYER_SPEED_SET](int(speed))
+
+    async def cmd_power2mW(self, power, freq, mode):
+        power = float(power)
+        if not 0 <= power <= 1:
+            raise ValueError(f'Power out of range: {power}')
+        max_mw = self._tx_band(freq).high_power * 1000
+        self._send(f'{int(power * max_mw):d}\n')
+
+    async def cmd_mW2power(self, mw, freq, mode):
+        mw = int(mw)
+        if mw < 0:
+            raise ValueError(f'Power out of range: {mw}')
+        max_mw = self._tx_band(freq).high_power * 1000
+        self._send(f'{min(1.0, mw / max_mw):f}\n')
 
     async def cmd_set_powerstat(self, val):
         self.rigproto.set_powerstate(int(val))
@@ -305,18 +623,36 @@ class Session:
         self.rigproto.set_ptt(pttflag)
 
 
+def _handlers(cls):
+    # cmd_* coroutine functions by command name, looked up once per class
+    return {name[4:]: func for (name, func) in inspect.getmembers(cls)
+            if name.startswith('cmd_')}
+
+
+Session._handlers = _handlers(Session)
+
+
 class Server:
-    def __init__(self, rig):
+    """
+    Serves one rig, or with rigs (name -> Rig) all of them, starting
+    each session on rig and letting it switch with \\set_rig.
+    """
+    def __init__(self, rig, max_age=DEFAULT_MAX_AGE, timeout=DEFAULT_QUERY_TIMEOUT,
+                 rigs=None):
         self._rig = rig
+        self._max_age = max_age
+        self._timeout = timeout
+        self._rigs = rigs
 
-    async def start(self, host='127.0.0.1', port=4532, loop=None):
-        _logger.info('TCP server started on {}:{}', host, port)
-        await asyncio.start_server(
+    async def start(self, host='127.0.0.1', port=4532):
+        server = await asyncio.start_server(
             self.handle_new_connection,
             host,
-            port,
-            loop=loop)
+            port)
+        _logger.info('TCP server started on {}:{}', host, port)
+        return server
 
     def handle_new_connection(self, stream_reader, stream_writer):
-        session = Session(self._rig, stream_reader, stream_writer)
+        session = Session(self._rig, stream_reader, stream_writer,
+                          self._max_age, self._timeout, self._rigs)
         asyncio.Task(session.run())
@@ -2,32 +2,140 @@ from .hamlib.modes import Mode
 from .hamlib.ptt import PTT
 from .msgbus import MsgBus, MsgType
 
+import asyncio
+import functools
 import logging
+import time
+
+
+DEFAULT_QUERY_TIMEOUT = 1.0
+
+
+class Field:
+    """
+    A single value of the model along with the time it was last reported
+    by the rig, the time a client last asked for it and the futures
+    waiting for the next report. changed(old, new) is called when a
+    report carries a different value.
+    """
+    __slots__ = ['value', 'timestamp', 'read_timestamp', 'changed', '_waiters']
+
+    def __init__(self, value, changed=None):
+        self.value = value
+        self.timestamp = None
+        self.read_timestamp = None
+        self.changed = changed
+        self._waiters = []
+
+    @property
+    def age(self):
+        if self.timestamp is None:
+            return float('inf')
+        return time.monotonic() - self.timestamp
+
+    def is_fresh(self, max_age):
+        return self.age <= max_age
+
+    def invalidate(self):
+        """
+        Forget when the value was reported, e.g. after asking the rig to
+        change it, so the next refresh() queries the rig.
+        """
+        self.timestamp = None
+
+    def update(self, value):
+        """
+        Record a report from the rig. Returns True if the value changed;
+        a repeated value only refreshes the timestamp.
+        """
+        old = self.value
+        self.timestamp = time.monotonic()
+        changed = value != old
+        if changed:
+            self.value = value
+            if self.changed is not None:
+                self.changed(old, value)
+        waiters = self._waiters
+        if waiters:
+            self._waiters = []
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(value)
+        return changed
+
+    def wait(self):
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters = [w for w in self._waiters if not w.done()]
+        self._waiters.append(waiter)
+        return waiter
+
+
+async def _refresh(fields, queries, names, max_age, timeout):
+    waiters = []
+    now = time.monotonic()
+    for name in names:
+        field = fields[name]
+        field.read_timestamp = now
+        if not field.is_fresh(max_age):
+            waiters.append(field.wait())
+            queries[name]()
+    if waiters:
+        await asyncio.wait_for(asyncio.gather(*waiters), timeout)
+
 
 class VFO:
-    def __init__(self, index, name):
+    def __init__(self, index, name, changed=None):
         self._index = index
         self._name = name
-        self._frequency = 0
-        self._mode = Mode.CW
-        self._queries = []
+        self._fields = {
+            'frequency': Field(0),
+            'mode': Field(Mode.CW),
+        }
+        if changed is not None:
+            for (field_name, field) in self._fields.items():
+                field.changed = functools.partial(
+                    changed, f'{name}.{field_name}')
+        self._queries = {}
         self._freq_set = None
         self._mode_set = None
 
     def __str__(self):
-        return f'VFO-{self._name} {self._frequency} {self._mode}'
+        return f'VFO-{self._name} {self.frequency} {self.mode}'
 
     def register_signals(self, msgbus):
-        msgbus[MsgType.VFO_FREQUENCY_RESULT].connect(self.__update_frequency)
-        msgbus[MsgType.VFO_MODE_RESULT].connect(self.__update_mode)
-        self._queries.append(msgbus[MsgType.VFO_FREQUENCY_QUERY])
-        self._queries.append(msgbus[MsgType.VFO_MODE_QUERY])
+        index = self._index
+        msgbus[MsgType.VFO_FREQUENCY_RESULT, index].connect(self.__update_frequency)
+        msgbus[MsgType.VFO_MODE_RESULT, index].connect(self.__update_mode)
+        self._queries['frequency'] = functools.partial(
+            msgbus[MsgType.VFO_FREQUENCY_QUERY], self._index)
+        self._queries['mode'] = functools.partial(
+            msgbus[MsgType.VFO_MODE_QUERY], self._index)
         self._freq_set = msgbus[MsgType.VFO_FREQUENCY_SET]
         self._mode_set = msgbus[MsgType.VFO_MODE_SET]
 
     def query_all(self):
-        for query in self._queries:
-            query(index=self._index)
+        for query in self._queries.values():
+            query()
+
+    def fields(self):
+        """
+        (name, Field, query) for each field, for the poller.
+        """
+        for (name, field) in self._fields.items():
+            yield (name, field, self._queries[name])
+
+    def timestamp(self, field):
+        return self._fields[field].timestamp
+
+    async def refresh(self, *fields, max_age=0, timeout=DEFAULT_QUERY_TIMEOUT):
+        """
+        Query the named fields (frequency, mode; all of them if none are
+        given) unless they were reported within the last max_age seconds,
+        and wait for the rig to answer. Raises asyncio.TimeoutError if it
+        does not answer within timeout seconds.
+        """
+        await _refresh(self._fields, self._queries, fields or self._fields,
+                       max_age, timeout)
 
     @property
     def index(self):
@@ -39,61 +147,102 @@ class VFO:
 
     @property
     def frequency(self):
-        return self._frequency
+        return self._fields['frequency'].value
 
     @frequency.setter
     def frequency(self, freq):
+        self._fields['frequency'].invalidate()
         self._freq_set(self._index, freq)
 
     @property
     def mode(self):
-        return self._mode
+        return self._fields['mode'].value
 
     @mode.setter
     def mode(self, mode):
+        self._fields['mode'].invalidate()
         self._mode_set(self._index, mode)
 
     def __update_frequency(self, index, frequency):
-        if index == self._index:
-            self._frequency = frequency
+        self._fields['frequency'].update(frequency)
 
     def __update_mode(self, index, mode):
-        if index == self._index:
-            self._mode = mode
+        self._fields['mode'].update(mode)
 
 
 class Model:
+    """
+    The state of the rig as last reported.
+
+    Reports which repeat a value are not published. Changes made within
+    one pass of the event loop are coalesced into a single MODEL_UPDATED
+    message carrying a dict of field name (as in fields()) to (old, new)
+    value; a field changed and changed back within the pass is left out.
+    """
     def __init__(self):
         self._vfos = []
         self._vfos_by_name = {}
-        self._tx = PTT.RX
+        self._fields = {
+            'tx': Field(PTT.RX),
+            'primary_rx_vfo': Field(0),
+            'primary_tx_vfo': Field(0),
+        }
+        for (name, field) in self._fields.items():
+            field.changed = functools.partial(self._changed, name)
         self._tx_signal = None
-        self._queries = []
-        self._primary_rx_vfo = 0
-        self._primary_tx_vfo = 0
+        self._rx_signal = None
+        self._queries = {}
+        self._updated = None
+        self._diff = {}
+        self._flush_handle = None
+        self._online = True
 
     def register_signals(self, msgbus):
+        self._updated = msgbus[MsgType.MODEL_UPDATED]
         msgbus[MsgType.TRANSMIT_RESULT].connect(self.__update_tx)
+        msgbus[MsgType.RECEIVE_RESULT].connect(self.__update_rx)
         msgbus[MsgType.RX_VFO_RESULT].connect(self.__update_rx_vfo)
         msgbus[MsgType.TX_VFO_RESULT].connect(self.__update_tx_vfo)
         self._tx_signal = msgbus[MsgType.TRANSMIT_SET]
+        self._rx_signal = msgbus[MsgType.RECEIVE_SET]
         self._rx_vfo_signal = msgbus[MsgType.RX_VFO_SET]
         self._tx_vfo_signal = msgbus[MsgType.TX_VFO_SET]
-        self._queries.append(msgbus[MsgType.TRANSMIT_QUERY])
-        self._queries.append(msgbus[MsgType.RX_VFO_QUERY])
-        self._queries.append(msgbus[MsgType.TX_VFO_QUERY])
+        self._queries['tx'] = msgbus[MsgType.TRANSMIT_QUERY]
+        self._queries['primary_rx_vfo'] = msgbus[MsgType.RX_VFO_QUERY]
+        self._queries['primary_tx_vfo'] = msgbus[MsgType.TX_VFO_QUERY]
         for vfo in self._vfos:
             vfo.register_signals(msgbus)
 
     def query_all(self):
-        for query in self._queries:
+        for query in self._queries.values():
             query()
         for vfo in self._vfos:
             vfo.query_all()
 
+    def fields(self):
+        """
+        (name, Field, query) for each field of the model and of its VFOs,
+        whose fields are named after the VFO, e.g. 'A.frequency'.
+        """
+        for (name, field) in self._fields.items():
+            yield (name, field, self._queries[name])
+        for vfo in self._vfos:
+            for (name, field, query) in vfo.fields():
+                yield (f'{vfo.name}.{name}', field, query)
+
+    async def refresh(self, *fields, max_age=0, timeout=DEFAULT_QUERY_TIMEOUT):
+        """
+        Query the named model fields (tx, primary_rx_vfo, primary_tx_vfo;
+        all of them if none are given) unless they were reported within
+        the last max_age seconds, and wait for the rig to answer. VFO
+        fields are refreshed through VFO.refresh().
+        """
+        await _refresh(self._fields, self._queries, fields or self._fields,
+                       max_age, timeout)
+
     def add_vfo(self, name):
         index = len(self._vfos)
-        vfo = VFO(index, name)
+        vfo = VFO(index, name, self._changed)
         self._vfos.append(vfo)
         self._vfos_by_name[name] = vfo
         return vfo
@@ -106,47 +255,103 @@ class Model:
 
     @property
     def tx(self):
-        return self._tx
+        return self._fields['tx'].value
 
     @tx.setter
     def tx(self, value):
         assert(value is not None)
         assert(self._rx_signal)
         assert(self._tx_signal)
+        self._fields['tx'].invalidate()
         if value:
             self._tx_signal(value)
-            self._tx = value
         else:
             self._rx_signal(value)
-            self._tx = value
+
+    def timestamp(self, field):
+        return self._fields[field].timestamp
 
     @property
     def primary_rx_vfo(self):
-        return self._vfos[self._primary_rx_vfo]
+        return self._vfos[self._fields['primary_rx_vfo'].value]
 
     @primary_rx_vfo.setter
     def primary_rx_vfo(self, value):
         if type(value) is not int:
             value = self._vfos_by_name[value].index
+        self._fields['primary_rx_vfo'].invalidate()
         self._rx_vfo_signal(index=value)
 
     @property
     def primary_tx_vfo(self):
-        return self._vfos[self._primary_tx_vfo]
+        return self._vfos[self._fields['primary_tx_vfo'].value]
 
     @primary_tx_vfo.setter
     def primary_tx_vfo(self, value):
         if type(value) is not int:
             value = self._vfos_by_name[value].index
+        self._fields['primary_tx_vfo'].invalidate()
         self._tx_vfo_signal(index=value)
 
-    def __update_tx(self, value):
-        self._tx = value
+    @property
+    def online(self):
+        """
+        False while the connection to the rig is down, when the values
+        are only the last known ones.
+        """
+        return self._online
+
+    def set_online(self, online):
+        """
+        Record whether the rig is connected. Going offline invalidates
+        every field, so nothing is answered from the model until the rig
+        reports it again. The change is published in MODEL_UPDATED as
+        'online'.
+        """
+        if online == self._online:
+            return
+        self._online = online
+        if not online:
+            for (name, field, query) in self.fields():
+                field.invalidate()
+        self._changed('online', not online, online)
+
+    def _changed(self, name, old, new):
+        diff = self._diff
+        if name in diff:
+            old = diff[name][0]
+            if old == new:
+                del diff[name]
+                return
+        diff[name] = (old, new)
+        if self._flush_handle is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self._flush()
+                return
+            self._flush_handle = loop.call_soon(self._flush)
+
+    def _flush(self):
+        self._flush_handle = None
+        diff = self._diff
+        if not diff:
+            return
+        self._diff = {}
+        if self._updated is not None:
+            self._updated(diff)
+
+    def __update_tx(self, value=PTT.TX):
+        # Kenwood style rigs answer TX; and RX; without a value
+        self._fields['tx'].update(value)
+
+    def __update_rx(self):
+        self._fields['tx'].update(PTT.RX)
 
     def __update_rx_vfo(self, value):
-        self._primary_rx_vfo = value
+        self._fields['primary_rx_vfo'].update(value)
 
     def __update_tx_vfo(self, value):
         logging.debug("__update_tx_vfo")
-        self._primary_tx_vfo = value
+        self._fields['primary_tx_vfo'].update(value)
 
@@ -2,8 +2,6 @@ from .utils.signal_slots import Signal
 
 from enum import auto, IntEnum
 
-import collections
-
 
 class MsgType(IntEnum):
     MODEL_UPDATED = auto()
@@ -30,11 +28,66 @@ class MsgType(IntEnum):
     KEYER_SPEED_RESULT = auto()
     KEYER_BUFFER_AVAILABLE = auto()
     KEYER_BUFFER_FULL = auto()
+    MORSE_SEND = auto()
+    MORSE_CANCEL = auto()
+    MORSE_COMPLETE = auto()
+
+
+# Messages whose first argument is a VFO index
+INDEXED_MSGTYPES = frozenset((
+    MsgType.VFO_FREQUENCY_SET,
+    MsgType.VFO_FREQUENCY_QUERY,
+    MsgType.VFO_FREQUENCY_RESULT,
+    MsgType.VFO_MODE_SET,
+    MsgType.VFO_MODE_QUERY,
+    MsgType.VFO_MODE_RESULT,
+))
+
+
+class IndexedSignal(Signal):
+    """
+    A Signal whose first argument is an index. Slots connected to
+    signal[index] only receive messages for that index, found with a
+    single dict lookup per emit; slots connected to the signal itself
+    receive every message.
+    """
+    __slots__ = ['_topics']
+
+    def __init__(self):
+        super().__init__()
+        self._topics = {}
+
+    def __getitem__(self, index):
+        topic = self._topics.get(index)
+        if topic is None:
+            topic = self._topics[index] = Signal()
+        return topic
+
+    def __call__(self, index, *args, **kwargs):
+        topic = self._topics.get(index)
+        if topic is not None:
+            topic(index, *args, **kwargs)
+        Signal.__call__(self, index, *args, **kwargs)
 
 
 class MsgBus:
+    """
+    msgbus[msgtype] is the Signal carrying every message of a type.
+    For INDEXED_MSGTYPES, msgbus[msgtype, index] is the Signal carrying
+    only the messages for that index.
+    """
     def __init__(self):
-        self._signals = collections.defaultdict(Signal)
+        self._signals = {}
 
     def __getitem__(self, key):
-        return self._signals[key]
+        if type(key) is tuple:
+            (msgtype, index) = key
+            return self[msgtype][index]
+        signal = self._signals.get(key)
+        if signal is None:
+            if key in INDEXED_MSGTYPES:
+                signal = IndexedSignal()
+            else:
+                signal = Signal()
+            self._signals[key] = signal
+        return signal
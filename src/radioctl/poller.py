@@ -0,0 +1,195 @@
+from .msgbus import MsgType
+from .utils import logging
+
+import asyncio
+import time
+
+
+_logger = logging.getLogger('poller')
+
+# (fastest, slowest) poll interval in seconds, by field name
+DEFAULT_INTERVALS = {
+    'frequency': (0.25, 4.0),
+    'mode': (0.5, 8.0),
+    'tx': (0.25, 4.0),
+    'primary_rx_vfo': (1.0, 10.0),
+    'primary_tx_vfo': (1.0, 10.0),
+}
+
+# The interval grows by this factor each time a poll finds no change
+BACKOFF = 2.0
+
+# A field a client read within this many seconds is polled at its fastest
+ACTIVE_WINDOW = 5.0
+
+# A field which was just set is polled again after this many seconds
+SETTLE_TIME = 0.05
+
+# Bytes on the wire, both directions, of a typical query and response
+QUERY_BYTES = 20
+
+# Share of the link's capacity the poller may use
+DEFAULT_BUDGET_SHARE = 0.5
+
+BITS_PER_CHAR = 10
+
+MAX_SLEEP = 1.0
+
+
+class _Entry:
+    __slots__ = ['name', 'field', 'query', 'fastest', 'slowest', 'interval',
+                 'due', 'value', 'hurried']
+
+    def __init__(self, name, field, query, fastest, slowest):
+        self.name = name
+        self.field = field
+        self.query = query
+        self.fastest = fastest
+        self.slowest = slowest
+        self.interval = fastest
+        self.due = 0
+        self.value = field.value
+        self.hurried = False
+
+
+class Poller:
+    """
+    Keeps the model fresh on rigs which do not report changes on their
+    own.
+
+    Each field is polled on its own interval, which grows by BACKOFF
+    every time a poll finds the value unchanged, up to the slowest for
+    the field, and drops back to the fastest when it changes. Fields a
+    client has read recently, and fields just set, are polled at their
+    fastest. A field the rig reported within its interval (e.g. through
+    auto-information) is not polled.
+
+    Polls are sent no faster than budget_share of the bytes per second
+    the baud rate carries, leaving the rest of the link to clients.
+    """
+    def __init__(self, model, msgbus, baudrate, intervals=None,
+                 budget_share=DEFAULT_BUDGET_SHARE):
+        intervals = dict(DEFAULT_INTERVALS, **(intervals or {}))
+        self._model = model
+        self._entries = []
+        self._by_name = {}
+        for (name, field, query) in model.fields():
+            (fastest, slowest) = intervals[name.rsplit('.', 1)[-1]]
+            entry = _Entry(name, field, query, fastest, slowest)
+            self._entries.append(entry)
+            self._by_name[name] = entry
+        self._rate = baudrate / BITS_PER_CHAR * budget_share
+        self._capacity = QUERY_BYTES * len(self._entries)
+        self._tokens = self._capacity
+        self._refilled = time.monotonic()
+        self._wakeup = None
+        self._task = None
+        self.polls = 0
+        msgbus[MsgType.VFO_FREQUENCY_SET].connect(self._frequency_set)
+        msgbus[MsgType.VFO_MODE_SET].connect(self._mode_set)
+        msgbus[MsgType.RX_VFO_SET].connect(self._rx_vfo_set)
+        msgbus[MsgType.TX_VFO_SET].connect(self._tx_vfo_set)
+        msgbus[MsgType.TRANSMIT_SET].connect(self._tx_set)
+        msgbus[MsgType.RECEIVE_SET].connect(self._tx_set)
+
+    def interval(self, name):
+        return self._by_name[name].interval
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    def stop(self):
+        """
+        Stop polling. Returns the cancelled task, if there was one, for
+        callers that need to wait for it to finish.
+        """
+        task = self._task
+        if task is not None:
+            task.cancel()
+            self._task = None
+        return task
+
+    def hurry(self, name):
+        """
+        Poll a field soon at its fastest interval, e.g. after it was set.
+        """
+        entry = self._by_name.get(name)
+        if entry is None:
+            return
+        entry.hurried = True
+        entry.due = time.monotonic() + SETTLE_TIME
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _run(self):
+        self._wakeup = asyncio.Event()
+        try:
+            while True:
+                delay = self._poll_due(time.monotonic())
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+        finally:
+            self._wakeup = None
+
+    def _poll_due(self, now):
+        # Polls every due field the budget allows, and returns how long
+        # to sleep before something else is due.
+        self._tokens = min(self._capacity,
+                           self._tokens + (now - self._refilled) * self._rate)
+        self._refilled = now
+        delay = MAX_SLEEP
+        for entry in sorted(self._entries, key=lambda entry: entry.due):
+            if entry.due > now:
+                return min(delay, entry.due - now)
+            field = entry.field
+            if (not entry.hurried and field.timestamp is not None and
+                    now - field.timestamp < entry.interval):
+                entry.due = field.timestamp + entry.interval
+                delay = min(delay, entry.due - now)
+                continue
+            if self._tokens < QUERY_BYTES:
+                return min(delay, (QUERY_BYTES - self._tokens) / self._rate)
+            self._tokens -= QUERY_BYTES
+            self._adapt(entry, now)
+            entry.due = now + entry.interval
+            delay = min(delay, entry.interval)
+            self.polls += 1
+            entry.query()
+        return delay
+
+    def _adapt(self, entry, now):
+        field = entry.field
+        active = (field.read_timestamp is not None and
+                  now - field.read_timestamp < ACTIVE_WINDOW)
+        if entry.hurried or active or field.value != entry.value:
+            entry.interval = entry.fastest
+        else:
+            entry.interval = min(entry.interval * BACKOFF, entry.slowest)
+        entry.hurried = False
+        entry.value = field.value
+
+    def _frequency_set(self, index, *args):
+        self._hurry_vfo(index, 'frequency')
+
+    def _mode_set(self, index, *args):
+        self._hurry_vfo(index, 'mode')
+
+    def _hurry_vfo(self, index, name):
+        try:
+            vfo = self._model.get_vfo(index)
+        except IndexError:
+            return
+        self.hurry(f'{vfo.name}.{name}')
+
+    def _rx_vfo_set(self, *args, **kwargs):
+        self.hurry('primary_rx_vfo')
+
+    def _tx_vfo_set(self, *args, **kwargs):
+        self.hurry('primary_tx_vfo')
+
+    def _tx_set(self, *args, **kwargs):
+        self.hurry('tx')
@@ -1 +1,2 @@
+from . import icom
 from . import kenwood
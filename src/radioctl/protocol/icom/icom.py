@@ -1,139 +1,430 @@
-import asyncio
-import functools
+from ..factory import register_protocol
+
+from radioctl.hamlib.ptt import PTT
+from radioctl.msgbus import MsgType
+from radioctl.utils import logging
+from radioctl.utils.bcd import bcd_to_integer, integer_to_bcd
+from radioctl.utils.framing import FrameProtocol
 
-from struct import Struct
+import asyncio
+import collections
 
-from .utils import asyncio_serial
+_logger = logging.getLogger('icom')
 
-from .bcd import bcd_to_integer, integer_to_bcd
-from .rigcap import VFO
+__ALL__ = ['CommandRejected', 'Protocol']
 
 
-CIV_Header_Fmt = Struct('HBBB')
+CIV_Preamble = 0xFE
 CIV_Footer = b'\xFD'
-Byte_Encode = Struct('B')
-
-
-class CIV_Header:
-    @staticmethod
-    def size():
-        return CIV_Header_Fmt.size
-
-    @staticmethod
-    def parse(buf):
-        (preamble, dest, src, cmd) = CIV_Header_Fmt.unpack_from(buf)
-        assert(preamble == 0xFEFE)
-        return dict(dest=dest, src=src, cmd=cmd)
-
-    @staticmethod
-    def fmt(dest, src, cmd, subcmd=None):
-        hdr = CIV_Header_Fmt.pack(0xFEFE, dest, src, cmd)
-        if subcmd is not None:
-            hdr += Byte_Encode.pack(subcmd)
-        return hdr
-
-
-class IcomXcvr:
-    DefaultXcvrAddr = 0x60
-    DefautlControllerAddr = 0xE0
-
-    def __init__(self, port_name, baudrate, xcvr_addr = DefaultXcvrAddr, controller_addr = DefautlControllerAddr, **kwargs):
-        self._port_name = port_name
-        self._baudrate = baudrate
-        self._xcvr_addr = xcvr_addr
-        self._controller_addr = controller_addr
-        self._reader = None
-        self._writer = None
-        self._rx_vfo = VFO.VFOA
-        self._tx_vfo = VFO.VFOA
-        self._satmode = False
+CIV_OK = 0xFB
+CIV_NG = 0xFA
+CIV_Broadcast = 0x00
+
+CMD_TRANSCEIVE_FREQ = 0x00
+CMD_TRANSCEIVE_MODE = 0x01
+CMD_READ_FREQ = 0x03
+CMD_READ_MODE = 0x04
+CMD_SET_FREQ = 0x05
+CMD_SET_MODE = 0x06
+CMD_SELECT_VFO = 0x07
+CMD_SPLIT = 0x0F
+CMD_PTT = 0x1C
+CMD_VFO_FREQ = 0x25
+
+FREQ_BYTES = 5
+
+DEFAULT_XCVR_ADDR = 0x60
+DEFAULT_CONTROLLER_ADDR = 0xE0
+DEFAULT_PIPELINE_DEPTH = 4
+DEFAULT_COMMAND_TIMEOUT = 1.0
+
+MODE_MAP_FROM = {
+    0x00: 'LSB',
+    0x01: 'USB',
+    0x02: 'AM',
+    0x03: 'CW',
+    0x04: 'RTTY',
+    0x05: 'FM',
+    0x06: 'WFM',
+    0x07: 'CWR',
+    0x08: 'RTTYR',
+}
+
+MODE_MAP_TO = {mode: code for (code, mode) in MODE_MAP_FROM.items()}
+
+
+class CommandRejected(Exception):
+    pass
+
+
+class _Command:
+    __slots__ = ['cmd', 'subcmd', 'frame', 'future', 'timer']
+
+    def __init__(self, cmd, subcmd, frame, future):
+        self.cmd = cmd
+        self.subcmd = subcmd
+        self.frame = frame
+        self.future = future
+        self.timer = None
+
+
+class Protocol:
+    """
+    Icom CI-V protocol.
+
+    A single frame protocol reads everything the rig sends. Replies are
+    matched, in order, against the commands written to the rig. Up to
+    pipeline_depth commands are written before their replies arrive;
+    the rest wait their turn. Transceive frames the rig sends on its own
+    are fed into the model.
+
+    OK and NG replies do not say which command they answer. Once a
+    command times out its reply may still arrive, so until the commands
+    in flight have drained no more are written and OK/NG replies are
+    discarded; data replies are only taken when their command and
+    subcommand match.
+    """
+    def __init__(self, dialect, cfg, msgbus, rig_def):
+        protocol_def = rig_def['protocol_config']
+        self._msgbus = msgbus
+        self._dialect = dialect
+        self._xcvr_addr = protocol_def.get('address', DEFAULT_XCVR_ADDR)
+        self._controller_addr = protocol_def.get('controller', DEFAULT_CONTROLLER_ADDR)
+        self._pipeline_depth = protocol_def.get('pipeline_depth', DEFAULT_PIPELINE_DEPTH)
+        self._timeout = protocol_def.get('timeout', DEFAULT_COMMAND_TIMEOUT)
+        self._vfo_freq_cmd = protocol_def.get('unselected_vfo_commands', False)
+        self._header = bytes((CIV_Preamble, CIV_Preamble,
+                              self._xcvr_addr, self._controller_addr))
+        self._loop = None
+        self._transport = None
+        self._closed = None
+        self._in_flight = collections.deque()
+        self._backlog = collections.deque()
+        self._desynchronized = False
+        self._queries = {}
+        self._tasks = set()
+        self._selected = 0
+        # other VFOs selected for a moment by _on_vfo()
+        self._borrowed = 0
         self._split = False
+        self._register_signals()
 
-    async def open(self, **kwargs):
-        self._reader, self._writer = await asyncio_serial.open_serial_connection(
-            url = self._port_name,
-            baudrate = self._baudrate,
-            **kwargs)
-        # TODO not generic icom
-        await self.set_satmode(False)
-        await self.set_active_vfo(VFO.VFOA)
-
-    async def writecmd(self, cmd, subcmd=None, data=b''):
-        buf = CIV_Header.fmt(self._xcvr_addr, self._controller_addr, cmd, subcmd) + data + CIV_Footer
-        logging.debug('IcomXcvr: wrote: {}', buf)
-        self._writer.write(buf)
-        while True:
-            pkt = await self._reader.readuntil(CIV_Footer)
-            hdr = CIV_Header.parse(pkt)
-            if hdr['dest'] == self._controller_addr:
-                logging.debug('IcomProtocol: Data Received: dest={dest:x} src={src:x} cmd={cmd:x}', **hdr)
-                data = pkt[CIV_Header.size():-1]
-                if len(data) > 0:
-                    dataval = bcd_to_integer(data)
-                    logging.debug('... data={}', dataval)
-                    return dataval
-                return
+    @property
+    def msgbus(self):
+        return self._msgbus
+
+    def create_frame_protocol(self):
+        """
+        Factory for the asyncio protocol to connect to the transport,
+        e.g. with asyncio_serial.create_serial_connection().
+        """
+        return FrameProtocol(CIV_Footer, self._dispatch, self._connection_lost)
 
-    async def get_active_vfo_freq(self):
-        return await self.writecmd(0x03)
-
-    async def set_active_vfo_freq(self, freq):
-        return await self.writecmd(0x05, None, integer_to_bcd(freq))
-
-    async def get_tx_vfo_freq(self):
-        if not self._split:
-            return await self.get_active_vfo_freq()
-        rxvfo = self._rx_vfo
-        await self.set_active_vfo(self._tx_vfo)
-        result = await self.get_active_vfo_freq()
-        await self.set_active_vfo(rxvfo)
-        return result
-
-    async def set_tx_vfo_freq(self, freq):
-        if not self._split:
-            return await self.set_active_vfo_freq(freq)
-        rxvfo = self._rx_vfo
-        await self.set_active_vfo(self._tx_vfo)
-        await self.set_active_vfo_freq(freq)
-        await self.set_active_vfo(rxvfo)
-
-    async def set_tx_vfo(self, onoff, vfo):
-        if not onoff:
-            if self._satmode:
-                await self.set_satmode(False)
-            self._split = False
-            self._tx_vfo = self._rx_vfo
+    def open(self, loop, transport):
+        """
+        Start talking to the rig over a transport connected to a protocol
+        from create_frame_protocol(). Returns a future which completes
+        when the connection is lost.
+        """
+        self._loop = loop
+        self._transport = transport
+        self._closed = loop.create_future()
+        return self._closed
+
+    def command(self, cmd, subcmd=None, data=b''):
+        """
+        Send a command to the rig and return a future for the data of its
+        reply (with the command and subcommand bytes stripped). The future
+        fails with CommandRejected if the rig answers NG, or with
+        asyncio.TimeoutError if it does not answer.
+        """
+        if subcmd is None:
+            frame = b''.join((self._header, bytes((cmd,)), data, CIV_Footer))
+        else:
+            frame = b''.join((self._header, bytes((cmd, subcmd)), data, CIV_Footer))
+        command = _Command(cmd, subcmd, frame, self._loop.create_future())
+        if len(self._in_flight) < self._pipeline_depth and not self._desynchronized:
+            self._write(command)
         else:
-            self._split = True
-            self._tx_vfo = vfo
-            await self.set_satmode((vfo & (VFO.MAIN | VFO.SUB)) != 0)
-
-    async def set_active_vfo(self, vfo):
-        if vfo == VFO.MEM:
-            return await self.writecmd(0x08)
-        elif vfo == VFO.VFOA:
-            subcmd = 0x0
-        elif vfo == VFO.VFOB:
-            subcmd = 0x1
-        elif vfo == VFO.MAIN:
-            subcmd = 0xD0
-        elif vfo == VFO.SUB:
-            subcmd = 0xD1
+            self._backlog.append(command)
+        return command.future
+
+    def _write(self, command):
+        _logger.debug('Sending: {}', command.frame.hex())
+        command.timer = self._loop.call_later(self._timeout, self._expire, command)
+        self._in_flight.append(command)
+        self._transport.write(command.frame)
+
+    def _expire(self, command):
+        try:
+            self._in_flight.remove(command)
+        except ValueError:
+            return
+        if not command.future.done():
+            command.future.set_exception(asyncio.TimeoutError(
+                f'No reply to command 0x{command.cmd:02x}'))
+        if self._in_flight and not self._desynchronized:
+            _logger.warning('Replies out of step, draining commands in flight')
+        self._desynchronized = True
+        self._fill_pipeline()
+
+    def _fill_pipeline(self):
+        if self._desynchronized:
+            if self._in_flight:
+                return
+            self._desynchronized = False
+        while self._backlog and len(self._in_flight) < self._pipeline_depth:
+            self._write(self._backlog.popleft())
+
+    def close(self):
+        """
+        Close the transport; the future returned by open() completes once
+        it is closed.
+        """
+        if self._transport is not None:
+            self._transport.close()
+
+    def _connection_lost(self, exc):
+        _logger.info('Connection lost')
+        self._transport = None
+        for command in (*self._in_flight, *self._backlog):
+            if command.timer:
+                command.timer.cancel()
+            if not command.future.done():
+                command.future.set_exception(
+                    ConnectionError('Connection to rig lost'))
+        self._in_flight.clear()
+        self._backlog.clear()
+        self._desynchronized = False
+        if self._closed and not self._closed.done():
+            self._closed.set_result(exc)
+
+    def _dispatch(self, frame):
+        # frame is a 0xFD terminated bytes-like object, usually a memoryview
+        # into the receive buffer.
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug('Received: {}', bytes(frame).hex())
+        start = 0
+        while start < len(frame) and frame[start] == CIV_Preamble:
+            start += 1
+        if start < 2 or len(frame) - start < 4:
+            _logger.warning('Malformed frame: {}', bytes(frame).hex())
+            return
+        dest = frame[start]
+        src = frame[start + 1]
+        cmd = frame[start + 2]
+        payload = frame[start + 3:-1]
+        if src != self._xcvr_addr:
+            return # our own commands echoed on the CI-V bus, or another rig
+        if dest == self._controller_addr:
+            self._reply(cmd, payload)
+        elif dest == CIV_Broadcast:
+            self._transceive(cmd, payload)
+
+    def _reply(self, cmd, payload):
+        if not self._in_flight:
+            _logger.debug('Unexpected reply to 0x{:02x}', cmd)
+            return
+        command = self._in_flight[0]
+        if cmd in (CIV_OK, CIV_NG) and self._desynchronized:
+            # may answer a command which timed out
+            _logger.debug('Discarding 0x{:02x} while out of step', cmd)
+            return
+        if cmd == CIV_OK:
+            result = b''
+        elif cmd == CIV_NG:
+            result = CommandRejected(f'Rig rejected command 0x{command.cmd:02x}')
+        elif cmd == command.cmd and (command.subcmd is None or
+                                     (payload and payload[0] == command.subcmd)):
+            if command.subcmd is not None:
+                payload = payload[1:]
+            result = bytes(payload)
         else:
-            raise RuntimeError('Invalid VFO')
-        self._rx_vfo = vfo
-        return await self.writecmd(0x07, subcmd)
-
-    async def set_satmode(self, onoff):
-        if onoff:
-            data = 1
-            if self._tx_vfo == VFO.MAIN:
-                self._rx_vfo = VFO.SUB
+            _logger.debug('Reply to 0x{:02x} while waiting for 0x{:02x}',
+                          cmd, command.cmd)
+            return
+        self._in_flight.popleft()
+        command.timer.cancel()
+        if not command.future.done():
+            if isinstance(result, Exception):
+                command.future.set_exception(result)
             else:
-                self._rx_vfo = VFO.MAIN
+                command.future.set_result(result)
+        self._fill_pipeline()
+
+    def _transceive(self, cmd, payload):
+        if self._borrowed:
+            # the frame may be about the VFO selected for a moment; the
+            # next query gets the right one
+            _logger.debug('Ignoring transceive 0x{:02x} while another VFO is selected',
+                          cmd)
+            return
+        try:
+            if cmd == CMD_TRANSCEIVE_FREQ:
+                self._freq_result(self._selected, payload)
+            elif cmd == CMD_TRANSCEIVE_MODE:
+                self._mode_result(self._selected, payload)
+        except (IndexError, ValueError):
+            _logger.warning('Could not parse transceive frame 0x{:02x}: {}',
+                            cmd, bytes(payload).hex())
+
+    def _freq_result(self, index, data):
+        self._msgbus[MsgType.VFO_FREQUENCY_RESULT](
+            index, bcd_to_integer(data[0:FREQ_BYTES]))
+
+    def _mode_result(self, index, data):
+        mode = MODE_MAP_FROM.get(data[0])
+        if mode is None:
+            _logger.warning('Unknown mode 0x{:02x}', data[0])
+            return
+        self._msgbus[MsgType.VFO_MODE_RESULT](index, mode)
+
+    def _register_signals(self):
+        msgbus = self._msgbus
+        msgbus[MsgType.VFO_FREQUENCY_QUERY].connect(self._query_frequency)
+        msgbus[MsgType.VFO_FREQUENCY_SET].connect(self._set_frequency)
+        msgbus[MsgType.VFO_MODE_QUERY].connect(self._query_mode)
+        msgbus[MsgType.VFO_MODE_SET].connect(self._set_mode)
+        msgbus[MsgType.RX_VFO_QUERY].connect(self._query_rx_vfo)
+        msgbus[MsgType.RX_VFO_SET].connect(self._set_rx_vfo)
+        msgbus[MsgType.TX_VFO_QUERY].connect(self._query_tx_vfo)
+        msgbus[MsgType.TX_VFO_SET].connect(self._set_tx_vfo)
+        msgbus[MsgType.TRANSMIT_QUERY].connect(self._query_transmit)
+        msgbus[MsgType.TRANSMIT_SET].connect(self._set_transmit)
+        msgbus[MsgType.RECEIVE_SET].connect(self._set_receive)
+
+    def _spawn(self, key, coro):
+        # Identical queries in flight are only sent once; the result
+        # signal answers every client which asked.
+        if self._transport is None:
+            coro.close()
+            _logger.debug('Not connected, dropping {}', key)
+            return
+        if key is not None:
+            if key in self._queries:
+                coro.close()
+                return
+            self._queries[key] = None
+        task = self._loop.create_task(self._run(key, coro))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, key, coro):
+        try:
+            await coro
+        except (asyncio.TimeoutError, CommandRejected, ConnectionError) as e:
+            _logger.warning('{}', e)
+        except Exception:
+            _logger.exception('Command failed')
+        finally:
+            if key is not None:
+                self._queries.pop(key, None)
+
+    async def _on_vfo(self, index, cmd, subcmd=None, data=b''):
+        # Run a command against a VFO which may not be the selected one.
+        # The select/command/select-back sequence is pipelined rather than
+        # taking three round trips.
+        if index == self._selected:
+            return await self.command(cmd, subcmd, data)
+        selected = self._selected
+        self._borrowed += 1
+        try:
+            outcomes = await asyncio.gather(
+                self.command(CMD_SELECT_VFO, index),
+                self.command(cmd, subcmd, data),
+                self.command(CMD_SELECT_VFO, selected),
+                return_exceptions=True)
+            if isinstance(outcomes[2], Exception):
+                # don't leave the rig on the other VFO
+                _logger.warning('Selecting VFO {} again: {}', selected, outcomes[2])
+                outcomes[2] = None
+                await self.command(CMD_SELECT_VFO, selected)
+        finally:
+            self._borrowed -= 1
+        for outcome in outcomes:
+            if isinstance(outcome, Exception):
+                raise outcome
+        return outcomes[1]
+
+    def _query_frequency(self, index):
+        self._spawn(('freq', index), self._read_frequency(index))
+
+    async def _read_frequency(self, index):
+        if self._vfo_freq_cmd:
+            sel = 0 if index == self._selected else 1
+            data = await self.command(CMD_VFO_FREQ, sel)
         else:
-            data = 0
-            self._rx_vfo = VFO.VFOA
-        await self.writecmd(0x1A, 0x07, data.to_bytes(1, byteorder='little'))
-        self._satmode = bool(data)
+            data = await self._on_vfo(index, CMD_READ_FREQ)
+        self._freq_result(index, data)
+
+    def _set_frequency(self, index, frequency):
+        data = integer_to_bcd(frequency, FREQ_BYTES)
+        if self._vfo_freq_cmd:
+            sel = 0 if index == self._selected else 1
+            self._spawn(None, self.command(CMD_VFO_FREQ, sel, data))
+        else:
+            self._spawn(None, self._on_vfo(index, CMD_SET_FREQ, None, data))
+
+    def _query_mode(self, index):
+        self._spawn(('mode', index), self._read_mode(index))
+
+    async def _read_mode(self, index):
+        self._mode_result(index, await self._on_vfo(index, CMD_READ_MODE))
+
+    def _set_mode(self, index, mode):
+        code = MODE_MAP_TO.get(mode)
+        if code is None:
+            raise ValueError(f'Mode not supported: {mode}')
+        data = bytes((code,))
+        self._spawn(None, self._on_vfo(index, CMD_SET_MODE, None, data))
+
+    def _query_rx_vfo(self):
+        # CI-V cannot read the VFO selection; it is tracked from the
+        # selections made through this protocol.
+        self._msgbus[MsgType.RX_VFO_RESULT](self._selected)
+
+    def _set_rx_vfo(self, index):
+        self._spawn(None, self._select_vfo(index))
+
+    async def _select_vfo(self, index):
+        await self.command(CMD_SELECT_VFO, index)
+        self._selected = index
+        self._msgbus[MsgType.RX_VFO_RESULT](index)
+
+    def _query_tx_vfo(self):
+        self._spawn(('split',), self._read_split())
+
+    async def _read_split(self):
+        data = await self.command(CMD_SPLIT)
+        self._split = bool(data and data[0])
+        self._tx_vfo_result()
+
+    def _tx_vfo_result(self):
+        index = self._selected
+        if self._split:
+            index = 1 - index
+        self._msgbus[MsgType.TX_VFO_RESULT](index)
+
+    def _set_tx_vfo(self, index):
+        self._spawn(None, self._write_split(index != self._selected))
+
+    async def _write_split(self, split):
+        await self.command(CMD_SPLIT, 0x01 if split else 0x00)
+        self._split = split
+        self._tx_vfo_result()
+
+    def _query_transmit(self):
+        self._spawn(('ptt',), self._read_transmit())
+
+    async def _read_transmit(self):
+        data = await self.command(CMD_PTT, 0x00)
+        self._msgbus[MsgType.TRANSMIT_RESULT](PTT.TX if data and data[0] else PTT.RX)
+
+    def _set_transmit(self, *args):
+        self._spawn(None, self.command(CMD_PTT, 0x00, b'\x01'))
+
+    def _set_receive(self, *args):
+        self._spawn(None, self.command(CMD_PTT, 0x00, b'\x00'))
+
 
+register_protocol('Icom', Protocol)
@@ -0,0 +1,195 @@
+import functools
+import re
+
+
+__ALL__ = ['compile_response', 'FieldError', 'FixedWidthDecoder', 'RegexDecoder']
+
+
+_DIGITS = b'0123456789'
+_SPECIAL = '.^$*+?{}[]|()'
+
+
+class FieldError(ValueError):
+    pass
+
+
+class Fields:
+    """
+    The fields of a fixed width frame. A field is only copied out of the
+    frame and validated when it is looked up, so handlers pay for the
+    fields they consume and nothing else. Raises FieldError if the field
+    does not match its pattern.
+    """
+    __slots__ = ['_frame', '_layout']
+
+    def __init__(self, frame, layout):
+        self._frame = frame
+        self._layout = layout
+
+    def __getitem__(self, name):
+        (start, end, allowed) = self._layout[name]
+        value = bytes(self._frame[start:end])
+        if allowed is _DIGITS:
+            if value.isdigit():
+                return value
+        elif not value.translate(None, allowed):
+            return value
+        raise FieldError(f'Invalid {name}: {value}')
+
+
+class FixedWidthDecoder:
+    """
+    Decodes frames whose response pattern has a fixed length. Literal
+    text is compared in place and each field is sliced out at a known
+    offset, so no regular expression is run per frame. Frames may be
+    bytes or memoryviews.
+
+    The leading command literal and the trailing ';' are not compared
+    again: the reader only hands over ';' terminated frames and the
+    dispatch table has already routed them on the command.
+    """
+    __slots__ = ['_length', '_literals', '_layout']
+
+    def __init__(self, length, literals, fields):
+        self._length = length
+        self._literals = tuple(
+            lit for lit in literals if lit[0] != 0 and lit[2] != b';')
+        self._layout = {
+            name: (start, end, allowed) for (name, start, end, allowed) in fields}
+
+    @property
+    def length(self):
+        return self._length
+
+    def decode(self, frame):
+        if len(frame) != self._length:
+            return None
+        for (start, end, literal) in self._literals:
+            if frame[start:end] != literal:
+                return None
+        return Fields(frame, self._layout)
+
+
+class RegexDecoder:
+    """
+    Fallback for response patterns that cannot be sliced at fixed
+    offsets (e.g. variable width fields). Matches against the raw bytes
+    and validates every field up front.
+    """
+    __slots__ = ['_re']
+
+    def __init__(self, pattern):
+        self._re = re.compile(pattern.encode())
+
+    def decode(self, frame):
+        return self._re.match(frame)
+
+
+def _parse_class(pattern, pos):
+    # pattern[pos] is the character following '['
+    allowed = []
+    while pattern[pos] != ']':
+        c = pattern[pos]
+        if c == '\\':
+            pos += 1
+            c = pattern[pos]
+            if c == 'd':
+                allowed.extend(_DIGITS.decode())
+                pos += 1
+                continue
+            if c.isalnum():
+                raise ValueError(f'Unsupported escape in class: \\{c}')
+        elif c == '^' and not allowed:
+            raise ValueError('Negated classes are not supported')
+        elif c == '-' and allowed and pattern[pos + 1] != ']':
+            end = pattern[pos + 1]
+            allowed.extend(chr(x) for x in range(ord(allowed[-1]) + 1, ord(end) + 1))
+            pos += 2
+            continue
+        allowed.append(c)
+        pos += 1
+    return (''.join(allowed).encode(), pos + 1)
+
+
+def _parse_count(pattern, pos):
+    # returns (count, new_pos); a missing quantifier means a single char
+    if pos < len(pattern) and pattern[pos] == '{':
+        end = pattern.index('}', pos)
+        count = pattern[pos + 1:end]
+        if not count.isdigit():
+            raise ValueError(f'Variable width quantifier: {{{count}}}')
+        return (int(count), end + 1)
+    if pos < len(pattern) and pattern[pos] in '*+?':
+        raise ValueError(f'Variable width quantifier: {pattern[pos]}')
+    return (1, pos)
+
+
+def _parse_atom(pattern, pos):
+    # returns (allowed_bytes, width, new_pos) for \d or [...] with quantifier
+    if pattern.startswith('\\d', pos):
+        allowed = _DIGITS
+        pos += 2
+    elif pattern[pos] == '[':
+        (allowed, pos) = _parse_class(pattern, pos + 1)
+    else:
+        raise ValueError(f'Unsupported field expression at {pos}')
+    (count, pos) = _parse_count(pattern, pos)
+    return (allowed, count, pos)
+
+
+def _compile_fixed_width(pattern):
+    literals = []
+    fields = []
+    offset = 0
+    pos = 0
+    literal_start = 0
+    literal = []
+
+    def flush_literal():
+        if literal:
+            literals.append((literal_start, offset, ''.join(literal).encode()))
+            del literal[:]
+
+    while pos < len(pattern):
+        c = pattern[pos]
+        if pattern.startswith('(?P<', pos):
+            flush_literal()
+            end = pattern.index('>', pos)
+            name = pattern[pos + 4:end]
+            (allowed, width, pos) = _parse_atom(pattern, end + 1)
+            if pattern[pos] != ')':
+                raise ValueError(f'Unsupported group body for {name}')
+            fields.append((name, offset, offset + width, allowed))
+            offset += width
+            pos += 1
+            continue
+        elif c == '\\':
+            c = pattern[pos + 1]
+            if c.isalnum():
+                raise ValueError(f'Unsupported escape outside field: \\{c}')
+            pos += 2
+        elif c in _SPECIAL:
+            raise ValueError(f'Unsupported pattern syntax: {c}')
+        else:
+            pos += 1
+        if not literal:
+            literal_start = offset
+        literal.append(c)
+        offset += 1
+
+    flush_literal()
+    return FixedWidthDecoder(offset, literals, fields)
+
+
+@functools.lru_cache(maxsize=None)
+def compile_response(pattern):
+    """
+    Compile a YAML response pattern into a frame decoder operating on
+    bytes. Fixed width patterns are sliced directly; anything else falls
+    back to a regular expression. Decoders hold no state, so each
+    pattern is compiled once and shared by every rig using it.
+    """
+    try:
+        return _compile_fixed_width(pattern)
+    except (ValueError, IndexError):
+        return RegexDecoder(pattern)
@@ -31,7 +31,10 @@ class ElecraftDialect:
         return self.MODE_MAP_FROM[rigmode]
 
     def mode_to_rig(self, mode):
-        return self.MODE_MAP_TO[mode]
+        code = self.MODE_MAP_TO.get(mode)
+        if code is None:
+            raise ValueError(f'Mode not supported: {mode}')
+        return code
 
     @property
     def startup_commands(self):
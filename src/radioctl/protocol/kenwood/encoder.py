@@ -0,0 +1,49 @@
+import functools
+import re
+import string
+
+
+__ALL__ = ['Command']
+
+
+_INT_SPEC = re.compile(r'\d*d')
+
+
+class Command:
+    """
+    A set command template from the rig definition, e.g. 'FA{freq:011d};',
+    rendered straight to bytes. Integer fields are rendered with bytes
+    %-formatting; templates using anything else fall back to str.format.
+    """
+    __slots__ = ['_template', '_format', '_names']
+
+    def __init__(self, template):
+        self._template = template
+        (self._format, self._names) = _compile_command(template)
+
+    def __str__(self):
+        return self._template
+
+    def __bool__(self):
+        return bool(self._template)
+
+    def format(self, **kwargs):
+        if self._format is None:
+            return self._template.format(**kwargs).encode()
+        return self._format % tuple([kwargs[name] for name in self._names])
+
+
+@functools.lru_cache(maxsize=None)
+def _compile_command(template):
+    # returns (bytes %-format, field names in order) or (None, None)
+    parts = []
+    names = []
+    for (literal, name, spec, conversion) in string.Formatter().parse(template):
+        parts.append(literal.replace('%', '%%'))
+        if name is None:
+            continue
+        if conversion or not name.isidentifier() or not _INT_SPEC.fullmatch(spec):
+            return (None, None)
+        parts.append(f'%{spec}')
+        names.append(name)
+    return (''.join(parts).encode(), tuple(names))
@@ -1,12 +1,17 @@
+from .decoder import compile_response, FieldError
 from .dialects import create_dialect
+from .encoder import Command
 from ..factory import register_protocol
 from ..morse_task import MorseTask
+from ..output_queue import OutputQueue
+from ..scheduler import RequestScheduler
 
+from radioctl.hamlib.ptt import PTT
 from radioctl.msgbus import MsgType
 from radioctl.utils import logging
+from radioctl.utils.framing import FrameProtocol
 
 import functools
-import re
 import weakref
 
 _logger = logging.getLogger('kenwood')
@@ -18,41 +23,49 @@ class Handler:
     def __init__(self, protocol, handler_cfg):
         # TODO self._send_method = weakref.proxy(protocol._send)
         self._send_method = protocol._send
-        self._cmd = ''
-        self._get_cmd = ''
-        self._set_cmd = ''
-        self._response_re = None
+        self._query_method = protocol._query
+        self._complete_method = protocol._complete
+        self._cmd = b''
+        self._get_cmd = b''
+        self._set_cmd = Command('')
+        self._decoder = None
         self._parse_params(handler_cfg)
 
-    def __call__(self, msg):
-        assert(self._response_re)
+    def __call__(self, frame):
+        assert(self._decoder)
         assert(self._response_signal)
-        match = self._response_re.match(msg)
-        if match:
-            self._response(match)
-        else:
-            _logger.warn('Could not parse: {}', msg)
+        fields = self._decoder.decode(frame)
+        if fields is not None:
+            try:
+                self._response(fields)
+            except FieldError:
+                fields = None
+            else:
+                if self._get_cmd:
+                    self._complete_method(self._get_cmd)
+        if fields is None:
+            _logger.warn('Could not parse: {}', bytes(frame))
 
     def _parse_params(self, handler_cfg):
         if 'get' in handler_cfg:
-            self._get_cmd = handler_cfg['get']
+            self._get_cmd = handler_cfg['get'].encode()
         if 'set' in handler_cfg:
-            self._set_cmd = handler_cfg['set']
+            self._set_cmd = Command(handler_cfg['set'])
         if 'response' in handler_cfg:
             resp = handler_cfg['response']
-            self._cmd = resp[0:2]
+            self._cmd = resp[0:2].encode()
             if resp[2] == '\\' and resp[3] == '$':
-                self._cmd += '$'
-            self._response_re = re.compile(resp)
+                self._cmd += b'$'
+            self._decoder = compile_response(resp)
 
-    def _response(self, match):
+    def _response(self, fields):
         self._response_signal()
 
     def _set_value(self, *args, **kwargs):
-        self._send_method(self._set_cmd)
+        self._send_method(self._set_cmd.format())
 
     def _get_value(self):
-        self._send_method(self._get_cmd)
+        self._query_method(self._get_cmd)
 
 
 class VfoHandler(Handler):
@@ -60,19 +73,17 @@ class VfoHandler(Handler):
         super().__init__(protocol, handler_cfg)
         self._index = index
         self._response_signal = protocol._msgbus[MsgType.VFO_FREQUENCY_RESULT]
-        protocol._msgbus[MsgType.VFO_FREQUENCY_SET].connect(self._set_frequency)
-        protocol._msgbus[MsgType.VFO_FREQUENCY_QUERY].connect(self._get_frequency)
+        protocol._msgbus[MsgType.VFO_FREQUENCY_SET, index].connect(self._set_frequency)
+        protocol._msgbus[MsgType.VFO_FREQUENCY_QUERY, index].connect(self._get_frequency)
 
-    def _response(self, match):
-        self._response_signal(self._index, int(match.group('freq')))
+    def _response(self, fields):
+        self._response_signal(self._index, int(fields['freq']))
 
     def _set_frequency(self, index, frequency):
-        if index == self._index:
-            self._send_method(self._set_cmd.format(freq=frequency))
+        self._send_method(self._set_cmd.format(freq=frequency))
 
     def _get_frequency(self, index):
-        if index == self._index:
-            self._send_method(self._get_cmd)
+        self._query_method(self._get_cmd)
 
 
 class ModeHandler(Handler):
@@ -82,21 +93,19 @@ class ModeHandler(Handler):
         self._dialect = protocol._dialect
         self._response_signal = protocol._msgbus[MsgType.VFO_MODE_RESULT]
         if self._set_cmd:
-            protocol._msgbus[MsgType.VFO_MODE_SET].connect(self._set_mode)
+            protocol._msgbus[MsgType.VFO_MODE_SET, index].connect(self._set_mode)
         if self._get_cmd:
-            protocol._msgbus[MsgType.VFO_MODE_QUERY].connect(self._get_mode)
+            protocol._msgbus[MsgType.VFO_MODE_QUERY, index].connect(self._get_mode)
 
-    def _response(self, match):
+    def _response(self, fields):
         self._response_signal(self._index,
-                              self._dialect.mode_from_rig(match.group('mode')))
+                              self._dialect.mode_from_rig(fields['mode'].decode()))
 
     def _set_mode(self, index, mode):
-        if index == self._index:
-            self._send_method(self._set_cmd.format(mode=self._dialect.mode_to_rig(mode)))
+        self._send_method(self._set_cmd.format(mode=self._dialect.mode_to_rig(mode)))
 
     def _get_mode(self, index):
-        if index == self._index:
-            self._send_method(self._get_cmd)
+        self._query_method(self._get_cmd)
 
 
 class VfoToggleHandler(Handler):
@@ -108,8 +117,8 @@ class VfoToggleHandler(Handler):
         if self._get_cmd:
             protocol._msgbus[query_signal].connect(self._get_value)
 
-    def _response(self, match):
-        self._response_signal(int(match.group('index')))
+    def _response(self, fields):
+        self._response_signal(int(fields['index']))
 
     def _set_value(self, index):
         self._send_method(self._set_cmd.format(index=index))
@@ -148,29 +157,98 @@ TxToggleHandler = functools.partial(ToggleHandler,
                                     MsgType.TRANSMIT_RESULT)
 
 
+class InfoHandler(Handler):
+    """
+    The IF frame reports the frequency and mode of the receive VFO, the
+    VFO selection, split and TX state in one response; each is passed on
+    as if it had been queried on its own.
+    """
+    def __init__(self, protocol, handler_cfg):
+        super().__init__(protocol, handler_cfg)
+        self._dialect = protocol._dialect
+        msgbus = protocol._msgbus
+        self._response_signal = msgbus[MsgType.VFO_FREQUENCY_RESULT]
+        self._mode_signal = msgbus[MsgType.VFO_MODE_RESULT]
+        self._rx_vfo_signal = msgbus[MsgType.RX_VFO_RESULT]
+        self._tx_vfo_signal = msgbus[MsgType.TX_VFO_RESULT]
+        self._tx_signal = msgbus[MsgType.TRANSMIT_RESULT]
+
+    def _response(self, fields):
+        # Convert everything before emitting anything, so a bad field
+        # does not leave the model half updated.
+        rx = int(fields['vfo'])
+        tx = 1 - rx if fields['split'] == b'1' else rx
+        freq = int(fields['freq'])
+        mode = self._dialect.mode_from_rig(fields['mode'].decode())
+        ptt = PTT.TX if fields['tx'] == b'1' else PTT.RX
+        self._rx_vfo_signal(rx)
+        self._tx_vfo_signal(tx)
+        self._response_signal(rx, freq)
+        self._mode_signal(rx, mode)
+        self._tx_signal(ptt)
+
+
 class KeyerSpeedHandler(Handler):
     def __init__(self, protocol, handler_cfg):
         super().__init__(protocol, handler_cfg)
         self._response_signal = protocol._msgbus[MsgType.KEYER_SPEED_RESULT]
         protocol._msgbus[MsgType.KEYER_SPEED_SET].connect(self._set_value)
         protocol._msgbus[MsgType.KEYER_SPEED_QUERY].connect(self._get_value)
-        self._min, self._max = handler_cfg['range'].split('-', 1)
+        self._min, self._max = (int(speed) for speed in handler_cfg['range'].split('-', 1))
 
-    def _response(self, match):
-        self._response_signal(int(match.group('speed')))
+    def _response(self, fields):
+        self._response_signal(int(fields['speed']))
 
     def _set_value(self, speed):
         speed = max(speed, self._min)
         speed = min(speed, self._max)
         self._send_method(self._set_cmd.format(speed=speed))
+        # the rig does not echo the new speed, which the keyer timing needs
+        self._get_value()
 
 
-class CatCWHandler:
+class CatCWHandler(Handler):
+    """
+    CW keyed from text sent over CAT, e.g. the Kenwood/Elecraft KY
+    command. The response reports whether the rig's keyer buffer is full;
+    text is queued in a MorseTask which keeps the buffer topped up.
+    """
     def __init__(self, protocol, handler_cfg):
-        # TODO self._send_method = weakref.proxy(protocol._send)
-        self._send_method = protocol._send
-        self._cancel_method = functools.partial(self._send_method, handler_cfg['cancel'])
-        self._send_cmd = handler_cfg['send']
+        super().__init__(protocol, handler_cfg)
+        msgbus = protocol._msgbus
+        self._send_cmd = Command(handler_cfg['send'])
+        # what every rendered send command starts with, e.g. b'KY '
+        self._send_prefix = handler_cfg['send'].split('{', 1)[0].encode()
+        self._cancel_cmd = handler_cfg['cancel'].encode()
+        self._discard_method = protocol._discard
+        self._full_signal = msgbus[MsgType.KEYER_BUFFER_FULL]
+        self._response_signal = msgbus[MsgType.KEYER_BUFFER_AVAILABLE]
+        self._morse_task = MorseTask(msgbus, self._send_text, self._cancel,
+                                     int(handler_cfg['length']),
+                                     self._get_value if self._get_cmd else None)
+        msgbus[MsgType.MORSE_SEND].connect(self._morse_task.send_morse)
+        msgbus[MsgType.MORSE_CANCEL].connect(self._morse_task.cancel_morse)
+
+    @property
+    def morse_task(self):
+        return self._morse_task
+
+    def _response(self, fields):
+        if fields['full'] == b'0':
+            self._response_signal()
+        else:
+            self._full_signal()
+
+    def _send_text(self, text):
+        # ';' would end the command early
+        self._send_method(self._send_cmd.format(text=text.replace(';', '')))
+
+    def _cancel(self):
+        # text still waiting for the output budget would be keyed after
+        # the abort, which jumps the queue
+        prefix = self._send_prefix
+        self._discard_method(lambda data: data.startswith(prefix))
+        self._send_method(self._cancel_cmd)
 
 
 class Protocol:
@@ -179,58 +257,134 @@ class Protocol:
         self._dialect = create_dialect(cfg, dialect)
         self._startup = ''
         self._handlers = {}
+        self._handlers_by_name = {}
         self._no_response_handlers = []
+        self._dispatch_table = {}
+        self._transport = None
+        self._closed = None
+        self._scheduler = RequestScheduler(self._send)
+        self._pacing = {}
+        self._priority_cmds = set()
         self._create_handlers(rig_def['protocol_config'])
+        self._output = OutputQueue(self._write, priority=self._priority_cmds,
+                                   **self._pacing)
+        if 'info' in self._handlers_by_name:
+            msgbus[MsgType.RX_VFO_RESULT].connect(self._update_summary)
+            self._update_summary(0)
 
     @property
     def msgbus(self):
         return self._msgbus
 
-    def open(self, loop, reader, writer):
-        self._reader = reader
-        self._writer = writer
-        self._send(self._startup)
+    def create_frame_protocol(self):
+        """
+        Factory for the asyncio protocol to connect to the transport,
+        e.g. with asyncio_serial.create_serial_connection().
+        """
+        return FrameProtocol(b';', self._dispatch, self._connection_lost)
+
+    def open(self, loop, transport):
+        """
+        Start talking to the rig over a transport connected to a protocol
+        from create_frame_protocol(). Returns a future which completes
+        when the connection is lost.
+        """
+        self._transport = transport
+        self._closed = loop.create_future()
+        self._send(self._startup.encode())
         if hasattr(self._dialect, "startup_commands"):
-            self._send(self._dialect.startup_commands)
-        return loop.create_task(self.reader_task(), name='Reader Task')
-
-    async def reader_task(self):
-        handlers = self._handlers
-        try:
-            while True:
-                pkt = await self._reader.readuntil(b';')
-                msg = pkt.decode()
-                _logger.debug('Received: {}', msg)
-                if len(msg) < 3:
-                    _logger.warn('Message too short: {}', msg)
-                    continue
-                if msg[2] == '$':
-                    cmd = msg[0:3]
-                else:
-                    cmd = msg[0:2]
-                try:
-                    handler = handlers[cmd]
-                    handler(msg)
-                except KeyError:
-                    _logger.debug('No handler for: {}', msg)
-        except EOFError:
-            _logger.info('Terminating reader task')
+            self._send(self._dialect.startup_commands.encode())
+        return self._closed
+
+    def close(self):
+        """
+        Close the transport; the future returned by open() completes once
+        it is closed.
+        """
+        if self._transport is not None:
+            self._transport.close()
+
+    def _connection_lost(self, exc):
+        _logger.info('Connection lost')
+        self._transport = None
+        self._scheduler.reset()
+        self._output.reset()
+        if self._closed and not self._closed.done():
+            self._closed.set_result(exc)
+
+    def _dispatch(self, frame):
+        # frame is a ';' terminated bytes-like object, usually a memoryview
+        # into the receive buffer; handlers copy only the fields they use.
+        if _logger.isEnabledFor(logging.DEBUG):
+            _logger.debug('Received: {}', bytes(frame))
+        if len(frame) < 3:
+            _logger.warn('Message too short: {}', bytes(frame))
+            return
+        key = (frame[0] << 8) | frame[1]
+        if frame[2] == 0x24: # '$'
+            key = (key << 8) | 0x24
+        handler = self._dispatch_table.get(key)
+        if handler is None:
+            _logger.debug('No handler for: {}', bytes(frame))
+            return
+        handler(frame)
 
     def _send(self, data):
+        if self._transport is None:
+            _logger.debug('Not connected, dropping {}', data)
+            return
+        self._output.send(data)
+
+    def _discard(self, predicate):
+        dropped = self._output.discard(predicate)
+        if dropped:
+            _logger.debug('Discarded {} queued commands', dropped)
+
+    def _write(self, data):
+        if self._transport is None:
+            _logger.debug('Not connected, dropping {}', data)
+            return
         _logger.debug('Sending: {}', data)
-        self._writer.write(data.encode())
+        self._transport.write(data)
+
+    def _query(self, cmd):
+        self._scheduler.query(cmd)
+
+    def _complete(self, cmd):
+        self._scheduler.complete(cmd)
+
+    def _update_summary(self, rx_index):
+        # IF answers the receive VFO's frequency and mode queries, and
+        # the VFO selection and TX state queries.
+        names = ('rx_vfo', 'tx_vfo', 'tx', f'vfo_{rx_index}', f'mode_{rx_index}')
+        covers = [self._handlers_by_name[name]._get_cmd
+                  for name in names
+                  if name in self._handlers_by_name]
+        self._scheduler.set_summary(self._handlers_by_name['info']._get_cmd,
+                                    [cmd for cmd in covers if cmd])
 
     def _register_handler(self, handler):
         if handler._cmd:
             self._handlers[handler._cmd] = handler
+            self._dispatch_table[int.from_bytes(handler._cmd, 'big')] = handler
         else:
             self._no_response_handlers.append(handler)
 
+    def _add_priority(self, set_cmd):
+        # TX/RX go out ahead of queued queries
+        if set_cmd:
+            self._priority_cmds.add(set_cmd.format())
+
     def _create_handlers(self, protocol_def):
         for (name, item) in protocol_def.items():
             if name == 'startup':
                 self._startup = item
                 continue
+            elif name == 'pacing':
+                self._pacing = {key: item[key]
+                                for key in ('commands_per_second', 'bytes_per_second')
+                                if key in item}
+                continue
             elif name.startswith('vfo_'):
                 index = int(name.split('_', 1)[1])
                 handler = VfoHandler(self, item, index)
@@ -243,21 +397,26 @@ class Protocol:
                 handler = TxVfoToggleHandler(self, item)
             elif name == 'rx':
                 handler = RxToggleHandler(self, item)
+                self._add_priority(handler._set_cmd)
             elif name == 'tx':
                 handler = TxToggleHandler(self, item)
+                self._add_priority(handler._set_cmd)
+            elif name == 'info':
+                handler = InfoHandler(self, item)
             elif name == 'keyer_speed':
                 handler = KeyerSpeedHandler(self, item)
             elif name == 'cw':
                 mode = item['mode']
                 if mode.lower() == 'cat':
-                    pass
-                    #handler = CatCWHandler(self, item)
+                    handler = CatCWHandler(self, item)
+                    self._priority_cmds.add(handler._cancel_cmd)
                 else:
                     raise RuntimeError(f'Unknown cw handler mode: {mode}')
             else:
                 _logger.info("Handler {} not supported", name)
                 continue
 
+            self._handlers_by_name[name] = handler
             self._register_handler(handler)
 
 
@@ -1,61 +1,141 @@
 from radioctl.msgbus import MsgType
 from radioctl.utils import logging
+from radioctl.utils.morse import duration
 
-import weakref
+import asyncio
+import collections
 
 
 _logger = logging.getLogger('MorseTask')
 
+# Assumed until the rig reports its keyer speed
+DEFAULT_WPM = 20
+
+# The next chunk is sent when the text already sent will be keyed within
+# this many seconds, so the rig's buffer never runs dry but holds little
+# more than one chunk.
+LEAD_TIME = 0.3
+
+# How often to ask a rig whose buffer is full whether it has room again,
+# and the longest the sender sleeps before checking its estimate
+BUFFER_POLL_INTERVAL = 0.1
+
 
 class MorseTask:
-    def __init__(self, msgbus, send_method, cancel_method, data_len_limit):
+    """
+    Feeds text to the rig's keyer buffer.
+
+    Text is split into chunks of at most data_len_limit characters,
+    queued and sent one at a time, each when the text before it is
+    estimated to be nearly keyed at the current keyer speed. After each
+    chunk the rig's buffer state is queried; while the rig reports its
+    buffer full (KEYER_BUFFER_FULL) nothing more is sent until it reports
+    room (KEYER_BUFFER_AVAILABLE).
+
+    Once the last of the text is estimated to have been keyed,
+    MORSE_COMPLETE is emitted. cancel_morse() drops the queued text and
+    sends the cancel command at once, which clears what the rig has
+    buffered; cancelled text is never reported complete.
+    """
+    def __init__(self, msgbus, send_method, cancel_method, data_len_limit,
+                 query_method=None):
+        self._msgbus = msgbus
         self._task = None
         self._data_len_limit = data_len_limit
-        self._buf = []
+        self._buf = collections.deque()
         self._buf_space_available = asyncio.Event()
         self._buf_space_available.set()
-        self._send_method = weakref.proxy(send_method)
-        self._cancel_method = weakref.proxy(cancel_method)
+        self._send_method = send_method
+        self._cancel_method = cancel_method
+        self._query_method = query_method
+        self._wpm = None
+        self._keyed_until = 0.0
         msgbus[MsgType.KEYER_BUFFER_AVAILABLE].connect(self._buffer_available)
         msgbus[MsgType.KEYER_BUFFER_FULL].connect(self._buffer_full)
+        msgbus[MsgType.KEYER_SPEED_RESULT].connect(self._speed)
+
+    @property
+    def wpm(self):
+        return self._wpm or DEFAULT_WPM
+
+    @property
+    def queued(self):
+        return ''.join(self._buf)
 
     def send_morse(self, buf):
         maxlen = self._data_len_limit
         while len(buf) > 0:
-            if len(self._buf) > 0 and (len(self._buf[-1]) + len(buf)) <= maxlen:
+            if self._buf and (len(self._buf[-1]) + len(buf)) <= maxlen:
                 self._buf[-1] += buf
             else:
                 self._buf.append(buf[0:maxlen])
             buf = buf[maxlen:]
+        if self._wpm is None:
+            self._msgbus[MsgType.KEYER_SPEED_QUERY]()
         if not self._task or self._task.done():
-            self._task = \
-                asyncio.create_task(self._morse_sender(), name='Morse Sender')
+            self._task = asyncio.get_event_loop().create_task(
+                self._morse_sender(), name='Morse Sender')
 
     def cancel_morse(self):
         if self._task:
             self._task.cancel()
+            self._task = None
         self._cancel_method()
-        del self._buf[:]
+        self._buf.clear()
+        self._keyed_until = 0.0
         self._buf_space_available.set()
 
     async def _morse_sender(self):
+        loop = asyncio.get_running_loop()
         try:
             _logger.debug('Starting Morse Sender...')
 
-            while len(self._buf):
-                _logger.debug('Morse string remaining: %s', self._buf)
-                if not self._buf_space_available.is_set():
+            while True:
+                wait = self._keyed_until - loop.time()
+                if self._buf:
+                    _logger.debug('Morse string remaining: {}', self._buf)
+                    wait -= LEAD_TIME
+                if wait > 0:
+                    # short steps, as a change of speed moves the estimate
+                    # and more text may arrive
+                    await asyncio.sleep(min(wait, BUFFER_POLL_INTERVAL))
+                    continue
+                if not self._buf:
+                    break
+                while not self._buf_space_available.is_set():
                     _logger.debug('Waiting for rig to report buffer available')
-                    await self._buf_space_available.wait()
-                self._buf_space_available.clear()
-                buf = self._buf.pop(0)
+                    self._query()
+                    try:
+                        await asyncio.wait_for(self._buf_space_available.wait(),
+                                               BUFFER_POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+                buf = self._buf.popleft()
                 self._send_method(buf)
+                self._keyed_until = \
+                    max(self._keyed_until, loop.time()) + duration(buf, self.wpm)
+                self._query()
         except asyncio.CancelledError:
-            pass
+            _logger.debug('Morse Sender Cancelled')
+            return
         _logger.debug('Morse Sender Complete')
+        self._msgbus[MsgType.MORSE_COMPLETE]()
+
+    def _query(self):
+        if self._query_method is not None:
+            self._query_method()
 
     def _buffer_available(self):
         self._buf_space_available.set()
 
     def _buffer_full(self):
         self._buf_space_available.clear()
+
+    def _speed(self, wpm):
+        # rescale what is left of the text sent at the old speed
+        if self._keyed_until:
+            now = asyncio.get_event_loop().time()
+            remaining = self._keyed_until - now
+            if remaining > 0:
+                self._keyed_until = now + remaining * self.wpm / wpm
+        self._wpm = wpm
@@ -0,0 +1,158 @@
+from radioctl.utils import logging
+
+import asyncio
+import collections
+
+
+_logger = logging.getLogger('output_queue')
+
+# Pacing lets this much of a second's budget go out at once after the
+# line has been idle; a single command always fits.
+BURST = 0.25
+
+
+class TokenBucket:
+    """
+    A rate limit of rate units per second. Units may be spent while at
+    least one remains, which can leave the bucket in debt; delay() is the
+    time until one is available again.
+    """
+    def __init__(self, rate, burst=BURST):
+        self._rate = rate
+        self._capacity = max(1.0, rate * burst)
+        self._tokens = self._capacity
+        self._time = None
+
+    def refill(self, now):
+        if self._time is not None:
+            self._tokens = min(self._capacity,
+                               self._tokens + (now - self._time) * self._rate)
+        self._time = now
+
+    @property
+    def available(self):
+        return self._tokens >= 1
+
+    def spend(self, units):
+        self._tokens -= units
+
+    def delay(self):
+        return max(0.0, (1 - self._tokens) / self._rate)
+
+
+class OutputQueue:
+    """
+    Sits between the protocol and the transport.
+
+    Commands sent during one event loop iteration are written to the rig
+    in a single write. With commands_per_second and/or bytes_per_second,
+    output is paced to that budget and the rest waits in the queue; by
+    default it is unlimited.
+
+    Priority commands (e.g. TX/RX, or aborting CW) go out ahead of
+    anything queued, without waiting for the budget. They are still
+    charged for it, so the commands behind them wait a little longer.
+    """
+    def __init__(self, write_method, separator=b';', commands_per_second=None,
+                 bytes_per_second=None, priority=()):
+        self._write_method = write_method
+        self._separator = separator
+        self._buckets = []
+        self._commands = None
+        self._bytes = None
+        if commands_per_second:
+            self._commands = TokenBucket(commands_per_second)
+            self._buckets.append(self._commands)
+        if bytes_per_second:
+            self._bytes = TokenBucket(bytes_per_second)
+            self._buckets.append(self._bytes)
+        self._priority_cmds = frozenset(priority)
+        self._priority = collections.deque()
+        self._queue = collections.deque()
+        self._loop = None
+        self._flush_handle = None
+        self._paced = False
+
+    def __len__(self):
+        return len(self._priority) + len(self._queue)
+
+    @property
+    def queued(self):
+        return tuple(self._priority) + tuple(self._queue)
+
+    def send(self, data, priority=None):
+        """
+        Queue data for the next write. priority defaults to whether data
+        is one of the priority commands.
+        """
+        if priority is None:
+            priority = data in self._priority_cmds
+        if priority:
+            self._priority.append(data)
+            if self._paced and self._flush_handle is not None:
+                # don't wait for the budget
+                self._flush_handle.cancel()
+                self._flush_handle = None
+        else:
+            self._queue.append(data)
+        if self._flush_handle is None:
+            if self._loop is None:
+                self._loop = asyncio.get_event_loop()
+            self._paced = False
+            self._flush_handle = self._loop.call_soon(self._flush)
+
+    def discard(self, predicate):
+        """
+        Drop the queued commands for which predicate(data) is true, e.g.
+        CW text which must not be keyed after an abort. Returns how many
+        were dropped.
+        """
+        kept = [data for data in self._queue if not predicate(data)]
+        dropped = len(self._queue) - len(kept)
+        if dropped:
+            self._queue = collections.deque(kept)
+        return dropped
+
+    def reset(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._paced = False
+        self._priority.clear()
+        self._queue.clear()
+
+    def _flush(self):
+        self._flush_handle = None
+        self._paced = False
+        buckets = self._buckets
+        if buckets:
+            now = self._loop.time()
+            for bucket in buckets:
+                bucket.refill(now)
+        out = list(self._priority)
+        self._priority.clear()
+        if not buckets:
+            out.extend(self._queue)
+            self._queue.clear()
+        else:
+            for data in out:
+                self._spend(data)
+            queue = self._queue
+            while queue and all(bucket.available for bucket in buckets):
+                data = queue.popleft()
+                self._spend(data)
+                out.append(data)
+        if out:
+            self._write_method(b''.join(out))
+        if self._queue:
+            delay = max(bucket.delay() for bucket in buckets)
+            _logger.debug('Pacing {} queued commands for {:.3f}s',
+                          len(self._queue), delay)
+            self._paced = True
+            self._flush_handle = self._loop.call_later(delay, self._flush)
+
+    def _spend(self, data):
+        if self._commands is not None:
+            self._commands.spend(max(1, data.count(self._separator)))
+        if self._bytes is not None:
+            self._bytes.spend(len(data))
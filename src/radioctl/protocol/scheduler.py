@@ -0,0 +1,121 @@
+from radioctl.utils import logging
+
+import asyncio
+
+
+_logger = logging.getLogger('scheduler')
+
+DEFAULT_QUERY_TIMEOUT = 1.0
+
+# A summary query replaces the queries it covers once this many of them
+# are sent together.
+MIN_COVERED = 2
+
+
+class RequestScheduler:
+    """
+    Sits between the query signals and the serial writer.
+
+    Queries issued during one event loop iteration are written to the rig
+    in a single write. A query which is already pending, or has been sent
+    and not yet answered, is not sent again: every client waiting on it is
+    served by the one response, which the protocol reports through
+    complete(). Queries the rig never answers expire after the timeout so
+    they can be sent again.
+
+    A summary query (e.g. Kenwood IF) answers several others at once.
+    When enough of the queries it covers are sent together, the summary
+    is sent instead, and completing it completes them. Covered queries
+    made while the summary is in flight wait for it.
+    """
+    def __init__(self, write_method, timeout=DEFAULT_QUERY_TIMEOUT):
+        self._write_method = write_method
+        self._timeout = timeout
+        self._loop = None
+        self._pending = {}
+        self._outstanding = {}
+        self._summary = None
+        self._covers = frozenset()
+        self._covered = {}
+        self._flush_handle = None
+
+    @property
+    def pending(self):
+        return tuple(self._pending)
+
+    @property
+    def outstanding(self):
+        return tuple(self._outstanding)
+
+    def set_summary(self, cmd, covers):
+        """
+        Make cmd the summary query for the commands in covers, or disable
+        summaries if cmd is None.
+        """
+        self._summary = cmd
+        self._covers = frozenset(covers) if cmd else frozenset()
+
+    def query(self, cmd):
+        if cmd in self._pending or cmd in self._outstanding:
+            _logger.debug('Query already in flight: {}', cmd)
+            return
+        self._pending[cmd] = None
+        if self._flush_handle is None:
+            if self._loop is None:
+                self._loop = asyncio.get_event_loop()
+            self._flush_handle = self._loop.call_soon(self._flush)
+
+    def complete(self, cmd):
+        timer = self._outstanding.pop(cmd, None)
+        if timer is not None:
+            timer.cancel()
+        for covered in self._covered.pop(cmd, ()):
+            self._outstanding.pop(covered, None)
+
+    def reset(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        for timer in self._outstanding.values():
+            if timer is not None:
+                timer.cancel()
+        self._pending.clear()
+        self._outstanding.clear()
+        self._covered.clear()
+
+    def _flush(self):
+        self._flush_handle = None
+        if not self._pending:
+            return
+        cmds = tuple(self._pending)
+        self._pending.clear()
+        if self._covers:
+            cmds = self._summarize(cmds)
+        loop = self._loop
+        for cmd in cmds:
+            self._outstanding[cmd] = \
+                loop.call_later(self._timeout, self._expire, cmd)
+        if cmds:
+            self._write_method(b''.join(cmds))
+
+    def _summarize(self, cmds):
+        summary = self._summary
+        covered = [cmd for cmd in cmds if cmd in self._covers]
+        in_flight = summary in self._outstanding
+        if not covered or not (in_flight or summary in cmds or
+                               len(covered) >= MIN_COVERED):
+            return cmds
+        _logger.debug('{} answers {}', summary, covered)
+        cmds = [cmd for cmd in cmds if cmd not in self._covers]
+        if not in_flight and summary not in cmds:
+            cmds.append(summary)
+        self._covered.setdefault(summary, []).extend(covered)
+        for cmd in covered:
+            self._outstanding[cmd] = None
+        return cmds
+
+    def _expire(self, cmd):
+        if self._outstanding.pop(cmd, None) is not None:
+            _logger.warning('No response to query: {}', cmd)
+        for covered in self._covered.pop(cmd, ()):
+            self._outstanding.pop(covered, None)
@@ -1,23 +1,58 @@
 from . import rigloader
+from .rigcache import default_cache_dir, file_stamp, RigCache
+from .utils import logging
 
-import logging
 import os
 
+_logger = logging.getLogger('radio_registry')
+
 _radios = dict()
 
+# name -> (file, stamp, cache) of the definitions not loaded yet
+_lazy = dict()
+
 def register_radio(name, definition):
     _radios[name] = definition
 
 def radio_definition(name):
-    return _radios[name]
+    """
+    The definition of a rig, by name or alias. Definitions are loaded
+    on first use, from the cache or else parsed, validated and cached;
+    an invalid one raises RigDefinitionError.
+    """
+    definition = _radios.get(name)
+    if definition is None:
+        (filename, stamp, cache) = _lazy[name]
+        rig_file = os.path.basename(filename)
+        definition = cache and cache.load(rig_file, stamp)
+        if not definition:
+            (name, aliases, definition) = rigloader.load_file(filename)
+            if cache:
+                cache.store(rig_file, stamp, name, aliases, definition)
+                cache.save()
+        # every alias shares the one definition
+        for (other, entry) in list(_lazy.items()):
+            if entry[0] == filename:
+                del _lazy[other]
+                register_radio(other, definition)
+    return definition
 
 def radio_choices():
-    return _radios.keys()
+    return sorted(set(_radios).union(_lazy))
 
 def clear():
     _radios.clear()
+    _lazy.clear()
 
-def load_all():
+def load_all(cache_dir=None):
+    """
+    Index the rig definitions of RIGSDB by name and alias, without
+    loading them: only the name and aliases of each file are read, from
+    the cache index (by default see rigcache.default_cache_dir()) when
+    the file is unchanged, else from the file itself and then indexed.
+    radio_definition() loads the rest. A file whose header cannot be
+    read is logged and skipped.
+    """
     rigsdb = os.getenv('RIGSDB', '/usr/share/pyradioctl/rigs')
 
     if not os.path.exists(rigsdb):
@@ -25,15 +60,31 @@ def load_all():
     elif not os.path.isdir(rigsdb):
         raise FileNotFoundError(f"RIGSDB ({rigsdb}) is not a directory")
 
-    listing = os.listdir(rigsdb)
+    if cache_dir is None:
+        cache_dir = default_cache_dir()
+    cache = RigCache(cache_dir, rigsdb) if cache_dir else None
+
+    listing = sorted(item for item in os.listdir(rigsdb) if item.endswith('.yaml'))
 
     for rig_item in listing:
-        if rig_item.endswith('.yaml'):
-            try:
-                (name, aliases, rig_definition) = \
-                    rigloader.load_file(os.path.join(rigsdb, rig_item))
-                register_radio(name, rig_definition)
-                for alias in aliases:
-                    register_radio(alias, rig_definition)
-            except Exception as e:
-                logging.exception("Unable to load rig definition: {}", rig_item)
+        filename = os.path.join(rigsdb, rig_item)
+        try:
+            stamp = file_stamp(filename)
+            header = cache and cache.lookup(rig_item, stamp)
+            if not header:
+                header = rigloader.scan_header(filename)
+                if cache:
+                    cache.store(rig_item, stamp, *header)
+        except (OSError, UnicodeDecodeError, rigloader.RigDefinitionError) as e:
+            _logger.error('Unable to load rig definition {}: {}', filename, e)
+            continue
+        (name, aliases) = header
+        for radio in (name, *aliases):
+            if radio in _lazy and _lazy[radio][0] != filename:
+                _logger.warning('Rig {} of {} also defined by {}', radio,
+                                _lazy[radio][0], filename)
+            _lazy[radio] = (filename, stamp, cache)
+
+    if cache:
+        cache.prune(listing)
+        cache.save()
@@ -1,5 +1,6 @@
 from .capabilities import Capabilities
 from .model import Model
+from .poller import Poller
 from .utils import asyncio_serial
 
 
@@ -9,8 +10,9 @@ class Rig:
         self._model = Model()
         self._protocol = protocol
         self._msgbus = protocol.msgbus
+        self._poller = None
 
-        for vfo in capabilities.vfos:
+        for vfo in sorted(capabilities.vfos):
             self._model.add_vfo(vfo)
 
         self._model.register_signals(self.msgbus)
@@ -31,9 +33,45 @@ class Rig:
     def protocol(self):
         return self._protocol
 
-    def open_serial(self, loop, serial_port, baudrate):
-        (reader, writer) = loop.run_until_complete(
-            asyncio_serial.open_serial_connection(
-                url = serial_port,
-                baudrate = baudrate))
-        self.protocol.open(loop, reader, writer)
+    @property
+    def poller(self):
+        return self._poller
+
+    def start_polling(self, baudrate, intervals=None):
+        """
+        Poll the rig to keep the model fresh, within a budget derived from
+        the baud rate. See Poller.
+        """
+        self.stop_polling()
+        self._poller = Poller(self._model, self._msgbus, baudrate, intervals)
+        self._poller.start()
+
+    def stop_polling(self):
+        if self._poller is not None:
+            self._poller.stop()
+            self._poller = None
+
+    def close(self):
+        """
+        Stop polling and close the connection to the rig.
+        """
+        self.stop_polling()
+        self.protocol.close()
+
+    def open_serial(self, loop, serial_port, baudrate, low_latency=False, poll=True):
+        return loop.run_until_complete(
+            self.connect_serial(loop, serial_port, baudrate, low_latency, poll))
+
+    async def connect_serial(self, loop, serial_port, baudrate, low_latency=False,
+                             poll=True):
+        (transport, _) = await asyncio_serial.create_serial_connection(
+            loop,
+            self.protocol.create_frame_protocol,
+            url = serial_port,
+            baudrate = baudrate,
+            low_latency = low_latency)
+        closed = self.protocol.open(loop, transport)
+        if poll:
+            self.start_polling(baudrate)
+            closed.add_done_callback(lambda _: self.stop_polling())
+        return closed
@@ -0,0 +1,132 @@
+from .utils import logging
+
+import hashlib
+import marshal
+import os
+import sys
+import tempfile
+
+
+_logger = logging.getLogger('rigcache')
+
+INDEX = 'index'
+
+# bumped whenever what is cached changes, e.g. when the validation of
+# the definitions stored becomes stricter
+FORMAT = 3
+
+
+def default_cache_dir():
+    """
+    $PYRADIOCTL_CACHE, or pyradioctl under the XDG cache directory. An
+    empty PYRADIOCTL_CACHE disables the cache.
+    """
+    cache_dir = os.getenv('PYRADIOCTL_CACHE')
+    if cache_dir is not None:
+        return cache_dir or None
+    xdg = os.getenv('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(xdg, 'pyradioctl')
+
+
+def file_stamp(filename):
+    # a definition is reparsed whenever its file is touched or resized
+    st = os.stat(filename)
+    return (st.st_mtime_ns, st.st_size)
+
+
+class RigCache:
+    """
+    Compiled rig definitions of one RIGSDB directory, so YAML is only
+    parsed when a file changes.
+
+    The index maps each file to its stamp (mtime and size), name and
+    aliases; each validated definition is stored on its own so loading
+    one rig does not read the others. Entries are marshalled plain data,
+    under a directory per RIGSDB, Python version and FORMAT, and written
+    atomically.
+    A cache which cannot be read or written is only logged.
+    """
+    def __init__(self, cache_dir, rigsdb):
+        key = hashlib.sha1(os.path.abspath(rigsdb).encode()).hexdigest()[:16]
+        self._dir = os.path.join(
+            cache_dir, f'{key}.{sys.implementation.cache_tag}.{FORMAT}')
+        self._index = None
+        self._dirty = False
+        self._writable = True
+
+    def index(self):
+        """
+        {file name: (stamp, name, aliases)}
+        """
+        if self._index is None:
+            self._index = self._read(INDEX) or {}
+        return self._index
+
+    def lookup(self, rig_file, stamp):
+        """
+        (name, aliases) of rig_file if cached with stamp, else None.
+        """
+        entry = self.index().get(rig_file)
+        if entry is None or tuple(entry[0]) != stamp:
+            return None
+        return (entry[1], entry[2])
+
+    def load(self, rig_file, stamp):
+        """
+        The cached definition of rig_file, or None if missing or stale.
+        """
+        entry = self._read(rig_file)
+        if entry is None or tuple(entry[0]) != stamp:
+            return None
+        return entry[1]
+
+    def store(self, rig_file, stamp, name, aliases, definition=None):
+        """
+        Index rig_file by name and aliases, and cache its definition if
+        given; without one, load() misses until it is stored.
+        """
+        self.index()[rig_file] = (stamp, name, list(aliases))
+        self._dirty = True
+        if definition is not None:
+            self._write(rig_file, (stamp, definition))
+
+    def prune(self, rig_files):
+        """
+        Forget the files no longer in RIGSDB.
+        """
+        index = self.index()
+        for rig_file in set(index) - set(rig_files):
+            del index[rig_file]
+            self._dirty = True
+
+    def save(self):
+        if self._dirty:
+            self._write(INDEX, self._index)
+            self._dirty = False
+
+    def _read(self, name):
+        try:
+            with open(os.path.join(self._dir, name + '.marshal'), 'rb') as f:
+                return marshal.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError, TypeError) as e:
+            _logger.warning('Ignoring unreadable rig cache entry {}: {}', name, e)
+            return None
+
+    def _write(self, name, value):
+        if not self._writable:
+            return
+        try:
+            os.makedirs(self._dir, exist_ok=True)
+            (fd, tmp) = tempfile.mkstemp(dir=self._dir, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    marshal.dump(value, f)
+                os.replace(tmp, os.path.join(self._dir, name + '.marshal'))
+            except BaseException:
+                os.unlink(tmp)
+                raise
+        except (OSError, ValueError) as e:
+            _logger.warning('Cannot write rig cache {}: {}', self._dir, e)
+            self._writable = False
@@ -5,10 +5,24 @@ from .radio_registry import radio_definition
 from .rig import *
 
 
+# (id of rig definition, itu region) -> (rig definition, Capabilities).
+# Capabilities are frozen, so rigs of one model share them.
+_capabilities = {}
+
+
+def _load_capabilities(rig_def, itu_region):
+    key = (id(rig_def), itu_region)
+    entry = _capabilities.get(key)
+    if entry is None or entry[0] is not rig_def:
+        entry = _capabilities[key] = \
+            (rig_def, load_rig_definition(rig_def, itu_region))
+    return entry[1]
+
+
 def create_rig(name, cfg, itu_region):
     assert(itu_region in (1, 2, 3))
     rig_def = radio_definition(name)
-    caps = load_rig_definition(rig_def, itu_region)
+    caps = _load_capabilities(rig_def, itu_region)
     protocol_name = rig_def['protocol']
     dialect_name = rig_def['dialect']
     protocol = factory.create_protocol(
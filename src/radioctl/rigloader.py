@@ -1,15 +1,177 @@
-import logging
+from .capabilities import band_names
+from .hamlib.modes import Mode
+from .hamlib.rigfunctions import Function
+from .hamlib.riglevels import Level
+from .hamlib.rigparms import Parm
+
+import re
 import yaml
 
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+
+class RigDefinitionError(ValueError):
+    """
+    A rig definition which cannot be used, e.g.
+    'elecraft_k3.yaml: rx_bands[1].range: expected low-high, got 44000000'.
+    """
+    def __init__(self, filename, path, problem):
+        self.filename = filename
+        self.path = path
+        where = f'{filename}: {path}' if path else filename
+        super().__init__(f'{where}: {problem}')
+
+
+def parse(stream):
+    """
+    Rig definitions are plain data, parsed with libyaml when available.
+    """
+    return yaml.load(stream, Loader=SafeLoader)
+
 
 def load_file(filename):
-    with open(filename) as f:
-        rig_definition = yaml.full_load(f)
+    """
+    Parse and validate a rig definition. Returns (name, aliases,
+    definition); raises RigDefinitionError if it is not valid.
+    """
+    with open(filename, 'rb') as f:
+        try:
+            rig_definition = parse(f)
+        except yaml.YAMLError as e:
+            raise RigDefinitionError(filename, '', f'invalid YAML: {e}') from None
+    validate(rig_definition, filename)
+    return (rig_definition['name'], rig_definition['aliases'], rig_definition)
 
+
+# Top level keys only: the name, and the aliases block up to the next key
+_HEADER_KEYS = ('name', 'aliases')
+_TOP_LEVEL_KEY = re.compile(r'([A-Za-z_]\w*)\s*:')
+
+
+def scan_header(filename):
+    """
+    (name, aliases) of a rig definition, reading only those entries, so
+    a database can be indexed without parsing every definition. The
+    rest of the file is checked when it is loaded.
+    """
+    blocks = {}
+    current = None
+    with open(filename, encoding='utf-8') as f:
+        for line in f:
+            if line[:1] not in ' \t#\n\r-':
+                match = _TOP_LEVEL_KEY.match(line)
+                current = match and match.group(1)
+                if current in _HEADER_KEYS:
+                    blocks[current] = [line]
+                    continue
+                current = None
+                if len(blocks) == len(_HEADER_KEYS):
+                    break
+            elif current is not None:
+                blocks[current].append(line)
     try:
-        name = rig_definition['name']
-        aliases = rig_definition['aliases']
-    except KeyError as e:
-        logging.error("Rig definition missing {}: {}", e.args[0], filename)
+        header = parse(''.join(line for block in blocks.values() for line in block)) or {}
+    except yaml.YAMLError as e:
+        raise RigDefinitionError(filename, '', f'invalid YAML: {e}') from None
+    _check(_HEADER_SCHEMA, header, filename, '')
+    return (header['name'], header['aliases'])
+
+
+# A schema is a type, a tuple of alternative schemas, a one item list
+# (a list of that schema), a dict of key -> (required, schema), or a
+# callable returning a problem or None.
+def _range(pattern, number):
+    def check(value):
+        if not isinstance(value, str) or not re.fullmatch(f'{pattern}-{pattern}', value):
+            return f'expected low-high, got {value!r}'
+        (low, high) = (number(x) for x in value.split('-'))
+        if low > high:
+            return f'empty range {value!r}'
+        return None
+    return check
+
+def _one_of(*choices):
+    def check(value):
+        if value not in choices:
+            return f'expected one of {", ".join(map(repr, choices))}, got {value!r}'
+        return None
+    return check
+
+def _name(kind, names):
+    names = frozenset(names)
+    def check(value):
+        if not isinstance(value, str):
+            return f'expected str, got {value!r}'
+        if value not in names:
+            return f'unknown {kind} {value!r}'
+        return None
+    return check
+
+def _names(kind, names):
+    # a list of those the rig can both get and set, or get and set lists
+    name = _name(kind, names)
+    return ([name], {'get': (False, [name]), 'set': (False, [name])})
+
+_HEADER_SCHEMA = {
+    'name': (True, str),
+    'aliases': (True, [str]),
+}
+
+SCHEMA = dict(_HEADER_SCHEMA, **{
+    'protocol': (True, str),
+    'dialect': (True, str),
+    'modes': (True, [_name('mode', Mode.__members__)]),
+    'vfos': (True, _one_of('A/B')),
+    'rx_bands': (True, [{'range': (True, _range(r'\d+', int))}]),
+    'tx_bands': (True, [_name('band', band_names())]),
+    'rf_power': (True, _range(r'\d+(\.\d+)?', float)),
+    'levels': (False, _names('level', Level.__members__)),
+    'funcs': (False, _names('function', Function.__members__)),
+    'parms': (False, _names('parm', Parm.__members__)),
+    'protocol_config': (True, dict),
+})
+
+
+def validate(rig_definition, filename):
+    """
+    Raise RigDefinitionError naming the first entry of rig_definition
+    which does not match SCHEMA.
+    """
+    _check(SCHEMA, rig_definition, filename, '')
+
+
+def _check(schema, value, filename, path):
+    problem = _problem(schema, value, filename, path)
+    if problem is not None:
+        raise RigDefinitionError(filename, path, problem)
+
 
-    return (name, aliases, rig_definition)
+def _problem(schema, value, filename, path):
+    if isinstance(schema, dict):
+        if not isinstance(value, dict):
+            return f'expected a mapping, got {value!r}'
+        for (key, (required, item_schema)) in schema.items():
+            item_path = f'{path}.{key}' if path else key
+            if key in value:
+                _check(item_schema, value[key], filename, item_path)
+            elif required:
+                raise RigDefinitionError(filename, item_path, 'missing')
+    elif isinstance(schema, list):
+        if not isinstance(value, list):
+            return f'expected a list, got {value!r}'
+        for (i, item) in enumerate(value):
+            _check(schema[0], item, filename, f'{path}[{i}]')
+    elif isinstance(schema, tuple):
+        problems = [_problem(alternative, value, filename, path)
+                    for alternative in schema]
+        if all(problems):
+            return ' or '.join(problems)
+    elif isinstance(schema, type):
+        if not isinstance(value, schema):
+            return f'expected {schema.__name__}, got {value!r}'
+    else:
+        return schema(value)
+    return None
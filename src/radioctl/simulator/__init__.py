@@ -0,0 +1,19 @@
+from .base import PtySimulator
+from .icom import IcomSimulator
+from .kenwood import KenwoodSimulator
+
+
+__ALL__ = ['create_simulator', 'IcomSimulator', 'KenwoodSimulator', 'PtySimulator']
+
+
+_simulators = {
+    'Icom': IcomSimulator,
+    'Kenwood': KenwoodSimulator,
+}
+
+
+def create_simulator(rig_def, **kwargs):
+    """
+    Create a simulator for a rig definition, picked by its protocol.
+    """
+    return _simulators[rig_def['protocol']](rig_def, **kwargs)
@@ -0,0 +1,94 @@
+from radioctl.utils import logging
+from radioctl.utils.framing import FrameProtocol
+
+import abc
+import asyncio
+import os
+import tty
+
+
+_logger = logging.getLogger('simulator')
+
+# 8N1: a start bit, eight data bits and a stop bit per character
+BITS_PER_CHAR = 10
+
+
+class PtySimulator(abc.ABC):
+    """
+    A rig on the master side of a pty. Connect to port, the slave side,
+    as if it were the rig's serial port.
+
+    With a baudrate, bytes take as long to arrive as they would on a
+    serial line: frames from the host are handled, and replies are
+    delivered, only once their last character would have been received.
+    Without one the pty runs as fast as it can.
+
+    Subclasses implement frame_received() and answer with send().
+    """
+    def __init__(self, delimiter, baudrate=None):
+        (self._master, self._slave) = os.openpty()
+        # The slave stays open so the master never sees a hangup before
+        # the host connects.
+        tty.setraw(self._slave)
+        os.set_blocking(self._master, False)
+        self._framer = FrameProtocol(delimiter, self._frame_received)
+        self._char_time = BITS_PER_CHAR / baudrate if baudrate else 0
+        self._rx_free = 0
+        self._tx_free = 0
+        self._loop = None
+        self.port = os.ttyname(self._slave)
+        self.frames_received = 0
+        self.frames_sent = 0
+
+    def start(self, loop=None):
+        self._loop = loop or asyncio.get_event_loop()
+        self._loop.add_reader(self._master, self._read_ready)
+
+    def close(self):
+        if self._loop is not None:
+            self._loop.remove_reader(self._master)
+            self._loop = None
+        if self._master is not None:
+            os.close(self._master)
+            os.close(self._slave)
+            self._master = None
+
+    def send(self, data):
+        if not self._char_time:
+            self._write(data)
+            return
+        now = self._loop.time()
+        self._tx_free = max(now, self._tx_free) + len(data) * self._char_time
+        self._loop.call_at(self._tx_free, self._write, data)
+
+    @abc.abstractmethod
+    def frame_received(self, frame):
+        """
+        Handle a frame from the host, delimiter included.
+        """
+
+    def _write(self, data):
+        if self._master is None:
+            return
+        try:
+            os.write(self._master, data)
+        except BlockingIOError:
+            _logger.warning('Host is not reading, dropped {} bytes', len(data))
+            return
+        self.frames_sent += 1
+
+    def _read_ready(self):
+        try:
+            data = os.read(self._master, 4096)
+        except (BlockingIOError, InterruptedError):
+            return
+        if not self._char_time:
+            self._framer.data_received(data)
+            return
+        now = self._loop.time()
+        self._rx_free = max(now, self._rx_free) + len(data) * self._char_time
+        self._loop.call_at(self._rx_free, self._framer.data_received, data)
+
+    def _frame_received(self, frame):
+        self.frames_received += 1
+        self.frame_received(bytes(frame))
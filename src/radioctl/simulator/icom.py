@@ -0,0 +1,124 @@
+from .base import PtySimulator
+from radioctl.protocol.icom.icom import (
+    CIV_Broadcast, CIV_Footer, CIV_NG, CIV_OK, CIV_Preamble,
+    CMD_PTT, CMD_READ_FREQ, CMD_READ_MODE, CMD_SELECT_VFO, CMD_SET_FREQ,
+    CMD_SET_MODE, CMD_SPLIT, CMD_TRANSCEIVE_FREQ, CMD_VFO_FREQ,
+    DEFAULT_CONTROLLER_ADDR, DEFAULT_XCVR_ADDR, FREQ_BYTES)
+from radioctl.utils import logging
+from radioctl.utils.bcd import bcd_to_integer, integer_to_bcd
+
+
+_logger = logging.getLogger('simulator')
+
+DEFAULT_FILTER = 0x01
+
+
+class IcomSimulator(PtySimulator):
+    """
+    Simulates an Icom CI-V rig with two VFOs at the address given in the
+    protocol_config of its rig definition.
+
+    With echo, every frame from the host is sent back first, as on a
+    single wire CI-V bus. With chatter_interval the selected VFO is
+    tuned up by chatter_step every interval and reported with a
+    transceive frame.
+    """
+    def __init__(self, rig_def, baudrate=None, chatter_interval=None,
+                 chatter_step=10, echo=False):
+        super().__init__(CIV_Footer, baudrate)
+        config = rig_def['protocol_config']
+        self._address = config.get('address', DEFAULT_XCVR_ADDR)
+        self._controller = config.get('controller', DEFAULT_CONTROLLER_ADDR)
+        self._echo = echo
+        self._chatter_interval = chatter_interval
+        self._chatter_step = chatter_step
+        self._chatter_handle = None
+        self.frequencies = [14074000, 7074000]
+        self.modes = [0x01, 0x01]
+        self.selected = 0
+        self.split = False
+        self.tx = False
+
+    def start(self, loop=None):
+        super().start(loop)
+        if self._chatter_interval:
+            self._chatter_handle = self._loop.call_later(
+                self._chatter_interval, self._chatter)
+
+    def close(self):
+        if self._chatter_handle:
+            self._chatter_handle.cancel()
+            self._chatter_handle = None
+        super().close()
+
+    def frame_received(self, frame):
+        if self._echo:
+            self.send(frame)
+        start = 0
+        while start < len(frame) and frame[start] == CIV_Preamble:
+            start += 1
+        if len(frame) - start < 4 or frame[start] != self._address:
+            return
+        cmd = frame[start + 2]
+        data = frame[start + 3:-1]
+        try:
+            reply = self._command(cmd, data)
+        except (IndexError, ValueError, OverflowError):
+            reply = None
+        if reply is None:
+            _logger.debug('Rejected command: {}', frame.hex())
+            self._reply(CIV_NG)
+        elif reply is True:
+            self._reply(CIV_OK)
+        else:
+            self._reply(cmd, reply)
+
+    def _command(self, cmd, data):
+        # Returns the reply data, True for OK or None for NG
+        index = self.selected
+        if cmd == CMD_READ_FREQ:
+            return integer_to_bcd(self.frequencies[index], FREQ_BYTES)
+        elif cmd == CMD_SET_FREQ:
+            self.frequencies[index] = bcd_to_integer(data[0:FREQ_BYTES])
+            return True
+        elif cmd == CMD_READ_MODE:
+            return bytes((self.modes[index], DEFAULT_FILTER))
+        elif cmd == CMD_SET_MODE:
+            self.modes[index] = data[0]
+            return True
+        elif cmd == CMD_SELECT_VFO:
+            if data[0] not in (0, 1):
+                return None
+            self.selected = data[0]
+            return True
+        elif cmd == CMD_SPLIT:
+            if not data:
+                return bytes((int(self.split),))
+            self.split = bool(data[0])
+            return True
+        elif cmd == CMD_PTT and data[0] == 0x00:
+            if len(data) == 1:
+                return bytes((0x00, int(self.tx)))
+            self.tx = bool(data[1])
+            return True
+        elif cmd == CMD_VFO_FREQ:
+            vfo = index if data[0] == 0 else 1 - index
+            if len(data) == 1:
+                return bytes((data[0],)) + integer_to_bcd(self.frequencies[vfo], FREQ_BYTES)
+            self.frequencies[vfo] = bcd_to_integer(data[1:1 + FREQ_BYTES])
+            return True
+        return None
+
+    def _reply(self, cmd, data=b''):
+        self.send(b''.join((bytes((CIV_Preamble, CIV_Preamble, self._controller,
+                                   self._address, cmd)), data, CIV_Footer)))
+
+    def _chatter(self):
+        self._chatter_handle = self._loop.call_later(
+            self._chatter_interval, self._chatter)
+        self.frequencies[self.selected] += self._chatter_step
+        self.send(b''.join((
+            bytes((CIV_Preamble, CIV_Preamble, CIV_Broadcast, self._address,
+                   CMD_TRANSCEIVE_FREQ)),
+            integer_to_bcd(self.frequencies[self.selected], FREQ_BYTES),
+            CIV_Footer)))
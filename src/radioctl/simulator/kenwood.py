@@ -0,0 +1,247 @@
+from .base import PtySimulator
+from radioctl.protocol.kenwood.decoder import compile_response
+from radioctl.utils import logging
+from radioctl.utils.morse import duration
+
+import re
+
+
+_logger = logging.getLogger('simulator')
+
+_GROUP = re.compile(r'\(\?P<(\w+)>(\\d|\[[^\]]*\])(?:\{(\d+)\}|(\+))?\)')
+
+# Commands the rig accepts without a reply; AI sets the auto-info level.
+_ACCEPTED = (b'AI', b'DT', b'K2', b'K3')
+
+DEFAULT_VALUES = {
+    'vfo_0': {'freq': 14074000},
+    'vfo_1': {'freq': 7074000},
+    'mode_0': {'mode': 2},
+    'mode_1': {'mode': 2},
+    'rx_vfo': {'index': 0},
+    'tx_vfo': {'index': 0},
+    'keyer_speed': {'speed': 25},
+}
+
+# Characters of CW text the simulated keyer buffers; more are dropped.
+# It reports the buffer full once it could not take another full chunk.
+CW_BUFFER = 48
+
+
+class _Response:
+    """
+    Builds and parses the frames of one protocol_config response pattern.
+    """
+    def __init__(self, pattern):
+        self.decoder = compile_response(pattern)
+        self.parts = []
+        self.defaults = {}
+        pos = 0
+        for match in _GROUP.finditer(pattern):
+            self._literal(pattern[pos:match.start()])
+            (name, atom, count, plus) = match.groups()
+            width = None if plus else int(count or 1)
+            self.parts.append((name, width))
+            if atom == '\\d':
+                self.defaults[name] = 0
+            else:
+                # the first character the class allows
+                self.defaults[name] = atom[2] if atom[1] == '\\' else atom[1]
+            pos = match.end()
+        self._literal(pattern[pos:])
+
+    def _literal(self, text):
+        if text:
+            self.parts.append(re.sub(r'\\(.)', r'\1', text))
+
+    def format(self, values):
+        out = []
+        for part in self.parts:
+            if isinstance(part, str):
+                out.append(part)
+                continue
+            (name, width) = part
+            value = str(values.get(name, self.defaults[name]))
+            out.append(value.rjust(width, '0') if width else value)
+        return ''.join(out).encode()
+
+    def parse(self, frame):
+        fields = self.decoder.decode(frame)
+        if fields is None:
+            return None
+        values = {}
+        for part in self.parts:
+            if not isinstance(part, str):
+                value = fields[part[0]].decode()
+                values[part[0]] = int(value) if value.isdigit() else value
+        return values
+
+
+class KenwoodSimulator(PtySimulator):
+    """
+    Simulates a Kenwood style rig from the protocol_config of its rig
+    definition: every get command is answered from the simulated state
+    and every frame matching a response pattern sets it. The info (IF)
+    frame is assembled from the other handlers.
+
+    With chatter_interval, and auto-info enabled by the host (AI1 or
+    above), VFO A is tuned up by chatter_step every interval and the new
+    frequency is reported as the rig would when its knob is turned.
+
+    CW text sent with the cw send command is buffered and keyed a
+    character at a time at the keyer speed; cw_keyed is the text keyed
+    so far, cw_started and cw_finished the loop times the keyer last
+    started and went idle, and cw_starts the number of times it started,
+    more than once for one message if it ran dry. The cancel command empties the buffer and
+    records the time in cw_cancelled.
+    """
+    def __init__(self, rig_def, baudrate=None, chatter_interval=None,
+                 chatter_step=10):
+        super().__init__(b';', baudrate)
+        self._handlers = {}
+        self._responses = {}
+        self._gets = {}
+        self._sets = {}
+        self._values = {}
+        self._auto_info = 0
+        self._chatter_interval = chatter_interval
+        self._chatter_step = chatter_step
+        self._chatter_handle = None
+        self._cw_prefix = None
+        self._cw_cancel = None
+        self._cw_buffer = ''
+        self._cw_handle = None
+        self.tx = False
+        self.cw_keyed = ''
+        self.cw_started = None
+        self.cw_finished = None
+        self.cw_cancelled = None
+        self.cw_starts = 0
+        self.cw_overflows = 0
+        for (name, item) in rig_def['protocol_config'].items():
+            if isinstance(item, dict):
+                self._add_handler(name, item)
+        cw = rig_def['protocol_config'].get('cw')
+        if cw:
+            self._cw_prefix = cw['send'].split('{', 1)[0].encode()
+            self._cw_cancel = cw['cancel'].encode()
+            self._cw_length = int(cw['length'])
+
+    def _add_handler(self, name, item):
+        self._values[name] = dict(DEFAULT_VALUES.get(name, {}))
+        if 'response' in item:
+            response = _Response(item['response'])
+            prefix = response.format({})[0:3]
+            if prefix[2:3] != b'$':
+                prefix = prefix[0:2]
+            self._handlers.setdefault(prefix, []).append((name, response))
+            self._responses[name] = response
+            if 'get' in item:
+                self._gets[item['get'].encode()] = (name, response)
+        elif 'set' in item:
+            self._sets[item['set'].encode()] = name
+
+    def get(self, name, field):
+        return self._values[name][field]
+
+    def set(self, name, field, value):
+        self._values[name][field] = value
+
+    def start(self, loop=None):
+        super().start(loop)
+        if self._chatter_interval:
+            self._chatter_handle = self._loop.call_later(
+                self._chatter_interval, self._chatter)
+
+    def close(self):
+        if self._chatter_handle:
+            self._chatter_handle.cancel()
+            self._chatter_handle = None
+        if self._cw_handle:
+            self._cw_handle.cancel()
+            self._cw_handle = None
+        super().close()
+
+    def report(self, name):
+        """Send the response frame of a handler, as auto-info would."""
+        self.send(self._responses[name].format(self._current(name)))
+
+    def frame_received(self, frame):
+        if frame in self._gets:
+            (name, response) = self._gets[frame]
+            self.send(response.format(self._current(name)))
+            return
+        if frame == self._cw_cancel:
+            self._cancel_cw()
+        if frame in self._sets:
+            self.tx = self._sets[frame] == 'tx'
+            return
+        if self._cw_prefix and frame.startswith(self._cw_prefix):
+            self._buffer_cw(frame[len(self._cw_prefix):-1].decode())
+            return
+        prefix = frame[0:3] if frame[2:3] == b'$' else frame[0:2]
+        for (name, response) in self._handlers.get(prefix, ()):
+            values = response.parse(frame)
+            if values is not None:
+                self._values[name].update(values)
+                return
+        if prefix in _ACCEPTED:
+            if prefix == b'AI' and frame[2:3].isdigit():
+                self._auto_info = int(frame[2:3])
+            return
+        _logger.debug('Unknown command: {}', frame)
+        self.send(b'?;')
+
+    def _current(self, name):
+        if name == 'cw':
+            return {'full': int(len(self._cw_buffer) > CW_BUFFER - self._cw_length)}
+        if name != 'info':
+            return self._values[name]
+        values = dict(self._values[name])
+        rx = self._values['rx_vfo']['index']
+        tx = self._values['tx_vfo']['index']
+        values.update(
+            freq=self._values[f'vfo_{rx}']['freq'],
+            mode=self._values[f'mode_{rx}']['mode'],
+            vfo=rx,
+            split=int(rx != tx),
+            tx=int(self.tx))
+        return values
+
+    def _chatter(self):
+        self._chatter_handle = self._loop.call_later(
+            self._chatter_interval, self._chatter)
+        if self._auto_info:
+            self._values['vfo_0']['freq'] += self._chatter_step
+            self.report('vfo_0')
+
+    def _buffer_cw(self, text):
+        room = CW_BUFFER - len(self._cw_buffer)
+        if len(text) > room:
+            _logger.warning('CW buffer overflow, dropped {!r}', text[room:])
+            self.cw_overflows += 1
+            text = text[:room]
+        self._cw_buffer += text
+        if self._cw_handle is None:
+            self.cw_starts += 1
+            self.cw_started = self._loop.time()
+            self._key_cw()
+
+    def _key_cw(self):
+        if not self._cw_buffer:
+            self._cw_handle = None
+            self.cw_finished = self._loop.time()
+            return
+        char = self._cw_buffer[0]
+        self._cw_buffer = self._cw_buffer[1:]
+        self.cw_keyed += char
+        wpm = self._values['keyer_speed']['speed']
+        self._cw_handle = self._loop.call_later(duration(char, wpm), self._key_cw)
+
+    def _cancel_cw(self):
+        self.cw_cancelled = self._loop.time()
+        self._cw_buffer = ''
+        if self._cw_handle is not None:
+            self._cw_handle.cancel()
+            self._cw_handle = None
+            self.cw_finished = self.cw_cancelled
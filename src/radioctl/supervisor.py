@@ -0,0 +1,118 @@
+from .connection import SerialConnection
+from .hamlib.server import Server
+from .rigfactory import create_rig
+from .utils import logging
+
+import asyncio
+import yaml
+
+
+_logger = logging.getLogger('supervisor')
+
+DEFAULT_BAUDRATE = 9600
+DEFAULT_ITU_REGION = 2
+DEFAULT_TCP_BIND = '127.0.0.1'
+
+
+def load_config(filename):
+    with open(filename) as f:
+        return yaml.safe_load(f)
+
+
+class Supervisor:
+    """
+    Runs several rigs on one event loop, from a config such as:
+
+        tcp_bind: 127.0.0.1
+        shared_port: 4540          # optional, all rigs, see \\set_rig
+        rigs:
+            - name: run
+              radio: K3
+              serial_port: /dev/ttyUSB0
+              baudrate: 38400
+              tcp_port: 4532
+            - name: mult
+              radio: IC-7300
+              serial_port: /dev/ttyUSB1
+              baudrate: 19200
+              tcp_port: 4533
+
+    Each rig entry may also give low_latency, poll (default true),
+    itu_region (default the top level itu_region, or 2) and cfg, the
+    protocol configuration. A rig without tcp_port is only served on
+    the shared port. Port 0 picks a free port.
+
+    Rigs are isolated from each other: a rig whose serial port cannot be
+    opened, or whose connection is lost, is retried with backoff (see
+    SerialConnection) while the others carry on.
+    """
+    def __init__(self, config):
+        self._tcp_bind = config.get('tcp_bind', DEFAULT_TCP_BIND)
+        self._shared_port = config.get('shared_port')
+        itu_region = config.get('itu_region', DEFAULT_ITU_REGION)
+        self._entries = {}
+        self._rigs = {}
+        self._connections = {}
+        self._servers = []
+        ports = set()
+        for entry in config['rigs']:
+            name = str(entry['name'])
+            if name in self._rigs:
+                raise ValueError(f'Duplicate rig name in config: {name}')
+            port = entry.get('tcp_port')
+            if port:
+                if port in ports or port == self._shared_port:
+                    raise ValueError(f'TCP port {port} of rig {name} already in use')
+                ports.add(port)
+            self._entries[name] = entry
+            self._rigs[name] = create_rig(entry['radio'], entry.get('cfg', {}),
+                                          entry.get('itu_region', itu_region))
+        if not self._rigs:
+            raise ValueError('No rigs in config')
+
+    @property
+    def rigs(self):
+        return self._rigs
+
+    @property
+    def servers(self):
+        return self._servers
+
+    def connection(self, name):
+        return self._connections[name]
+
+    def is_connected(self, name):
+        connection = self._connections.get(name)
+        return connection is not None and connection.connected
+
+    async def start(self, loop):
+        """
+        Open every rig's serial port and start the rigctld servers.
+        """
+        for (name, rig) in self._rigs.items():
+            entry = self._entries[name]
+            connection = SerialConnection(
+                rig, entry['serial_port'], entry.get('baudrate', DEFAULT_BAUDRATE),
+                entry.get('low_latency', False), entry.get('poll', True))
+            self._connections[name] = connection
+            connection.start(loop)
+        await asyncio.gather(*(connection.wait_started()
+                               for connection in self._connections.values()))
+        for (name, rig) in self._rigs.items():
+            port = self._entries[name].get('tcp_port')
+            if port is not None:
+                self._servers.append(await Server(rig).start(self._tcp_bind, port))
+        if self._shared_port is not None:
+            first = next(iter(self._rigs.values()))
+            server = Server(first, rigs=self._rigs)
+            self._servers.append(await server.start(self._tcp_bind, self._shared_port))
+
+    async def close(self):
+        for server in self._servers:
+            server.close()
+        for server in self._servers:
+            await server.wait_closed()
+        self._servers = []
+        await asyncio.gather(*(connection.stop()
+                               for connection in self._connections.values()))
+        self._connections = {}
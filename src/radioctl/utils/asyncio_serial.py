@@ -20,6 +20,8 @@ import os
 
 import serial
 
+from . import logging
+
 try:
     import termios
 except ImportError:
@@ -27,6 +29,32 @@ except ImportError:
 
 __version__ = '0.4'
 
+_logger = logging.getLogger('serial')
+
+DEFAULT_READ_SIZE = 256
+MAX_READ_SIZE = 64 * 1024
+
+
+class TransportStats:
+    """Counters kept by a SerialTransport.
+
+    reads and writes count read and write system calls, read_callbacks
+    counts the times the event loop reported the port readable.
+    """
+    __slots__ = ['bytes_received', 'bytes_sent', 'reads', 'writes',
+                 'read_callbacks']
+
+    def __init__(self):
+        self.bytes_received = 0
+        self.bytes_sent = 0
+        self.reads = 0
+        self.writes = 0
+        self.read_callbacks = 0
+
+    def __repr__(self):
+        return '{}({})'.format(self.__class__.__name__, ', '.join(
+            '{}={}'.format(name, getattr(self, name)) for name in self.__slots__))
+
 
 class SerialTransport(asyncio.Transport):
     """An asyncio transport model of a serial communication channel.
@@ -42,9 +70,17 @@ class SerialTransport(asyncio.Transport):
     will call `create_serial_connection` which will create the
     transport and try to initiate the underlying communication channel,
     calling you back when it succeeds.
+
+    On posix platforms a port with a file descriptor is read directly
+    into a preallocated buffer, one system call per readable event; the
+    read size grows whenever a read fills it. Protocols derived from
+    asyncio.BufferedProtocol are given the read size as the size hint
+    and read into their own buffer. With low_latency the port is
+    switched to VMIN=1/VTIME=0 and, where the driver supports it, the
+    Linux ASYNC_LOW_LATENCY flag is set.
     """
 
-    def __init__(self, loop, protocol, serial_instance):
+    def __init__(self, loop, protocol, serial_instance, low_latency=False):
         super().__init__()
         self._loop = loop
         self._protocol = protocol
@@ -53,6 +89,14 @@ class SerialTransport(asyncio.Transport):
         self._protocol_paused = False
         self._max_read_size = 1024
         self._write_buffer = []
+        self._write_buffer_size = 0
+        self._stats = TransportStats()
+        self._low_latency = False
+        self._fd = self._native_fd()
+        self._read_size = DEFAULT_READ_SIZE
+        self._read_buffer = None
+        if self._fd is not None and not isinstance(protocol, asyncio.BufferedProtocol):
+            self._read_buffer = memoryview(bytearray(MAX_READ_SIZE))
         self._set_write_buffer_limits()
         self._has_reader = False
         self._has_writer = False
@@ -64,6 +108,9 @@ class SerialTransport(asyncio.Transport):
         self._serial.timeout = 0
         self._serial.write_timeout = 0
 
+        if low_latency:
+            self._set_low_latency()
+
         # These two callbacks will be enqueued in a FIFO queue by asyncio
         loop.call_soon(protocol.connection_made, self)
         loop.call_soon(self._ensure_reader)
@@ -78,6 +125,42 @@ class SerialTransport(asyncio.Transport):
         """The underlying Serial instance."""
         return self._serial
 
+    @property
+    def stats(self):
+        """The TransportStats counters of this transport."""
+        return self._stats
+
+    @property
+    def low_latency(self):
+        """True if the driver accepted the ASYNC_LOW_LATENCY flag."""
+        return self._low_latency
+
+    def _native_fd(self):
+        if os.name == 'nt':
+            return None
+        try:
+            return self._serial.fileno()
+        except (AttributeError, serial.SerialException, OSError):
+            # URL handlers such as loop:// have no file descriptor
+            return None
+
+    def _set_low_latency(self):
+        if self._fd is None or termios is None:
+            _logger.info('Low latency mode not supported on {}', self._serial.port)
+            return
+        # Wake up on the first byte rather than waiting for more
+        attrs = termios.tcgetattr(self._fd)
+        attrs[6][termios.VMIN] = 1
+        attrs[6][termios.VTIME] = 0
+        termios.tcsetattr(self._fd, termios.TCSANOW, attrs)
+        try:
+            self._serial.set_low_latency_mode(True)
+        except (AttributeError, ValueError) as e:
+            # Not Linux, or not a UART driver (a pty, some USB adapters)
+            _logger.info('ASYNC_LOW_LATENCY not set on {}: {}', self._serial.port, e)
+        else:
+            self._low_latency = True
+
     def __repr__(self):
         return '{self.__class__.__name__}({self.loop}, {self._protocol}, {self.serial})'.format(self=self)
 
@@ -98,14 +181,48 @@ class SerialTransport(asyncio.Transport):
             self._close(None)
 
     def _read_ready(self):
+        self._stats.read_callbacks += 1
+        if self._fd is not None:
+            self._read_native()
+            return
         try:
             data = self._serial.read(self._max_read_size)
         except serial.SerialException as e:
             self._close(exc=e)
         else:
+            self._stats.reads += 1
             if data:
+                self._stats.bytes_received += len(data)
                 self._protocol.data_received(data)
 
+    def _read_native(self):
+        size = self._read_size
+        buffered = self._read_buffer is None
+        if buffered:
+            buf = self._protocol.get_buffer(size)
+        else:
+            buf = self._read_buffer[:size]
+        try:
+            n = os.readv(self._fd, (buf,))
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            self._close(exc=serial.SerialException('read failed: {}'.format(e)))
+            return
+        self._stats.reads += 1
+        if n == 0:
+            self._close(exc=serial.SerialException(
+                'device reports readiness to read but returned no data '
+                '(device disconnected or multiple access on port?)'))
+            return
+        self._stats.bytes_received += n
+        if n == size and size < MAX_READ_SIZE:
+            self._read_size = size * 2
+        if buffered:
+            self._protocol.buffer_updated(n)
+        else:
+            self._protocol.data_received(bytes(buf[:n]))
+
     def write(self, data):
         """Write some data to the transport.
 
@@ -115,8 +232,9 @@ class SerialTransport(asyncio.Transport):
         if self._closing:
             return
 
-        if self.get_write_buffer_size() == 0:
+        if self._write_buffer_size == 0:
             # Attempt to send it right away first
+            self._stats.writes += 1
             try:
                 n = self._serial.write(data)
             except (BlockingIOError, InterruptedError):
@@ -124,6 +242,7 @@ class SerialTransport(asyncio.Transport):
             except serial.SerialException as exc:
                 self._fatal_error(exc, 'Fatal write error on serial transport')
                 return
+            self._stats.bytes_sent += n
             if n == len(data):
                 return  # Whole request satisfied
             assert 0 <= n < len(data)
@@ -131,6 +250,7 @@ class SerialTransport(asyncio.Transport):
             self._ensure_writer()
 
         self._write_buffer.append(data)
+        self._write_buffer_size += len(data)
         self._maybe_pause_protocol()
 
     def can_write_eof(self):
@@ -173,7 +293,7 @@ class SerialTransport(asyncio.Transport):
         This buffer is unbounded, so the result may be larger than the
         the high water mark.
         """
-        return sum(map(len, self._write_buffer))
+        return self._write_buffer_size
 
     def write_eof(self):
         raise NotImplementedError("Serial connections do not support end-of-file")
@@ -246,14 +366,18 @@ class SerialTransport(asyncio.Transport):
         assert data, 'Write buffer should not be empty'
 
         self._write_buffer.clear()
+        self._write_buffer_size = 0
 
+        self._stats.writes += 1
         try:
             n = self._serial.write(data)
         except (BlockingIOError, InterruptedError):
             self._write_buffer.append(data)
+            self._write_buffer_size = len(data)
         except serial.SerialException as exc:
             self._fatal_error(exc, 'Fatal write error on serial transport')
         else:
+            self._stats.bytes_sent += n
             if n == len(data):
                 assert self._flushed()
                 self._remove_writer()
@@ -269,6 +393,7 @@ class SerialTransport(asyncio.Transport):
             assert 0 <= n < len(data)
             data = data[n:]
             self._write_buffer.append(data)  # Try again later
+            self._write_buffer_size = len(data)
             self._maybe_resume_protocol()
             assert self._has_writer
 
@@ -402,16 +527,18 @@ class SerialTransport(asyncio.Transport):
             self._protocol.connection_lost(exc)
         finally:
             self._write_buffer.clear()
+            self._write_buffer_size = 0
             self._serial.close()
             self._serial = None
             self._protocol = None
             self._loop = None
 
 
-async def create_serial_connection(loop, protocol_factory, *args, **kwargs):
+async def create_serial_connection(loop, protocol_factory, *args,
+                                   low_latency=False, **kwargs):
     ser = serial.serial_for_url(*args, **kwargs)
     protocol = protocol_factory()
-    transport = SerialTransport(loop, protocol, ser)
+    transport = SerialTransport(loop, protocol, ser, low_latency=low_latency)
     return (transport, protocol)
 
 
@@ -1,25 +1,81 @@
-#TODO endianess!!
+"""
+Packed BCD codec, two decimal digits per byte.
 
-def bcd_to_integer(bcd):
+CI-V sends frequencies least significant byte first (byteorder 'little');
+other fields, such as levels, are most significant byte first ('big').
+Bytes are converted through lookup tables rather than nibble arithmetic.
+"""
+
+__all__ = ['bcd_to_integer', 'integer_to_bcd', 'decode_many', 'encode_many']
+
+
+# byte -> 0..99, or -1 if either nibble is not a decimal digit
+_DECODE = tuple(
+    (b >> 4) * 10 + (b & 0xF) if (b >> 4) < 10 and (b & 0xF) < 10 else -1
+    for b in range(256))
+
+# 0..99 -> byte
+_ENCODE = bytes(((v // 10) << 4) | (v % 10) for v in range(100))
+
+
+def bcd_to_integer(bcd, byteorder='little'):
+    """
+    Decode a bytes-like object of packed BCD. Raises ValueError if a
+    nibble is not a decimal digit.
+    """
+    if byteorder == 'little':
+        bcd = reversed(bcd)
+    elif byteorder != 'big':
+        raise ValueError("byteorder must be either 'little' or 'big'")
     result = 0
-    mult = 1
     for byteval in bcd:
-        lower = byteval & 0xF
-        upper = (byteval & 0xF0) >> 4
-        result += (upper * 10 + lower) * mult
-        mult *= 100
+        value = _DECODE[byteval]
+        if value < 0:
+            raise ValueError(f'Invalid BCD byte: 0x{byteval:02x}')
+        result = result * 100 + value
     return result
 
-def integer_to_bcd(i):
-    result = b''
 
-    while i > 0:
-        a = i % 10
-        i //= 10
-        a |= (i % 10) << 4
-        i //= 10
-        result += bytes([a])
+def integer_to_bcd(i, width=None, byteorder='little'):
+    """
+    Encode a non-negative integer as packed BCD. With a width the result
+    is zero padded to that many bytes, and OverflowError is raised if the
+    value does not fit; otherwise it is as short as possible (one byte
+    for zero).
+    """
+    if i < 0:
+        raise OverflowError('Cannot encode a negative value as BCD')
+    result = bytearray()
+    while i:
+        (i, pair) = divmod(i, 100)
+        result.append(_ENCODE[pair])
+    if width is not None:
+        if len(result) > width:
+            raise OverflowError(f'Value too large for {width} BCD bytes')
+        result.extend(bytes(width - len(result)))
+    elif not result:
+        result.append(0)
+    if byteorder == 'big':
+        result.reverse()
+    elif byteorder != 'little':
+        raise ValueError("byteorder must be either 'little' or 'big'")
+    return bytes(result)
+
+
+def decode_many(data, width, byteorder='little'):
+    """
+    Decode consecutive fixed width BCD values, e.g. from a memory channel
+    dump. The length of data must be a multiple of width.
+    """
+    if len(data) % width:
+        raise ValueError(f'Data length {len(data)} is not a multiple of {width}')
+    data = memoryview(data)
+    return [bcd_to_integer(data[offset:offset + width], byteorder)
+            for offset in range(0, len(data), width)]
 
-    return result
 
-assert(integer_to_bcd(123456) == b'\x56\x34\x12')
+def encode_many(values, width, byteorder='little'):
+    """
+    Encode a sequence of values as consecutive fixed width BCD.
+    """
+    return b''.join(integer_to_bcd(value, width, byteorder) for value in values)
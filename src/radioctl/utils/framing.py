@@ -0,0 +1,84 @@
+from . import logging
+
+import asyncio
+import traceback
+
+
+_logger = logging.getLogger('framing')
+
+DEFAULT_MAX_FRAME_SIZE = 4096
+
+
+class FrameProtocol(asyncio.Protocol):
+    """
+    An asyncio protocol splitting a byte stream into frames which end
+    with a delimiter.
+
+    Each complete frame is handed to frame_received() as a memoryview
+    slice of the received data, delimiter included, so no bytes are
+    copied to find or dispatch it. The view is only valid for the
+    duration of the call; callers must copy whatever they keep. Only a
+    trailing partial frame is carried over, in a reusable bytearray.
+    An exception raised by frame_received() is logged and the next frame
+    handled.
+    """
+    def __init__(self, delimiter, frame_received, connection_lost=None,
+                 max_frame_size=DEFAULT_MAX_FRAME_SIZE):
+        self._delimiter = delimiter
+        self._frame_received = frame_received
+        self._connection_lost = connection_lost
+        self._max_frame_size = max_frame_size
+        self._partial = bytearray()
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def connection_lost(self, exc):
+        self.transport = None
+        del self._partial[:]
+        if self._connection_lost:
+            self._connection_lost(exc)
+
+    def data_received(self, data):
+        partial = self._partial
+        try:
+            if partial:
+                partial += data
+                self._scan(partial)
+            else:
+                remainder = self._scan(data)
+                if remainder:
+                    partial += remainder
+        finally:
+            if len(partial) > self._max_frame_size:
+                _logger.warning('Discarding {} bytes without a frame delimiter',
+                                len(partial))
+                del partial[:]
+
+    def _scan(self, data):
+        # Hands every complete frame in data to frame_received() and
+        # returns what is left after the last delimiter.
+        delimiter = self._delimiter
+        width = len(delimiter)
+        frame_received = self._frame_received
+        find = data.find
+        start = 0
+        with memoryview(data) as view:
+            end = find(delimiter)
+            while end >= 0:
+                end += width
+                try:
+                    frame_received(view[start:end])
+                except Exception:
+                    # one bad frame must not stall the ones after it. The
+                    # traceback is logged as text: a record keeping it would
+                    # keep the frame's view, and data could not be resized.
+                    _logger.error('Error handling frame {!r}\n{}',
+                                  bytes(view[start:end]), traceback.format_exc())
+                start = end
+                end = find(delimiter, start)
+        if data is self._partial:
+            del data[:start]
+            return None
+        return data[start:]
@@ -1,5 +1,7 @@
 import logging
 
+from logging import CRITICAL, DEBUG, ERROR, INFO, WARNING
+
 class BraceStyleLogRecord(logging.LogRecord):
     def getMessage(self):
         """
@@ -0,0 +1,41 @@
+__ALL__ = ['dit_time', 'duration', 'units']
+
+
+CODE = {
+    'A': '.-', 'B': '-...', 'C': '-.-.', 'D': '-..', 'E': '.', 'F': '..-.',
+    'G': '--.', 'H': '....', 'I': '..', 'J': '.---', 'K': '-.-', 'L': '.-..',
+    'M': '--', 'N': '-.', 'O': '---', 'P': '.--.', 'Q': '--.-', 'R': '.-.',
+    'S': '...', 'T': '-', 'U': '..-', 'V': '...-', 'W': '.--', 'X': '-..-',
+    'Y': '-.--', 'Z': '--..',
+    '0': '-----', '1': '.----', '2': '..---', '3': '...--', '4': '....-',
+    '5': '.....', '6': '-....', '7': '--...', '8': '---..', '9': '----.',
+    '.': '.-.-.-', ',': '--..--', '?': '..--..', '/': '-..-.', '=': '-...-',
+    '+': '.-.-.', '-': '-....-', '(': '-.--.', ')': '-.--.-', "'": '.----.',
+    '"': '.-..-.', ':': '---...', '@': '.--.-.', '!': '-.-.--', '&': '.-...',
+}
+
+# Dits per character: a dit or dah each, a dit between them and three
+# after the character. A space stretches that gap to the seven of a
+# word space.
+_UNITS = {char: sum(1 if element == '.' else 3 for element in code) + len(code) + 2
+          for (char, code) in CODE.items()}
+_UNITS[' '] = 4
+
+
+def units(text):
+    """
+    The length of text in dits; characters without a code take no time.
+    """
+    return sum(_UNITS.get(char, 0) for char in text.upper())
+
+
+def dit_time(wpm):
+    # PARIS, 50 dits, sent wpm times a minute
+    return 1.2 / wpm
+
+
+def duration(text, wpm):
+    """
+    Seconds to key text at wpm words per minute.
+    """
+    return units(text) * dit_time(wpm)
@@ -1,10 +1,9 @@
-from weakref import *
-
-import inspect
+from types import MethodType
+from weakref import ref
 
 
 class Signal:
-    __slots__ = ['slots', 'funchost']
+    __slots__ = ['_slots', '_keys', '__weakref__']
 
     """
     class Signal
@@ -17,74 +16,70 @@ class Signal:
     slot is a member of a class, Signal will automatically detect when
     the method's class instance has been deleted and remove it from
     its list of connected slots.
+
+    Emitting walks a tuple of (function, instance reference) pairs which
+    is rebuilt on every connect/disconnect, so slots may connect or
+    disconnect (or be garbage collected) while the signal is being
+    emitted. Plain callables are held strongly and called directly. Bound
+    methods are split into their function and a weak reference to their
+    instance whose finalizer removes the slot once the instance is
+    collected; unlike weakref.WeakMethod this needs no bound method to
+    be rebuilt on every call.
     """
     def __init__(self):
-        self.slots = []
-
-        # for keeping references to _WeakMethod_FuncHost objects.
-        # If we didn't, then the weak references would die for
-        # non-method slots that we've created.
-        self.funchost = []
+        self._slots = ()
+        self._keys = {}
 
     def __call__(self, *args, **kwargs):
-        for (i, slot) in enumerate(self.slots):
-            if slot != None:
-                slot(*args, **kwargs)
+        for (func, instance) in self._slots:
+            if instance is None:
+                func(*args, **kwargs)
             else:
-                del self.slots[i]
-
+                instance = instance()
+                if instance is not None:
+                    func(instance, *args, **kwargs)
 
     def call(self, *args, **kwargs):
         self.__call__(*args, **kwargs)
 
     def connect(self, slot):
-        self.disconnect(slot)
-        if inspect.ismethod(slot):
-            self.slots.append(_WeakMethod(slot))
+        key = _slot_key(slot)
+        self._keys.pop(key, None)
+        if type(slot) is MethodType:
+            instance = ref(slot.__self__, _reaper(self, key))
+            self._keys[key] = (slot.__func__, instance)
         else:
-            o = _WeakMethod_FuncHost(slot)
-            self.slots.append(_WeakMethod(o.func))
-            # we stick a copy in here just to keep the instance alive
-            self.funchost.append(o)
+            self._keys[key] = (slot, None)
+        self._slots = tuple(self._keys.values())
 
     def disconnect(self, slot):
-        try:
-            for i in range(len(self.slots)):
-                wm = self.slots[i]
-                if inspect.ismethod(slot):
-                    if wm.f == slot.im_func and wm.c() == slot.im_self:
-                        del self.slots[i]
-                        return
-                else:
-                    if wm.c().func == slot:
-                        del self.slots[i]
-                        return
-        except:
-            pass
+        if self._keys.pop(_slot_key(slot), None) is not None:
+            self._slots = tuple(self._keys.values())
 
     def disconnectAll(self):
-        del self.slots[:]
-        del self.funchost[:]
+        self._keys.clear()
+        self._slots = ()
 
+    def _reap(self, key, instance):
+        entry = self._keys.get(key)
+        if entry is not None and entry[1] is instance:
+            del self._keys[key]
+            self._slots = tuple(self._keys.values())
 
-class _WeakMethod_FuncHost:
-    __slots__ = ['f', '__weakref__']
 
-    def __init__(self, func):
-        self.f = func
+def _slot_key(slot):
+    if type(slot) is MethodType:
+        return (id(slot.__self__), slot.__func__)
+    return slot
 
-    def func(self, *args, **kwargs):
-        self.f(*args, **kwargs)
 
+def _reaper(signal, key):
+    # Only a weak reference to the signal is kept so a dead slot never
+    # keeps its signal alive.
+    signal = ref(signal)
 
-class _WeakMethod:
-    __slots__ = ['f', 'c']
-
-    def __init__(self, f):
-        self.f = f.__func__
-        self.c = ref(f.__self__)
-
-    def __call__(self, *args, **kwargs):
-        if self.c() == None :
-            return
-        self.f(self.c(), *args, **kwargs)
+    def reap(instance):
+        s = signal()
+        if s is not None:
+            s._reap(key, instance)
+    return reap
@@ -0,0 +1,103 @@
+from radioctl.utils import asyncio_serial
+from radioctl.utils.framing import FrameProtocol
+
+import asyncio
+import os
+import termios
+import unittest
+
+
+class Collector(asyncio.BufferedProtocol):
+    def __init__(self):
+        self.buffer = bytearray(asyncio_serial.MAX_READ_SIZE)
+        self.data = bytearray()
+        self.sizehints = []
+
+    def get_buffer(self, sizehint):
+        self.sizehints.append(sizehint)
+        return memoryview(self.buffer)[:sizehint]
+
+    def buffer_updated(self, nbytes):
+        self.data += self.buffer[:nbytes]
+
+
+@unittest.skipUnless(hasattr(os, 'openpty'), 'needs a pty')
+class SerialTransportTest(unittest.TestCase):
+    # The pty slave stands in for the serial port, the master for the rig.
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        (self.master, slave) = os.openpty()
+        self.port = os.ttyname(slave)
+        os.close(slave)
+        self.frames = []
+        # cleanups run last in, first out: transports close before these
+        self.addCleanup(self.loop.close)
+        self.addCleanup(lambda: os.close(self.master))
+
+    def connect(self, protocol_factory, low_latency=False):
+        (transport, protocol) = self.loop.run_until_complete(
+            asyncio_serial.create_serial_connection(
+                self.loop, protocol_factory, url=self.port, baudrate=38400,
+                low_latency=low_latency))
+        self.addCleanup(self.close, transport)
+        return (transport, protocol)
+
+    def close(self, transport):
+        if not transport.is_closing():
+            transport.abort()
+            self.loop.run_until_complete(asyncio.sleep(0))
+
+    def frame_protocol(self):
+        return FrameProtocol(b';', lambda frame: self.frames.append(bytes(frame)))
+
+    def run_until(self, predicate):
+        async def wait():
+            while not predicate():
+                await asyncio.sleep(0.001)
+        self.loop.run_until_complete(asyncio.wait_for(wait(), 1))
+
+    def test_read_write(self):
+        (transport, _) = self.connect(self.frame_protocol)
+        os.write(self.master, b'FA00007074000;FB000')
+        os.write(self.master, b'14074000;')
+        self.run_until(lambda: len(self.frames) == 2)
+        self.assertEqual([b'FA00007074000;', b'FB00014074000;'], self.frames)
+        transport.write(b'FA;FB;')
+        self.assertEqual(b'FA;FB;', os.read(self.master, 100))
+        stats = transport.stats
+        self.assertEqual(28, stats.bytes_received)
+        self.assertEqual(6, stats.bytes_sent)
+        self.assertEqual(1, stats.writes)
+        self.assertGreaterEqual(stats.read_callbacks, stats.reads)
+        self.assertEqual(0, transport.get_write_buffer_size())
+
+    def test_low_latency_on_pty(self):
+        (transport, _) = self.connect(self.frame_protocol, low_latency=True)
+        # a pty has no UART, so only the termios settings apply
+        self.assertFalse(transport.low_latency)
+        cc = termios.tcgetattr(transport.serial.fileno())[6]
+        self.assertEqual(1, cc[termios.VMIN])
+        self.assertEqual(0, cc[termios.VTIME])
+        os.write(self.master, b'FR0;')
+        self.run_until(lambda: self.frames)
+
+    def test_buffered_protocol_read_size(self):
+        (transport, protocol) = self.connect(Collector)
+        data = bytes(range(256)) * 8
+        os.write(self.master, data)
+        self.run_until(lambda: len(protocol.data) == len(data))
+        self.assertEqual(data, bytes(protocol.data))
+        self.assertEqual(asyncio_serial.DEFAULT_READ_SIZE, protocol.sizehints[0])
+        # each full read doubles the next one
+        self.assertGreater(protocol.sizehints[-1], protocol.sizehints[0])
+        self.assertEqual(len(protocol.sizehints), transport.stats.reads)
+
+    def test_hangup(self):
+        lost = []
+        (transport, _) = self.connect(
+            lambda: FrameProtocol(b';', self.frames.append, lost.append))
+        self.loop.run_until_complete(asyncio.sleep(0))
+        os.close(self.master)
+        self.master = os.open(os.devnull, os.O_RDONLY)
+        self.run_until(lambda: lost)
+        self.assertIsNotNone(lost[0])
@@ -0,0 +1,83 @@
+from radioctl.utils.bcd import (
+    bcd_to_integer, decode_many, encode_many, integer_to_bcd)
+
+import random
+import unittest
+
+
+class BcdTest(unittest.TestCase):
+    # Property checks over random values; the seed keeps failures
+    # reproducible.
+    SEED = 7300
+    SAMPLES = 2000
+
+    def setUp(self):
+        self.rng = random.Random(self.SEED)
+
+    def random_values(self, width):
+        limit = 100 ** width
+        return [self.rng.randrange(limit) for _ in range(self.SAMPLES)]
+
+    def test_examples(self):
+        self.assertEqual(b'\x56\x34\x12', integer_to_bcd(123456))
+        self.assertEqual(b'\x12\x34\x56', integer_to_bcd(123456, byteorder='big'))
+        self.assertEqual(b'\x00\x40\x07\x07\x00', integer_to_bcd(7074000, 5))
+        self.assertEqual(7074000, bcd_to_integer(b'\x00\x40\x07\x07\x00'))
+        self.assertEqual(b'\x00', integer_to_bcd(0))
+        self.assertEqual(b'\x00' * 5, integer_to_bcd(0, 5))
+        self.assertEqual(0, bcd_to_integer(b''))
+
+    def test_round_trip(self):
+        for width in (1, 2, 5, 8):
+            for value in self.random_values(width):
+                for byteorder in ('little', 'big'):
+                    encoded = integer_to_bcd(value, width, byteorder)
+                    self.assertEqual(width, len(encoded))
+                    self.assertEqual(value, bcd_to_integer(encoded, byteorder))
+
+    def test_matches_decimal_digits(self):
+        # big endian BCD reads as the decimal digits in hex
+        for value in self.random_values(5):
+            encoded = integer_to_bcd(value, 5, 'big')
+            self.assertEqual(f'{value:010d}', encoded.hex())
+            self.assertEqual(encoded[::-1], integer_to_bcd(value, 5))
+
+    def test_minimal_width(self):
+        for value in self.random_values(6):
+            encoded = integer_to_bcd(value)
+            self.assertEqual(max(1, (len(str(value)) + 1) // 2), len(encoded))
+            self.assertEqual(value, bcd_to_integer(encoded))
+
+    def test_invalid_nibbles(self):
+        for byteval in range(256):
+            valid = (byteval >> 4) < 10 and (byteval & 0xF) < 10
+            data = bytes((0x00, byteval, 0x12))
+            if valid:
+                bcd_to_integer(data)
+            else:
+                with self.assertRaises(ValueError):
+                    bcd_to_integer(data)
+
+    def test_overflow(self):
+        with self.assertRaises(OverflowError):
+            integer_to_bcd(100000, 2)
+        with self.assertRaises(OverflowError):
+            integer_to_bcd(-1)
+        self.assertEqual(b'\x99\x99', integer_to_bcd(9999, 2))
+
+    def test_byteorder(self):
+        with self.assertRaises(ValueError):
+            integer_to_bcd(1, byteorder='middle')
+        with self.assertRaises(ValueError):
+            bcd_to_integer(b'\x01', byteorder='middle')
+
+    def test_batch(self):
+        values = self.random_values(5)
+        for byteorder in ('little', 'big'):
+            dump = encode_many(values, 5, byteorder)
+            self.assertEqual(5 * len(values), len(dump))
+            self.assertEqual(values, decode_many(dump, 5, byteorder))
+            self.assertEqual(values, decode_many(memoryview(dump), 5, byteorder))
+        self.assertEqual([], decode_many(b'', 5))
+        with self.assertRaises(ValueError):
+            decode_many(b'\x00' * 7, 5)
@@ -0,0 +1,91 @@
+from radioctl.connection import SerialConnection
+from radioctl.radio_registry import load_all, radio_definition
+from radioctl.rigfactory import create_rig
+from radioctl.simulator import create_simulator
+
+import asyncio
+import os
+import types
+import unittest
+import unittest.mock
+
+
+load_all()
+
+
+@unittest.skipUnless(hasattr(os, 'openpty'), 'needs a pty')
+class SerialConnectionTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(asyncio.set_event_loop, None)
+        self.addCleanup(self.loop.close)
+        self.rig = create_rig('K3', {}, itu_region=2)
+
+    def start(self, port, **kwargs):
+        connection = SerialConnection(self.rig, port, 38400, **kwargs)
+        connection.start(self.loop)
+        self.addCleanup(self.loop.run_until_complete, connection.stop())
+        return connection
+
+    def wait(self, coro):
+        return self.loop.run_until_complete(asyncio.wait_for(coro, 2))
+
+    async def until(self, condition):
+        while not condition():
+            await asyncio.sleep(0.001)
+
+    def test_reconnect_and_resync(self):
+        sim = create_simulator(radio_definition('K3'))
+        sim.start(self.loop)
+        self.addCleanup(sim.close)
+        connection = self.start(sim.port)
+        self.wait(connection.wait_connected())
+        vfo = self.rig.model.get_vfo(0)
+        self.wait(vfo.refresh('frequency'))
+        self.assertEqual(14074000, vfo.frequency)
+
+        # the port drops out while the rig is retuned
+        self.rig.protocol.close()
+        sim.set('vfo_0', 'freq', 7074000)
+        self.wait(self.until(lambda: connection.connects == 2))
+
+        # the startup commands were replayed and the model, invalidated
+        # while offline, queried again
+        self.wait(vfo.refresh('frequency', max_age=60))
+        self.assertEqual(7074000, vfo.frequency)
+        self.assertTrue(self.rig.model.online)
+        self.assertEqual(2, connection.connects)
+        self.assertEqual(2, sim._auto_info)
+
+    def test_backoff(self):
+        connection = self.start('/nonexistent/tty', min_delay=0.01, max_delay=0.04)
+        self.wait(connection.wait_started())
+        self.assertFalse(connection.connected)
+        self.assertFalse(self.rig.model.online)
+        # retried after 0.01, 0.02, 0.04, 0.04...
+        self.wait(asyncio.sleep(0.1))
+        self.assertIn(connection.failures, (4, 5))
+
+    def test_flapping_port_backs_off(self):
+        # the port opens, then drops at once, every time
+        times = []
+
+        async def connect_serial(loop, *args):
+            times.append(loop.time())
+            closed = loop.create_future()
+            closed.set_result(None)
+            return closed
+        rig = types.SimpleNamespace(connect_serial=connect_serial,
+                                    model=unittest.mock.MagicMock(),
+                                    close=unittest.mock.MagicMock())
+        connection = SerialConnection(rig, 'flapping', 38400, min_delay=0.01,
+                                      max_delay=0.04)
+        connection.start(self.loop)
+        self.addCleanup(self.loop.run_until_complete, connection.stop())
+        self.wait(asyncio.sleep(0.15))
+        # reconnected after at least 0.01, 0.02, 0.04, 0.04...
+        self.assertTrue(3 <= len(times) <= 6, times)
+        gaps = [later - earlier for (earlier, later) in zip(times, times[1:])]
+        for (gap, delay) in zip(gaps, (0.01, 0.02, 0.04, 0.04, 0.04)):
+            self.assertGreaterEqual(gap, delay * 0.99)
@@ -0,0 +1,125 @@
+from radioctl.bridge.cwdaemon import CWDaemonListener, CWDaemonListenerProtocol
+from radioctl.msgbus import MsgBus, MsgType
+from radioctl.radio_registry import load_all, radio_definition
+from radioctl.rigfactory import create_rig
+from radioctl.simulator import create_simulator
+
+import asyncio
+import os
+import socket
+import unittest
+import unittest.mock
+
+
+load_all()
+
+ADDR = ('127.0.0.1', 12345)
+
+
+class CWDaemonProtocolTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.msgbus = MsgBus()
+        self.callbacks = unittest.mock.MagicMock()
+        for msgtype in (MsgType.MORSE_SEND, MsgType.MORSE_CANCEL,
+                        MsgType.KEYER_SPEED_SET, MsgType.TRANSMIT_SET,
+                        MsgType.RECEIVE_SET):
+            self.msgbus[msgtype].connect(getattr(self.callbacks, msgtype.name))
+        self.transport = unittest.mock.MagicMock()
+        self.protocol = CWDaemonListenerProtocol(self.msgbus)
+        self.protocol.connection_made(self.transport)
+
+    def tearDown(self):
+        self.protocol.connection_lost(None)
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def run_once(self):
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+    def receive(self, *datagrams):
+        for data in datagrams:
+            self.protocol.datagram_received(data, ADDR)
+
+    def test_burst_batched(self):
+        self.receive(b'CQ ', b'TEST~', b'N0CALL\x00')
+        self.callbacks.MORSE_SEND.assert_not_called()
+        self.run_once()
+        self.callbacks.MORSE_SEND.assert_called_once_with('CQ TEST N0CALL')
+
+    def test_commands_in_order(self):
+        self.receive(b'CQ ', b'\x1b230', b'TEST')
+        self.callbacks.MORSE_SEND.assert_called_once_with('CQ ')
+        self.callbacks.KEYER_SPEED_SET.assert_called_once_with(30)
+        self.run_once()
+        self.callbacks.MORSE_SEND.assert_called_with('TEST')
+
+    def test_echo_on_completion(self):
+        self.receive(b'\x1bhdone', b'5NN')
+        self.run_once()
+        self.transport.sendto.assert_not_called()
+        self.msgbus[MsgType.MORSE_COMPLETE]()
+        self.transport.sendto.assert_called_once_with(b'hdone\r\n', ADDR)
+        # one echo per request
+        self.msgbus[MsgType.MORSE_COMPLETE]()
+        self.transport.sendto.assert_called_once()
+
+    def test_abort(self):
+        self.receive(b'\x1bhdone', b'CQ TEST', b'\x1b4')
+        self.callbacks.MORSE_CANCEL.assert_called_once_with()
+        self.transport.sendto.assert_called_once_with(b'hdone\r\n', ADDR)
+        self.run_once()
+        self.callbacks.MORSE_SEND.assert_called_once_with('CQ TEST')
+
+    def test_ptt(self):
+        self.receive(b'\x1ba1')
+        self.callbacks.TRANSMIT_SET.assert_called_once_with()
+        self.receive(b'\x1ba0')
+        self.callbacks.RECEIVE_SET.assert_called_once_with()
+
+    def test_bad_speed(self):
+        self.receive(b'\x1b2fast')
+        self.callbacks.KEYER_SPEED_SET.assert_not_called()
+
+
+@unittest.skipUnless(hasattr(os, 'openpty'), 'needs a pty')
+class CWDaemonSimulatorTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(asyncio.set_event_loop, None)
+        self.addCleanup(self.loop.close)
+
+    def test_echo_timing(self):
+        sim = create_simulator(radio_definition('K3'))
+        sim.start(self.loop)
+        self.addCleanup(sim.close)
+        sim.set('keyer_speed', 'speed', 400)
+        rig = create_rig('K3', {}, itu_region=2)
+        closed = self.loop.run_until_complete(
+            rig.connect_serial(self.loop, sim.port, 38400, poll=False))
+        self.addCleanup(self.loop.run_until_complete, closed)
+        self.addCleanup(rig.close)
+        listener = CWDaemonListener()
+        transport = self.loop.run_until_complete(
+            listener.start(rig, self.loop, '127.0.0.1', 0))
+        self.addCleanup(listener.close)
+        port = transport.get_extra_info('sockname')[1]
+
+        client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(client.close)
+        client.bind(('127.0.0.1', 0))
+        client.setblocking(False)
+        for data in (b'\x1bhecho', b'CQ TEST ', b'N0CALL'):
+            client.sendto(data, ('127.0.0.1', port))
+
+        reply = self.loop.run_until_complete(
+            asyncio.wait_for(self.loop.sock_recv(client, 64), 3))
+        received = self.loop.time()
+        self.assertEqual(b'hecho\r\n', reply)
+        self.assertEqual('CQ TEST N0CALL', sim.cw_keyed)
+        # the echo comes close to the end of keying, which may be just
+        # after it
+        self.loop.run_until_complete(asyncio.sleep(0.1))
+        self.assertLess(abs(received - sim.cw_finished), 0.05)
@@ -1,13 +1,17 @@
+from radioctl.bands import Band, BandIndex
 from radioctl.capabilities import *
 from radioctl.hamlib.formatters import *
+from radioctl.hamlib.server import Session
 from radioctl.model import *
 from radioctl.msgbus import *
 from radioctl.protocol.kenwood.protocol import Protocol as KenwoodProtocol
 from radioctl.radio_registry import load_all
 from radioctl.rigfactory import create_rig
 
+import asyncio
 import os
 import unittest
+import unittest.mock
 import yaml
 
 RIGSDB = os.getenv('RIGSDB')
@@ -27,6 +31,39 @@ class ElecraftK3Capabilities(unittest.TestCase):
         self.assertEquals((0.01, 100), self.caps.rf_power)
         # TODO more here
 
+    def test_band_lookup(self):
+        self.assertEqual((310000, 32000000), self.caps.rx_band(7074000).freq_range)
+        self.assertEqual((310000, 32000000), self.caps.rx_band(310000).freq_range)
+        self.assertEqual((44000000, 54000000), self.caps.rx_band(54000000).freq_range)
+        self.assertIsNone(self.caps.rx_band(32000001))
+        self.assertIsNone(self.caps.rx_band(144300000))
+        self.assertIsNone(self.caps.rx_band(100))
+        band = self.caps.tx_band(14074000)
+        self.assertEqual((14000000, 14350000), band.freq_range)
+        self.assertEqual(100, band.high_power)
+        self.assertIsNone(self.caps.tx_band(14350001))
+        self.assertIsNone(self.caps.tx_band(10000000))
+
+    def test_overlapping_rx_bands_merged(self):
+        caps = Capabilities(itu_region=2)
+        caps.add_vfos('A', 'B')
+        caps.add_rx_band(100000, 30000000)
+        caps.add_rx_band(50000000, 54000000)
+        caps.add_rx_band(29000000, 44000000)
+        caps.add_rx_band(200000, 500000)
+        caps.freeze()
+        self.assertEqual([(100000, 44000000), (50000000, 54000000)],
+                         [band.freq_range for band in caps.rx_bands])
+        self.assertIs(caps.rx_bands[0], caps.rx_band(35000000))
+        self.assertIsNone(caps.rx_band(45000000))
+
+    def test_overlapping_index(self):
+        bands = [Band(), Band()]
+        bands[0].set_freq_range(100000, 30000000)
+        bands[1].set_freq_range(29000000, 54000000)
+        with self.assertRaises(ValueError):
+            BandIndex(bands)
+
     def test_hamlib_dump_state(self):
         f = CapabilitiesFormatter(self.caps)
         expected = \
@@ -65,6 +102,26 @@ class ElecraftK3Capabilities(unittest.TestCase):
 '''
         self.assertEquals(expected, str(f))
 
+    def test_dump_state_cached(self):
+        text = dump_state(self.caps)
+        self.assertEqual(str(CapabilitiesFormatter(self.caps)), text)
+        self.assertIs(text, dump_state(self.caps))
+        with self.assertRaises(ValueError):
+            dump_state(self.caps, version=1)
+
+    def test_levels_funcs_parms(self):
+        with open(os.path.join(RIGSDB, 'elecraft_k3.yaml')) as f:
+            rig_def = yaml.full_load(f)
+        rig_def['levels'] = {'get': ['AF', 'RF', 'STRENGTH'], 'set': ['AF', 'RF']}
+        rig_def['funcs'] = ['NB', 'VOX']
+        rig_def['parms'] = {'get': ['BEEP']}
+        caps = load_rig_definition(rig_def, itu_region=2)
+        lines = dump_state(caps).splitlines()
+        self.assertEqual(['0xa', '0xa', '0x40000018', '0x18', '0x10', '0x0'],
+                         lines[-6:])
+        self.assertIn('Get level: AF RF STRENGTH\n', dump_caps(caps))
+        self.assertIn('Set functions: NB VOX\n', dump_caps(caps))
+
 
 class ElecraftK3Rig(unittest.TestCase):
     def test_load_rig(self):
@@ -76,3 +133,16 @@ class ElecraftK3Rig(unittest.TestCase):
         self.assertTrue(isinstance(rig.msgbus, MsgBus))
         self.assertTrue(isinstance(rig.protocol, KenwoodProtocol))
 
+    def test_unsupported_mode(self):
+        rig = create_rig('K3', {}, itu_region=2)
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        writer = unittest.mock.MagicMock()
+        session = Session(rig, None, writer)
+        # a mode of the K3 which the Elecraft dialect cannot set
+        with self.assertLogs('rigctld', 'WARNING') as cm:
+            loop.run_until_complete(session._execute(('set_mode', 'RTTY', '0')))
+        self.assertEqual(['WARNING:rigctld:Invalid arguments: '
+                          "('set_mode', 'RTTY', '0')"], cm.output)
+        self.assertEqual(b'RPRT -1\n', writer.write.call_args.args[0])
+
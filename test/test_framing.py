@@ -0,0 +1,66 @@
+from radioctl.utils.framing import FrameProtocol
+
+import unittest
+import unittest.mock
+
+
+class FrameProtocolTest(unittest.TestCase):
+    def setUp(self):
+        self.frames = []
+        self.lost = unittest.mock.MagicMock()
+        self.protocol = FrameProtocol(b';', self.frame_received, self.lost,
+                                      max_frame_size=32)
+
+    def frame_received(self, frame):
+        self.assertTrue(isinstance(frame, memoryview))
+        self.frames.append(bytes(frame))
+
+    def test_whole_frames(self):
+        self.protocol.data_received(b'FA00007074000;FR0;MD2;')
+        self.assertEqual([b'FA00007074000;', b'FR0;', b'MD2;'], self.frames)
+
+    def test_split_frames(self):
+        self.protocol.data_received(b'FA0000')
+        self.assertEqual([], self.frames)
+        self.protocol.data_received(b'7074000;F')
+        self.protocol.data_received(b'R')
+        self.protocol.data_received(b'0;MD2')
+        self.assertEqual([b'FA00007074000;', b'FR0;'], self.frames)
+        self.protocol.data_received(b';')
+        self.assertEqual([b'FA00007074000;', b'FR0;', b'MD2;'], self.frames)
+
+    def test_multibyte_delimiter(self):
+        frames = []
+        protocol = FrameProtocol(b'\r\n', lambda f: frames.append(bytes(f)))
+        protocol.data_received(b'a\r')
+        protocol.data_received(b'\nb\r\nc')
+        self.assertEqual([b'a\r\n', b'b\r\n'], frames)
+
+    def test_oversized_frame_discarded(self):
+        self.protocol.data_received(b'X' * 40)
+        self.protocol.data_received(b';FR1;')
+        self.assertEqual([b';', b'FR1;'], self.frames)
+
+    def test_handler_raises(self):
+        def frame_received(frame):
+            if frame == b'BAD;':
+                raise ValueError('bad frame')
+            self.frames.append(bytes(frame))
+        protocol = FrameProtocol(b';', frame_received, max_frame_size=32)
+        with self.assertLogs('framing', 'ERROR'):
+            protocol.data_received(b'FA1')
+            protocol.data_received(b';BAD;FB2;MD')
+        protocol.data_received(b'2;')
+        self.assertEqual([b'FA1;', b'FB2;', b'MD2;'], self.frames)
+        self.assertEqual(b'', bytes(protocol._partial))
+        with self.assertLogs('framing', 'ERROR'):
+            protocol.data_received(b'BAD;')
+        protocol.data_received(b'FR0;')
+        self.assertEqual([b'FA1;', b'FB2;', b'MD2;', b'FR0;'], self.frames)
+
+    def test_connection_lost(self):
+        self.protocol.data_received(b'FA000')
+        self.protocol.connection_lost(None)
+        self.lost.assert_called_once_with(None)
+        self.protocol.data_received(b'FR1;')
+        self.assertEqual([b'FR1;'], self.frames)
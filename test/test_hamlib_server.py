@@ -1,6 +1,14 @@
+from radioctl.capabilities import Capabilities
+from radioctl.hamlib.ptt import PTT
 from radioctl.hamlib.server import *
+from radioctl.model import Model
+from radioctl.msgbus import MsgBus, MsgType
 
+import asyncio
+import types
 import unittest
+import unittest.mock
+
 
 class CommandParserTestCase(unittest.TestCase):
     def test_zero_args(self):
@@ -41,3 +49,191 @@ class CommandParserTestCase(unittest.TestCase):
         self.assertEqual(('set_freq', '7074000'), cmds[3])
         self.assertEqual(('set_mode', 'PKTUSB', '2700'), cmds[4])
 
+    def test_args_then_commands(self):
+        cmds = list(parse_command('F 7074000 mv'))
+        self.assertEqual([('set_freq', '7074000'), ('get_mode',), ('get_vfo',)], cmds)
+        cmds = list(parse_command('fM USB 2400 \\get_vfo K'))
+        self.assertEqual([('get_freq',), ('set_mode', 'USB', '2400'),
+                          ('get_vfo',), ('unknown',)], cmds)
+
+    def test_response_mode(self):
+        self.assertEqual((None, 'f'), split_response_mode('f'))
+        self.assertEqual(('\n', '\\get_freq'), split_response_mode('+\\get_freq'))
+        self.assertEqual((';', 'fm'), split_response_mode(';fm'))
+        self.assertEqual(('|', 'f'), split_response_mode('|f'))
+
+
+
+class SubscribeTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.msgbus = MsgBus()
+        model = Model()
+        model.add_vfo('A')
+        model.add_vfo('B')
+        model.register_signals(self.msgbus)
+        rig = types.SimpleNamespace(capabilities=None, model=model,
+                                    msgbus=self.msgbus)
+        self.writer = unittest.mock.MagicMock()
+        self.session = Session(rig, None, self.writer)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def command(self, line):
+        for cmd in parse_command(line):
+            self.loop.run_until_complete(self.session._execute(cmd))
+
+    def sent(self):
+        sent = ''.join(c.args[0].decode() for c in self.writer.write.call_args_list)
+        self.writer.reset_mock()
+        return sent
+
+    def test_hamlib_format(self):
+        self.command('\\subscribe')
+        self.assertEqual('!online 1\n!ptt 0\n!vfo VFOA\n!split_vfo VFOA\n'
+                         '!freq VFOA 0\n!mode VFOA CW\n'
+                         '!freq VFOB 0\n!mode VFOB CW\n'
+                         'RPRT 0\n', self.sent())
+        self.msgbus[MsgType.VFO_FREQUENCY_RESULT](1, 7074000)
+        self.msgbus[MsgType.TRANSMIT_RESULT](PTT.TX)
+        self.assertEqual('!freq VFOB 7074000\n!ptt 1\n', self.sent())
+
+    def test_json_format(self):
+        self.command('\\subscribe json')
+        self.sent()
+        self.msgbus[MsgType.VFO_FREQUENCY_RESULT](0, 14074000)
+        self.msgbus[MsgType.TX_VFO_RESULT](1)
+        self.assertEqual('{"freq": {"VFOA": 14074000}}\n{"split_vfo": "VFOB"}\n',
+                         self.sent())
+
+    def test_unsubscribe(self):
+        self.command('\\subscribe json')
+        self.sent()
+        self.command('\\unsubscribe')
+        self.assertEqual('RPRT 0\n', self.sent())
+        self.msgbus[MsgType.VFO_FREQUENCY_RESULT](0, 14074000)
+        self.assertEqual('', self.sent())
+
+    def test_unknown_format(self):
+        self.command('\\subscribe xml')
+        self.assertEqual('RPRT -1\n', self.sent())
+
+    def test_extended_response(self):
+        self.command('\\subscribe json')
+        self.sent()
+        self.loop.run_until_complete(
+            self.session._execute(('unsubscribe',), '\n'))
+        self.assertEqual('unsubscribe:\nRPRT 0\n', self.sent())
+
+
+class PipelineTestCase(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.msgbus = MsgBus()
+        self.model = Model()
+        self.model.add_vfo('A')
+        self.model.add_vfo('B')
+        self.model.register_signals(self.msgbus)
+        caps = Capabilities(itu_region=2)
+        caps.add_vfos('A', 'B')
+        caps.add_rx_band(500000, 30000000)
+        caps.set_rf_power(5, 100)
+        caps.add_tx_band('40m')
+        caps.add_tx_band('20m')
+        caps.freeze()
+        rig = types.SimpleNamespace(capabilities=caps, model=self.model,
+                                    msgbus=self.msgbus)
+        self.queries = []
+        self.msgbus[MsgType.VFO_FREQUENCY_QUERY].connect(self.answer_frequency)
+        self.msgbus[MsgType.VFO_MODE_QUERY].connect(self.answer_mode)
+        self.msgbus[MsgType.RX_VFO_QUERY].connect(self.answer_rx_vfo)
+        self.reader = asyncio.StreamReader()
+        self.writer = unittest.mock.MagicMock()
+        self.writer.drain = unittest.mock.AsyncMock()
+        self.session = Session(rig, self.reader, self.writer, max_age=0)
+
+    def tearDown(self):
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def answer(self, name, *result):
+        # the rig answers a little later
+        self.queries.append((name, self.loop.time()))
+        self.loop.call_later(0.01, self.msgbus[result[0]], *result[1:])
+
+    def answer_frequency(self, index):
+        self.answer('f', MsgType.VFO_FREQUENCY_RESULT, index, 7074000 + index)
+
+    def answer_mode(self, index):
+        self.answer('m', MsgType.VFO_MODE_RESULT, index, 'USB')
+
+    def answer_rx_vfo(self):
+        self.answer('v', MsgType.RX_VFO_RESULT, 0)
+
+    def serve(self, data):
+        self.reader.feed_data(data)
+        self.reader.feed_eof()
+        self.loop.run_until_complete(asyncio.wait_for(self.session.run(), 1))
+        return [c.args[0].decode() for c in self.writer.write.call_args_list]
+
+    def test_replies_batched_in_order(self):
+        written = self.serve(b'f\nm\nfmv\n')
+        # every query went out before the first answer came back
+        self.assertEqual(['f', 'f', 'm', 'm'],
+                         sorted(name for (name, t) in self.queries if name != 'v'))
+        times = [t for (name, t) in self.queries]
+        self.assertLess(max(times) - min(times), 0.01)
+        self.assertEqual(['7074000\nUSB\n0\n7074000\nUSB\n0\nVFOA\n'], written)
+        self.writer.drain.assert_awaited()
+
+    def test_extended_responses(self):
+        written = ''.join(self.serve(b'+f\n;\\get_mode\n|F 14074000\n'))
+        self.assertEqual('get_freq:\nFrequency: 7074000\nRPRT 0\n'
+                         'get_mode:;Mode: USB;Passband: 0;RPRT 0\n'
+                         'set_freq: 14074000|RPRT 0\n', written)
+
+    def test_morse(self):
+        sends = unittest.mock.MagicMock()
+        self.msgbus[MsgType.MORSE_SEND].connect(sends)
+        written = self.serve(b'+\\send_morse CQ TEST\nb CQ\n\\cancel_morse\n')
+        self.assertEqual('send_morse: CQ TEST\nRPRT 0\nRPRT 0\nRPRT 0\n',
+                         ''.join(written))
+        self.assertEqual([unittest.mock.call('CQ TEST'), unittest.mock.call('CQ')],
+                         sends.call_args_list)
+
+    def test_get_rig_single(self):
+        written = self.serve(b'\\get_rig\n+\\get_rig\n')
+        self.assertEqual('RPRT -11\nget_rig:\nRPRT -11\n', ''.join(written))
+
+    def test_errors(self):
+        written = ''.join(self.serve(b'F x\n+\\foo\n'))
+        self.assertEqual('RPRT -1\nfoo:\nRPRT -1\n', written)
+
+    def test_offline(self):
+        self.model.set_online(False)
+        written = ''.join(self.serve(b'f\nF 7074000\n'))
+        self.assertEqual('RPRT -6\nRPRT -6\n', written)
+        self.assertEqual([], self.queries)
+
+    def test_out_of_band(self):
+        sets = unittest.mock.MagicMock()
+        self.msgbus[MsgType.VFO_FREQUENCY_SET].connect(sets)
+        written = self.serve(b'F 144300000\nI 300000\nF 30000000\n')
+        self.assertEqual('RPRT -1\nRPRT -1\nRPRT 0\n', ''.join(written))
+        sets.assert_called_once_with(0, 30000000)
+
+    def test_power_conversion(self):
+        written = self.serve(b'+\\power2mW 0.5 14074000 USB\n'
+                             b'\\mW2power 25000 7074000 CW\n'
+                             b'\\power2mW 0.5 10120000 CW\n')
+        self.assertEqual('power2mW: 0.5 14074000 USB\nPower mW: 50000\nRPRT 0\n'
+                         '0.250000\nRPRT -1\n', ''.join(written))
+
+    def test_set_before_get(self):
+        sets = unittest.mock.MagicMock()
+        self.msgbus[MsgType.VFO_FREQUENCY_SET].connect(sets)
+        written = self.serve(b'F 14074000\nf\nq\nf\n')
+        sets.assert_called_once_with(0, 14074000)
+        self.assertEqual('RPRT 0\n7074000\n', ''.join(written))
@@ -0,0 +1,164 @@
+from radioctl.hamlib.modes import Mode
+from radioctl.hamlib.ptt import PTT
+from radioctl.model import *
+from radioctl.msgbus import *
+
+import asyncio
+import unittest
+import unittest.mock
+
+
+class ModelRefreshTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.msgbus = MsgBus()
+        self.model = Model()
+        self.vfo_a = self.model.add_vfo('A')
+        self.vfo_b = self.model.add_vfo('B')
+        self.model.register_signals(self.msgbus)
+        self.freq_query = unittest.mock.MagicMock()
+        self.mode_query = unittest.mock.MagicMock()
+        self.rx_vfo_query = unittest.mock.MagicMock()
+        self.msgbus[MsgType.VFO_FREQUENCY_QUERY].connect(self.freq_query)
+        self.msgbus[MsgType.VFO_MODE_QUERY].connect(self.mode_query)
+        self.msgbus[MsgType.RX_VFO_QUERY].connect(self.rx_vfo_query)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def answer(self, query, result_type, *result):
+        # reply from the rig arrives on a later loop iteration
+        query.side_effect = lambda *args, **kwargs: self.loop.call_soon(
+            self.msgbus[result_type], *result)
+
+    def test_timestamps(self):
+        self.assertIsNone(self.vfo_a.timestamp('frequency'))
+        self.msgbus[MsgType.VFO_FREQUENCY_RESULT](0, 7074000)
+        self.assertEqual(7074000, self.vfo_a.frequency)
+        self.assertIsNotNone(self.vfo_a.timestamp('frequency'))
+        self.assertIsNone(self.vfo_b.timestamp('frequency'))
+        self.assertIsNone(self.vfo_a.timestamp('mode'))
+
+    def test_refresh_queries_and_waits(self):
+        self.answer(self.freq_query, MsgType.VFO_FREQUENCY_RESULT, 0, 14074000)
+        self.loop.run_until_complete(self.vfo_a.refresh('frequency'))
+        self.freq_query.assert_called_once_with(0)
+        self.mode_query.assert_not_called()
+        self.assertEqual(14074000, self.vfo_a.frequency)
+
+    def test_refresh_cache_hit(self):
+        self.msgbus[MsgType.VFO_FREQUENCY_RESULT](0, 7074000)
+        self.loop.run_until_complete(self.vfo_a.refresh('frequency', max_age=60))
+        self.freq_query.assert_not_called()
+
+    def test_set_invalidates(self):
+        self.msgbus[MsgType.VFO_FREQUENCY_RESULT](0, 7074000)
+        self.vfo_a.frequency = 14074000
+        self.answer(self.freq_query, MsgType.VFO_FREQUENCY_RESULT, 0, 14074000)
+        self.loop.run_until_complete(self.vfo_a.refresh('frequency', max_age=60))
+        self.freq_query.assert_called_once_with(0)
+        self.assertEqual(14074000, self.vfo_a.frequency)
+
+    def test_refresh_all_fields(self):
+        self.answer(self.freq_query, MsgType.VFO_FREQUENCY_RESULT, 1, 3573000)
+        self.answer(self.mode_query, MsgType.VFO_MODE_RESULT, 1, 'USB')
+        self.loop.run_until_complete(self.vfo_b.refresh())
+        self.freq_query.assert_called_once_with(1)
+        self.mode_query.assert_called_once_with(1)
+        self.assertEqual(3573000, self.vfo_b.frequency)
+        self.assertEqual('USB', self.vfo_b.mode)
+
+    def test_refresh_timeout(self):
+        with self.assertRaises(asyncio.TimeoutError):
+            self.loop.run_until_complete(
+                self.vfo_a.refresh('frequency', timeout=0.01))
+        self.assertIsNone(self.vfo_a.timestamp('frequency'))
+        # a late answer is still applied
+        self.msgbus[MsgType.VFO_FREQUENCY_RESULT](0, 7074000)
+        self.assertEqual(7074000, self.vfo_a.frequency)
+
+    def test_model_refresh(self):
+        self.answer(self.rx_vfo_query, MsgType.RX_VFO_RESULT, 1)
+        self.loop.run_until_complete(self.model.refresh('primary_rx_vfo'))
+        self.rx_vfo_query.assert_called_once_with()
+        self.assertIs(self.vfo_b, self.model.primary_rx_vfo)
+        self.assertIsNotNone(self.model.timestamp('primary_rx_vfo'))
+
+
+class ModelUpdatedTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        self.msgbus = MsgBus()
+        self.model = Model()
+        self.model.add_vfo('A')
+        self.model.add_vfo('B')
+        self.model.register_signals(self.msgbus)
+        self.updated = unittest.mock.MagicMock()
+        self.msgbus[MsgType.MODEL_UPDATED].connect(self.updated)
+
+    def tearDown(self):
+        self.loop.close()
+
+    def tick(self, *messages):
+        # deliver messages from within one pass of the event loop
+        async def deliver():
+            for message in messages:
+                self.msgbus[message[0]](*message[1:])
+            await asyncio.sleep(0)
+        self.loop.run_until_complete(deliver())
+
+    def test_coalesced(self):
+        self.tick((MsgType.VFO_FREQUENCY_RESULT, 0, 7074000),
+                  (MsgType.VFO_FREQUENCY_RESULT, 0, 7074010),
+                  (MsgType.VFO_MODE_RESULT, 1, 'USB'),
+                  (MsgType.RX_VFO_RESULT, 1))
+        self.updated.assert_called_once_with({
+            'A.frequency': (0, 7074010),
+            'B.mode': (Mode.CW, 'USB'),
+            'primary_rx_vfo': (0, 1),
+        })
+
+    def test_repeated_value_not_published(self):
+        self.tick((MsgType.VFO_FREQUENCY_RESULT, 0, 7074000))
+        self.updated.reset_mock()
+        self.tick((MsgType.VFO_FREQUENCY_RESULT, 0, 7074000),
+                  (MsgType.VFO_FREQUENCY_RESULT, 0, 7074000))
+        self.updated.assert_not_called()
+        self.assertIsNotNone(self.model.get_vfo(0).timestamp('frequency'))
+
+    def test_changed_back_not_published(self):
+        self.tick((MsgType.TRANSMIT_RESULT, PTT.TX),
+                  (MsgType.TRANSMIT_RESULT, PTT.RX))
+        self.updated.assert_not_called()
+
+    def test_ptt_set_then_reported(self):
+        tx_set = unittest.mock.MagicMock()
+        rx_set = unittest.mock.MagicMock()
+        self.msgbus[MsgType.TRANSMIT_SET].connect(tx_set)
+        self.msgbus[MsgType.RECEIVE_SET].connect(rx_set)
+        self.model.tx = PTT.TX
+        tx_set.assert_called_once_with(PTT.TX)
+        self.assertIsNone(self.model.timestamp('tx'))
+        self.assertEqual(PTT.RX, self.model.tx)
+        # the rig's report makes the change, and publishes it
+        self.tick((MsgType.TRANSMIT_RESULT,))
+        self.updated.assert_called_once_with({'tx': (PTT.RX, PTT.TX)})
+        self.model.tx = PTT.RX
+        rx_set.assert_called_once_with(PTT.RX)
+        self.tick((MsgType.RECEIVE_RESULT,))
+        self.updated.assert_called_with({'tx': (PTT.TX, PTT.RX)})
+
+    def test_one_message_per_tick(self):
+        self.tick((MsgType.VFO_FREQUENCY_RESULT, 0, 7074000))
+        self.tick((MsgType.VFO_FREQUENCY_RESULT, 0, 7074010))
+        self.assertEqual([unittest.mock.call({'A.frequency': (0, 7074000)}),
+                          unittest.mock.call({'A.frequency': (7074000, 7074010)})],
+                         self.updated.call_args_list)
+
+    def test_offline(self):
+        self.tick((MsgType.VFO_FREQUENCY_RESULT, 0, 7074000))
+        self.updated.reset_mock()
+        self.model.set_online(False)
+        self.assertFalse(self.model.online)
+        self.assertIsNone(self.model.get_vfo(0).timestamp('frequency'))
+        self.updated.assert_called_once_with({'online': (True, False)})
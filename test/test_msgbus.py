@@ -0,0 +1,42 @@
+from radioctl.msgbus import *
+
+import unittest
+import unittest.mock
+
+
+class MsgBusTest(unittest.TestCase):
+    def setUp(self):
+        self.msgbus = MsgBus()
+
+    def test_same_signal(self):
+        self.assertIs(self.msgbus[MsgType.TX_VFO_RESULT],
+                      self.msgbus[MsgType.TX_VFO_RESULT])
+        self.assertIs(self.msgbus[MsgType.VFO_FREQUENCY_RESULT, 1],
+                      self.msgbus[MsgType.VFO_FREQUENCY_RESULT][1])
+
+    def test_indexed_routing(self):
+        vfo_a = unittest.mock.MagicMock()
+        vfo_b = unittest.mock.MagicMock()
+        every = unittest.mock.MagicMock()
+        self.msgbus[MsgType.VFO_FREQUENCY_RESULT, 0].connect(vfo_a)
+        self.msgbus[MsgType.VFO_FREQUENCY_RESULT, 1].connect(vfo_b)
+        self.msgbus[MsgType.VFO_FREQUENCY_RESULT].connect(every)
+
+        self.msgbus[MsgType.VFO_FREQUENCY_RESULT](1, 7074000)
+        vfo_a.assert_not_called()
+        vfo_b.assert_called_once_with(1, 7074000)
+        every.assert_called_once_with(1, 7074000)
+
+        self.msgbus[MsgType.VFO_FREQUENCY_RESULT](index=0, frequency=3573000)
+        vfo_a.assert_called_once_with(0, frequency=3573000)
+        self.assertEqual(1, vfo_b.call_count)
+        self.assertEqual(2, every.call_count)
+
+        self.msgbus[MsgType.VFO_FREQUENCY_RESULT](2, 14074000)
+        self.assertEqual(1, vfo_a.call_count)
+        self.assertEqual(1, vfo_b.call_count)
+        self.assertEqual(3, every.call_count)
+
+    def test_indexed_types(self):
+        self.assertTrue(isinstance(self.msgbus[MsgType.VFO_MODE_SET], IndexedSignal))
+        self.assertFalse(isinstance(self.msgbus[MsgType.RX_VFO_SET], IndexedSignal))
@@ -0,0 +1,106 @@
+from radioctl.model import Model
+from radioctl.msgbus import *
+from radioctl.poller import Poller
+
+import asyncio
+import collections
+import unittest
+
+
+FAST = {name: (0.01, 0.08) for name in
+        ('frequency', 'mode', 'tx', 'primary_rx_vfo', 'primary_tx_vfo')}
+
+
+class PollerTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.msgbus = MsgBus()
+        self.model = Model()
+        self.model.add_vfo('A')
+        self.model.add_vfo('B')
+        self.model.register_signals(self.msgbus)
+        # a rig answering every query on the next loop iteration
+        self.poller = None
+        self.frequencies = [14074000, 7074000]
+        self.queries = collections.Counter()
+        self.msgbus[MsgType.VFO_FREQUENCY_QUERY].connect(self.frequency_query)
+        for msgtype in (MsgType.VFO_MODE_QUERY, MsgType.RX_VFO_QUERY,
+                        MsgType.TX_VFO_QUERY, MsgType.TRANSMIT_QUERY):
+            self.msgbus[msgtype].connect(self.counter(msgtype))
+
+    def tearDown(self):
+        if self.poller:
+            task = self.poller.stop()
+            self.loop.run_until_complete(asyncio.wait([task]))
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def counter(self, msgtype):
+        def count(*args):
+            self.queries[msgtype] += 1
+        return count
+
+    def frequency_query(self, index):
+        self.queries[index] += 1
+        self.loop.call_soon(self.msgbus[MsgType.VFO_FREQUENCY_RESULT],
+                            index, self.frequencies[index])
+
+    def poll(self, duration, baudrate=38400, intervals=FAST):
+        self.poller = Poller(self.model, self.msgbus, baudrate, intervals)
+        self.poller.start()
+        self.wait(duration)
+        return self.poller
+
+    def wait(self, duration):
+        self.loop.run_until_complete(asyncio.sleep(duration))
+
+    def test_backoff_when_stable(self):
+        poller = self.poll(0.4)
+        self.assertEqual(0.08, poller.interval('A.frequency'))
+        # 0.01 + 0.02 + 0.04 + 0.08 ..., not one every 0.01
+        self.assertLess(self.queries[0], 12)
+        self.assertGreater(self.queries[0], 3)
+
+    def test_change_polls_fast_again(self):
+        poller = self.poll(0.3)
+        self.assertEqual(0.08, poller.interval('A.frequency'))
+        self.frequencies[0] = 7000000
+        self.queries.clear()
+        self.wait(0.2)
+        self.assertEqual(7000000, self.model.get_vfo(0).frequency)
+        # A went back to 0.01 when the change was seen, B stayed at 0.08
+        self.assertGreater(self.queries[0], self.queries[1])
+
+    def test_set_polls_soon(self):
+        intervals = dict(FAST, frequency=(1.0, 1.0))
+        poller = self.poll(0.05, intervals=intervals)
+        polls = self.queries[0]
+        self.msgbus[MsgType.VFO_FREQUENCY_SET](0, 7000000)
+        self.wait(0.1)
+        self.assertEqual(polls + 1, self.queries[0])
+        self.assertEqual(1, self.queries[1])
+
+    def test_reported_fields_not_polled(self):
+        # an auto-information rig reporting VFO A on its own
+        def report():
+            self.msgbus[MsgType.VFO_FREQUENCY_RESULT](0, 14074000)
+            self.handle = self.loop.call_later(0.005, report)
+        report()
+        self.addCleanup(lambda: self.handle.cancel())
+        self.poll(0.2)
+        self.assertEqual(0, self.queries[0])
+        self.assertGreater(self.queries[1], 0)
+
+    def test_bandwidth_budget(self):
+        # 100 baud leaves 5 bytes/sec for polling: after the initial burst
+        # of one poll per field, nothing more in this time.
+        poller = self.poll(0.3, baudrate=100)
+        self.assertEqual(7, poller.polls)
+
+    def test_active_reads_poll_fast(self):
+        poller = self.poll(0.3)
+        self.assertEqual(0.08, poller.interval('B.frequency'))
+        self.loop.run_until_complete(self.model.get_vfo(1).refresh('frequency'))
+        self.wait(0.2)
+        self.assertEqual(0.01, poller.interval('B.frequency'))
@@ -0,0 +1,221 @@
+from radioctl.hamlib.ptt import PTT
+from radioctl.msgbus import *
+from radioctl.protocol import factory
+from radioctl.protocol.icom.icom import CommandRejected, Protocol
+
+import asyncio
+import gc
+import unittest
+import unittest.mock
+
+
+RIG_DEF = {
+    'protocol_config': {
+        'address': 0x94,
+        'controller': 0xE0,
+        'pipeline_depth': 4,
+        'timeout': 0.05,
+    }
+}
+
+
+def frame(*data):
+    return bytes((0xFE, 0xFE) + data + (0xFD,))
+
+
+class ProtocolTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.msgbus = MsgBus()
+        self.protocol = factory.create_protocol('Icom', 'Icom', {}, self.msgbus, RIG_DEF)
+        self.transport = unittest.mock.MagicMock()
+        self.protocol.open(self.loop, self.transport)
+
+    def tearDown(self):
+        self.protocol._connection_lost(None)
+        self.loop.run_until_complete(asyncio.sleep(0))
+        self.loop.close()
+        asyncio.set_event_loop(None)
+
+    def run_once(self):
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+    def written(self):
+        return [c.args[0] for c in self.transport.write.call_args_list]
+
+    def reply(self, *data):
+        self.protocol._dispatch(memoryview(frame(0xE0, 0x94, *data)))
+        self.run_once()
+
+    def test_factory(self):
+        self.assertTrue(isinstance(self.protocol, Protocol))
+
+    def test_query_frequency(self):
+        slot = unittest.mock.MagicMock()
+        self.msgbus[MsgType.VFO_FREQUENCY_RESULT].connect(slot)
+        self.msgbus[MsgType.VFO_FREQUENCY_QUERY](0)
+        self.msgbus[MsgType.VFO_FREQUENCY_QUERY](0)
+        self.run_once()
+        self.assertEqual([frame(0x94, 0xE0, 0x03)], self.written())
+        self.reply(0x03, 0x00, 0x40, 0x07, 0x07, 0x00)
+        slot.assert_called_once_with(0, 7074000)
+
+    def test_unselected_vfo_pipelined(self):
+        slot = unittest.mock.MagicMock()
+        self.msgbus[MsgType.VFO_FREQUENCY_RESULT].connect(slot)
+        self.msgbus[MsgType.VFO_FREQUENCY_QUERY](1)
+        self.run_once()
+        # select B, read, select A written without waiting for replies
+        self.assertEqual([frame(0x94, 0xE0, 0x07, 0x01),
+                          frame(0x94, 0xE0, 0x03),
+                          frame(0x94, 0xE0, 0x07, 0x00)], self.written())
+        self.reply(0xFB)
+        self.reply(0x03, 0x00, 0x00, 0x25, 0x14, 0x00)
+        slot.assert_not_called()
+        self.reply(0xFB)
+        slot.assert_called_once_with(1, 14250000)
+
+    def test_unselected_vfo_select_rejected(self):
+        errors = unittest.mock.MagicMock()
+        self.loop.set_exception_handler(errors)
+        task = self.loop.create_task(self.protocol._on_vfo(1, 0x03))
+        self.run_once()
+        self.reply(0xFA)
+        self.reply(0x03, 0x00, 0x00, 0x25, 0x14, 0x00)
+        self.reply(0xFB)
+        with self.assertRaises(CommandRejected):
+            self.loop.run_until_complete(task)
+        del task
+        gc.collect()
+        errors.assert_not_called()
+
+    def test_unselected_vfo_selected_back(self):
+        task = self.loop.create_task(self.protocol._on_vfo(1, 0x03))
+        self.run_once()
+        self.reply(0xFB)
+        self.reply(0x03, 0x00, 0x00, 0x25, 0x14, 0x00)
+        self.reply(0xFA)
+        # the rig is not left on VFO B
+        self.assertEqual(frame(0x94, 0xE0, 0x07, 0x00), self.written()[-1])
+        self.assertEqual(4, len(self.written()))
+        self.reply(0xFB)
+        self.assertEqual(b'\x00\x00\x25\x14\x00', self.loop.run_until_complete(task))
+
+    def test_transceive_ignored_on_unselected_vfo(self):
+        freq = unittest.mock.MagicMock()
+        self.msgbus[MsgType.VFO_FREQUENCY_RESULT].connect(freq)
+        task = self.loop.create_task(self.protocol._on_vfo(1, 0x03))
+        self.run_once()
+        self.reply(0xFB)
+        self.protocol._dispatch(frame(0x00, 0x94, 0x00, 0x00, 0x00, 0x25, 0x14, 0x00))
+        freq.assert_not_called()
+        self.reply(0x03, 0x00, 0x00, 0x25, 0x14, 0x00)
+        self.reply(0xFB)
+        self.loop.run_until_complete(task)
+        self.protocol._dispatch(frame(0x00, 0x94, 0x00, 0x00, 0x40, 0x07, 0x07, 0x00))
+        freq.assert_called_once_with(0, 7074000)
+
+    def test_pipeline_depth(self):
+        futures = [self.protocol.command(0x03) for i in range(6)]
+        self.assertEqual(4, len(self.written()))
+        self.reply(0x03, 0x00, 0x40, 0x07, 0x07, 0x00)
+        self.assertEqual(5, len(self.written()))
+        self.assertEqual(b'\x00\x40\x07\x07\x00', futures[0].result())
+        self.protocol._connection_lost(None)
+        for future in futures[1:]:
+            self.assertTrue(isinstance(future.exception(), ConnectionError))
+
+    def test_echo_ignored(self):
+        future = self.protocol.command(0x1C, 0x00, b'\x01')
+        self.protocol._dispatch(frame(0x94, 0xE0, 0x1C, 0x00, 0x01))
+        self.assertFalse(future.done())
+        self.reply(0xFB)
+        self.assertEqual(b'', future.result())
+
+    def test_rejected(self):
+        future = self.protocol.command(0x05, None, b'\x00\x00\x00\x00\x01')
+        self.reply(0xFA)
+        with self.assertRaises(CommandRejected):
+            future.result()
+
+    def test_timeout(self):
+        first = self.protocol.command(0x03)
+        second = self.protocol.command(0x04)
+        self.loop.run_until_complete(asyncio.sleep(0.1))
+        with self.assertRaises(asyncio.TimeoutError):
+            first.result()
+        with self.assertRaises(asyncio.TimeoutError):
+            second.result()
+        self.assertFalse(self.protocol._in_flight)
+
+    def test_late_reply_after_timeout(self):
+        first = self.protocol.command(0x05, None, b'\x00\x00\x00\x00\x01')
+        self.loop.run_until_complete(asyncio.sleep(0.03))
+        second = self.protocol.command(0x06, None, b'\x01')
+        self.loop.run_until_complete(asyncio.sleep(0.03))
+        self.assertIsInstance(first.exception(), asyncio.TimeoutError)
+        # out of step: nothing more is written until the pipeline drains
+        third = self.protocol.command(0x07, 0x00)
+        self.assertEqual(2, len(self.written()))
+        # the first command's late OK is not taken for the second's
+        self.reply(0xFB)
+        self.assertFalse(second.done())
+        self.loop.run_until_complete(asyncio.sleep(0.03))
+        self.assertIsInstance(second.exception(), asyncio.TimeoutError)
+        self.assertEqual(frame(0x94, 0xE0, 0x07, 0x00), self.written()[2])
+        self.reply(0xFB)
+        self.assertEqual(b'', third.result())
+
+    def test_subcommand_checked(self):
+        future = self.protocol.command(0x1C, 0x00)
+        self.reply(0x1C, 0x01, 0x01)
+        self.assertFalse(future.done())
+        self.reply(0x1C, 0x00, 0x01)
+        self.assertEqual(b'\x01', future.result())
+
+    def test_unsupported_mode(self):
+        with self.assertRaises(ValueError):
+            self.msgbus[MsgType.VFO_MODE_SET](0, 'PKTUSB')
+        self.run_once()
+        self.assertEqual([], self.written())
+
+    def test_transceive(self):
+        freq = unittest.mock.MagicMock()
+        mode = unittest.mock.MagicMock()
+        self.msgbus[MsgType.VFO_FREQUENCY_RESULT].connect(freq)
+        self.msgbus[MsgType.VFO_MODE_RESULT].connect(mode)
+        self.protocol._dispatch(frame(0x00, 0x94, 0x00, 0x00, 0x40, 0x07, 0x07, 0x00))
+        self.protocol._dispatch(frame(0x00, 0x94, 0x01, 0x03, 0x01))
+        freq.assert_called_once_with(0, 7074000)
+        mode.assert_called_once_with(0, 'CW')
+
+    def test_set_frequency(self):
+        self.msgbus[MsgType.VFO_FREQUENCY_SET](0, 7074000)
+        self.run_once()
+        self.assertEqual([frame(0x94, 0xE0, 0x05, 0x00, 0x40, 0x07, 0x07, 0x00)],
+                         self.written())
+
+    def test_split(self):
+        slot = unittest.mock.MagicMock()
+        self.msgbus[MsgType.TX_VFO_RESULT].connect(slot)
+        self.msgbus[MsgType.TX_VFO_SET](1)
+        self.run_once()
+        self.assertEqual([frame(0x94, 0xE0, 0x0F, 0x01)], self.written())
+        self.reply(0xFB)
+        slot.assert_called_once_with(1)
+
+    def test_transmit(self):
+        slot = unittest.mock.MagicMock()
+        self.msgbus[MsgType.TRANSMIT_RESULT].connect(slot)
+        self.msgbus[MsgType.TRANSMIT_QUERY]()
+        self.run_once()
+        self.assertEqual([frame(0x94, 0xE0, 0x1C, 0x00)], self.written())
+        self.reply(0x1C, 0x00, 0x01)
+        slot.assert_called_once_with(PTT.TX)
+
+    def test_connection_lost(self):
+        future = self.protocol.command(0x03)
+        self.protocol._connection_lost(None)
+        with self.assertRaises(ConnectionError):
+            future.result()
@@ -1,8 +1,13 @@
+from radioctl.protocol.kenwood.decoder import (
+    compile_response, FieldError, FixedWidthDecoder, RegexDecoder)
+from radioctl.protocol.kenwood.encoder import Command
 from radioctl.protocol.kenwood.protocol import (
     ModeHandler, Protocol, RxToggleHandler, RxVfoToggleHandler,
     TxToggleHandler, TxVfoToggleHandler, VfoHandler)
+from radioctl.hamlib.ptt import PTT
 from radioctl.msgbus import *
 from radioctl.protocol import factory
+from radioctl.protocol.output_queue import OutputQueue
 
 import asyncio
 import socket
@@ -10,6 +15,75 @@ import unittest
 import unittest.mock
 
 
+class DecoderTest(unittest.TestCase):
+    IF_RESPONSE = (
+        'IF(?P<freq>\\d{11})     (?P<offset>[\\+-])(?P<offset_hz>\\d{4})'
+        '(?P<rit>[01])(?P<xit>[01]) 00(?P<tx>[01])(?P<mode>\\d)(?P<vfo>[01])'
+        '(?P<scan>[01])(?P<split>[01])(?P<band_change>[01])(?P<datamode>\\d)1 ;')
+
+    def test_fixed_width(self):
+        decoder = compile_response('FA(?P<freq>\\d{11});')
+        self.assertTrue(isinstance(decoder, FixedWidthDecoder))
+        self.assertEqual(14, decoder.length)
+        self.assertEqual(b'00007074000', decoder.decode(b'FA00007074000;')['freq'])
+        self.assertEqual(b'00007074000',
+                         decoder.decode(memoryview(b'FA00007074000;'))['freq'])
+        self.assertIsNone(decoder.decode(b'FA0000707400;'))
+        with self.assertRaises(FieldError):
+            decoder.decode(b'FA0000707400X;')['freq']
+
+    def test_escaped_literal(self):
+        decoder = compile_response('MD\\$(?P<mode>\\d);')
+        self.assertTrue(isinstance(decoder, FixedWidthDecoder))
+        self.assertEqual(b'3', decoder.decode(b'MD$3;')['mode'])
+        with self.assertRaises(FieldError):
+            decoder.decode(b'MD$X;')['mode']
+
+    def test_character_class(self):
+        decoder = compile_response('FR(?P<index>[01]);')
+        self.assertTrue(isinstance(decoder, FixedWidthDecoder))
+        self.assertEqual(b'1', decoder.decode(b'FR1;')['index'])
+        with self.assertRaises(FieldError):
+            decoder.decode(b'FR2;')['index']
+
+    def test_info_frame(self):
+        decoder = compile_response(self.IF_RESPONSE)
+        self.assertTrue(isinstance(decoder, FixedWidthDecoder))
+        fields = decoder.decode(b'IF00014074000     -002010 0006001011 ;')
+        self.assertEqual(b'00014074000', fields['freq'])
+        self.assertEqual(b'-', fields['offset'])
+        self.assertEqual(b'0020', fields['offset_hz'])
+        self.assertEqual(b'6', fields['mode'])
+        self.assertEqual(b'1', fields['split'])
+        fields = decoder.decode(b'IF00014074000     *002010 0006001011 ;')
+        self.assertEqual(b'00014074000', fields['freq'])
+        with self.assertRaises(FieldError):
+            fields['offset']
+        self.assertIsNone(decoder.decode(b'IF00014074000    -0020100 0006001011 ;'))
+
+    def test_regex_fallback(self):
+        decoder = compile_response('KS(?P<speed>\\d+);')
+        self.assertTrue(isinstance(decoder, RegexDecoder))
+        self.assertEqual(b'025', decoder.decode(b'KS025;')['speed'])
+        self.assertEqual(b'025', decoder.decode(memoryview(b'KS025;'))['speed'])
+        self.assertIsNone(decoder.decode(b'KSX;'))
+
+
+class CommandTest(unittest.TestCase):
+    def test_integer_fields(self):
+        self.assertEqual(b'FA00007074000;', Command('FA{freq:011d};').format(freq=7074000))
+        self.assertEqual(b'MD$6;', Command('MD${mode:d};').format(mode=6))
+        self.assertEqual(b'RX;', Command('RX;').format())
+
+    def test_fallback(self):
+        self.assertEqual(b'KYCQ TEST;', Command('KY{text};').format(text='CQ TEST'))
+        self.assertEqual(b'X 7.5;', Command('X{value:4.1f};').format(value=7.5))
+
+    def test_empty(self):
+        self.assertFalse(Command(''))
+        self.assertTrue(Command('RX;'))
+
+
 class ProtocolWrapper(Protocol):
     _send = unittest.mock.MagicMock()
 
@@ -61,22 +135,24 @@ class ProtocolTest(unittest.TestCase):
     })
 
     def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
         self.msgbus = MsgBus()
         self.protocol = ProtocolWrapper('Elecraft', None, self.msgbus, self.DEFINITION)
         self.vfo_callbacks = unittest.mock.MagicMock()
-        self.vfo_handler0 = self.protocol._handlers['FA']
-        self.vfo_handler1 = self.protocol._handlers['FB']
+        self.vfo_handler0 = self.protocol._handlers[b'FA']
+        self.vfo_handler1 = self.protocol._handlers[b'FB']
         self.mode_callbacks = unittest.mock.MagicMock()
-        self.mode_handler0 = self.protocol._handlers['MD']
-        self.mode_handler1 = self.protocol._handlers['MD$']
+        self.mode_handler0 = self.protocol._handlers[b'MD']
+        self.mode_handler1 = self.protocol._handlers[b'MD$']
         self.rx_vfo_callbacks = unittest.mock.MagicMock()
-        self.rx_vfo_handler = self.protocol._handlers['FR']
+        self.rx_vfo_handler = self.protocol._handlers[b'FR']
         self.tx_vfo_callbacks = unittest.mock.MagicMock()
-        self.tx_vfo_handler = self.protocol._handlers['FT']
+        self.tx_vfo_handler = self.protocol._handlers[b'FT']
         self.rx_callbacks = unittest.mock.MagicMock()
-        self.rx_handler = self.protocol._handlers['RX']
+        self.rx_handler = self.protocol._handlers[b'RX']
         self.tx_callbacks = unittest.mock.MagicMock()
-        self.tx_handler = self.protocol._handlers['TX']
+        self.tx_handler = self.protocol._handlers[b'TX']
         self.msgbus[MsgType.VFO_FREQUENCY_RESULT].connect(self.vfo_callbacks)
         self.msgbus[MsgType.VFO_MODE_RESULT].connect(self.mode_callbacks)
         self.msgbus[MsgType.RX_VFO_RESULT].connect(self.rx_vfo_callbacks)
@@ -84,6 +160,14 @@ class ProtocolTest(unittest.TestCase):
         self.msgbus[MsgType.RECEIVE_RESULT].connect(self.rx_callbacks)
         self.msgbus[MsgType.TRANSMIT_RESULT].connect(self.tx_callbacks)
 
+    def tearDown(self):
+        self.protocol._scheduler.reset()
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def run_once(self):
+        self.loop.run_until_complete(asyncio.sleep(0))
+
     def test_protocol_registration(self):
         self.assertEquals(factory._all_protocols['Kenwood'], Protocol)
 
@@ -92,27 +176,66 @@ class ProtocolTest(unittest.TestCase):
         self.protocol._msgbus[MsgType.VFO_FREQUENCY_SET](2, 3573000)
         self.protocol._send.assert_not_called()
         self.protocol._msgbus[MsgType.VFO_FREQUENCY_SET](0, 3573000)
-        self.protocol._send.assert_called_once_with('FA00003573000;')
+        self.protocol._send.assert_called_once_with(b'FA00003573000;')
         self.protocol._msgbus[MsgType.VFO_FREQUENCY_SET](1, 7074000)
-        self.protocol._send.assert_called_with('FB00007074000;')
+        self.protocol._send.assert_called_with(b'FB00007074000;')
 
     def test_vfo_handler_get(self):
         self.protocol._send.assert_not_called()
         self.protocol._msgbus[MsgType.VFO_FREQUENCY_QUERY](2)
+        self.run_once()
         self.protocol._send.assert_not_called()
         self.protocol._msgbus[MsgType.VFO_FREQUENCY_QUERY](0)
-        self.protocol._send.assert_called_once_with('FA;')
+        self.run_once()
+        self.protocol._send.assert_called_once_with(b'FA;')
         self.protocol._msgbus[MsgType.VFO_FREQUENCY_QUERY](1)
-        self.protocol._send.assert_called_with('FB;')
+        self.run_once()
+        self.protocol._send.assert_called_with(b'FB;')
+
+    def test_queries_coalesced(self):
+        query = self.protocol._msgbus[MsgType.VFO_FREQUENCY_QUERY]
+        for _ in range(3):
+            query(0)
+            query(1)
+        self.protocol._msgbus[MsgType.VFO_MODE_QUERY](0)
+        self.protocol._send.assert_not_called()
+        self.run_once()
+        self.protocol._send.assert_called_once_with(b'FA;FB;MD;')
+
+    def test_outstanding_query_deduplicated(self):
+        query = self.protocol._msgbus[MsgType.VFO_FREQUENCY_QUERY]
+        query(0)
+        self.run_once()
+        self.protocol._send.assert_called_once_with(b'FA;')
+        query(0)
+        self.run_once()
+        self.protocol._send.assert_called_once_with(b'FA;')
+        self.vfo_handler0(b'FA00007074000;')
+        self.assertEqual((), self.protocol._scheduler.outstanding)
+        query(0)
+        self.run_once()
+        self.assertEqual(2, self.protocol._send.call_count)
+
+    def test_outstanding_query_expires(self):
+        self.protocol._scheduler._timeout = 0.005
+        query = self.protocol._msgbus[MsgType.VFO_FREQUENCY_QUERY]
+        query(0)
+        self.run_once()
+        self.assertEqual((b'FA;',), self.protocol._scheduler.outstanding)
+        self.loop.run_until_complete(asyncio.sleep(0.02))
+        self.assertEqual((), self.protocol._scheduler.outstanding)
+        query(0)
+        self.run_once()
+        self.assertEqual(2, self.protocol._send.call_count)
 
     def test_vfo_handler_response(self):
         self.vfo_callbacks.assert_not_called()
-        self.vfo_handler0('FA00003573000;')
-        self.vfo_handler0('FA00014074000;')
-        self.vfo_handler0('FAABC03573000;')
-        self.vfo_handler1('FB00003573000;')
-        self.vfo_handler1('FB00014074000;')
-        self.vfo_handler1('FBABC03573000;')
+        self.vfo_handler0(b'FA00003573000;')
+        self.vfo_handler0(b'FA00014074000;')
+        self.vfo_handler0(b'FAABC03573000;')
+        self.vfo_handler1(b'FB00003573000;')
+        self.vfo_handler1(b'FB00014074000;')
+        self.vfo_handler1(b'FBABC03573000;')
         self.assertEquals(4, self.vfo_callbacks.call_count)
         self.assertEquals((0, 3573000), self.vfo_callbacks.call_args_list[0].args)
         self.assertEquals((0, 14074000), self.vfo_callbacks.call_args_list[1].args)
@@ -124,50 +247,64 @@ class ProtocolTest(unittest.TestCase):
         self.protocol._msgbus[MsgType.VFO_MODE_SET](2, "CW")
         self.protocol._send.assert_not_called()
         self.protocol._msgbus[MsgType.VFO_MODE_SET](0, "CW")
-        self.protocol._send.assert_called_once_with('MD3;')
+        self.protocol._send.assert_called_once_with(b'MD3;')
         self.protocol._msgbus[MsgType.VFO_MODE_SET](1, "PKTUSB")
-        self.protocol._send.assert_called_with('MD$6;')
+        self.protocol._send.assert_called_with(b'MD$6;')
 
     def test_mode_handler_get(self):
         self.protocol._send.assert_not_called()
         self.protocol._msgbus[MsgType.VFO_MODE_QUERY](2)
+        self.run_once()
         self.protocol._send.assert_not_called()
         self.protocol._msgbus[MsgType.VFO_MODE_QUERY](0)
-        self.protocol._send.assert_called_once_with('MD;')
+        self.run_once()
+        self.protocol._send.assert_called_once_with(b'MD;')
         self.protocol._msgbus[MsgType.VFO_MODE_QUERY](1)
-        self.protocol._send.assert_called_with('MD$;')
+        self.run_once()
+        self.protocol._send.assert_called_with(b'MD$;')
 
     def test_mode_handler_response(self):
         self.mode_callbacks.assert_not_called()
-        self.mode_handler0('MD1;')
-        self.mode_handler0('MD2;')
-        self.mode_handler0('MDX;')
-        self.mode_handler1('MD$1;')
-        self.mode_handler1('MD$2;')
-        self.mode_handler1('MD$X;')
+        self.mode_handler0(b'MD1;')
+        self.mode_handler0(b'MD2;')
+        self.mode_handler0(b'MDX;')
+        self.mode_handler1(b'MD$1;')
+        self.mode_handler1(b'MD$2;')
+        self.mode_handler1(b'MD$X;')
         self.assertEquals(4, self.mode_callbacks.call_count)
         self.assertEquals((0, "LSB"), self.mode_callbacks.call_args_list[0].args)
         self.assertEquals((0, "USB"), self.mode_callbacks.call_args_list[1].args)
         self.assertEquals((1, "LSB"), self.mode_callbacks.call_args_list[2].args)
         self.assertEquals((1, "USB"), self.mode_callbacks.call_args_list[3].args)
 
+    def test_unknown_frame_ignored(self):
+        self.protocol._dispatch(b'ZZ1;')
+        self.vfo_callbacks.assert_not_called()
+
+    def test_handler_errors_not_hidden(self):
+        self.msgbus[MsgType.VFO_FREQUENCY_RESULT].connect(
+            unittest.mock.MagicMock(side_effect=KeyError('slot')))
+        with self.assertRaises(KeyError):
+            self.protocol._dispatch(b'FA00014074000;')
+
     def test_rx_vfo_handler_set(self):
         self.protocol._send.assert_not_called()
         self.protocol._msgbus[MsgType.RX_VFO_SET](0)
-        self.protocol._send.assert_called_once_with('FR0;')
+        self.protocol._send.assert_called_once_with(b'FR0;')
         self.protocol._msgbus[MsgType.RX_VFO_SET](1)
-        self.protocol._send.assert_called_with('FR1;')
+        self.protocol._send.assert_called_with(b'FR1;')
 
     def test_rx_vfo_handler_get(self):
         self.protocol._send.assert_not_called()
         self.protocol._msgbus[MsgType.RX_VFO_QUERY]()
-        self.protocol._send.assert_called_once_with('FR;')
+        self.run_once()
+        self.protocol._send.assert_called_once_with(b'FR;')
 
     def test_rx_vfo_handler_response(self):
         self.rx_vfo_callbacks.assert_not_called()
-        self.rx_vfo_handler('FR0;')
-        self.rx_vfo_handler('FR1;')
-        self.rx_vfo_handler('FRX;')
+        self.rx_vfo_handler(b'FR0;')
+        self.rx_vfo_handler(b'FR1;')
+        self.rx_vfo_handler(b'FRX;')
         self.assertEquals(2, self.rx_vfo_callbacks.call_count)
         self.assertEquals((0,), self.rx_vfo_callbacks.call_args_list[0].args)
         self.assertEquals((1,), self.rx_vfo_callbacks.call_args_list[1].args)
@@ -175,20 +312,21 @@ class ProtocolTest(unittest.TestCase):
     def test_tx_vfo_handler_set(self):
         self.protocol._send.assert_not_called()
         self.protocol._msgbus[MsgType.TX_VFO_SET](0)
-        self.protocol._send.assert_called_once_with('FT0;')
+        self.protocol._send.assert_called_once_with(b'FT0;')
         self.protocol._msgbus[MsgType.TX_VFO_SET](1)
-        self.protocol._send.assert_called_with('FT1;')
+        self.protocol._send.assert_called_with(b'FT1;')
 
     def test_tx_vfo_handler_get(self):
         self.protocol._send.assert_not_called()
         self.protocol._msgbus[MsgType.TX_VFO_QUERY]()
-        self.protocol._send.assert_called_once_with('FT;')
+        self.run_once()
+        self.protocol._send.assert_called_once_with(b'FT;')
 
     def test_tx_vfo_handler_response(self):
         self.tx_vfo_callbacks.assert_not_called()
-        self.tx_vfo_handler('FT0;')
-        self.tx_vfo_handler('FT1;')
-        self.tx_vfo_handler('FTX;')
+        self.tx_vfo_handler(b'FT0;')
+        self.tx_vfo_handler(b'FT1;')
+        self.tx_vfo_handler(b'FTX;')
         self.assertEquals(2, self.tx_vfo_callbacks.call_count)
         self.assertEquals((0,), self.tx_vfo_callbacks.call_args_list[0].args)
         self.assertEquals((1,), self.tx_vfo_callbacks.call_args_list[1].args)
@@ -196,22 +334,22 @@ class ProtocolTest(unittest.TestCase):
     def test_rx_handler_set(self):
         self.protocol._send.assert_not_called()
         self.protocol._msgbus[MsgType.RECEIVE_SET]()
-        self.protocol._send.assert_called_once_with('RX;')
+        self.protocol._send.assert_called_once_with(b'RX;')
 
     def test_rx_handler_response(self):
         self.rx_callbacks.assert_not_called()
-        self.rx_handler('RX;')
+        self.rx_handler(b'RX;')
         self.assertEquals(1, self.rx_callbacks.call_count)
         self.assertEquals(tuple(), self.rx_callbacks.call_args_list[0].args)
 
     def test_tx_handler_set(self):
         self.protocol._send.assert_not_called()
         self.protocol._msgbus[MsgType.TRANSMIT_SET]()
-        self.protocol._send.assert_called_once_with('TX;')
+        self.protocol._send.assert_called_once_with(b'TX;')
 
     def test_tx_handler_response(self):
         self.tx_callbacks.assert_not_called()
-        self.tx_handler('TX;')
+        self.tx_handler(b'TX;')
         self.assertEquals(1, self.tx_callbacks.call_count)
         self.assertEquals(tuple(), self.tx_callbacks.call_args_list[0].args)
 
@@ -222,12 +360,11 @@ class ProtocolTest(unittest.TestCase):
         (cat_sock, rig_sock) = socket.socketpair()
         rig_sock.send(b'FA00003500000;FB00007100000;FR0;FT1;')
         rig_sock.close()
-        loop = asyncio.get_event_loop()
-        task = loop.create_task(asyncio.open_connection(sock=cat_sock))
-        loop.run_until_complete(task)
-        (reader, writer) = task.result()
-        task = self.protocol.open(loop, reader, writer)
-        loop.run_until_complete(task)
+        loop = self.loop
+        (transport, _) = loop.run_until_complete(loop.create_connection(
+            self.protocol.create_frame_protocol, sock=cat_sock))
+        closed = self.protocol.open(loop, transport)
+        loop.run_until_complete(closed)
         self.assertEquals(2, self.vfo_callbacks.call_count)
         self.assertEquals((0, 3500000), self.vfo_callbacks.call_args_list[0].args)
         self.assertEquals((1, 7100000), self.vfo_callbacks.call_args_list[1].args)
@@ -235,3 +372,312 @@ class ProtocolTest(unittest.TestCase):
         self.assertEquals((0,), self.rx_vfo_callbacks.call_args_list[0].args)
         self.assertEquals(1, self.tx_vfo_callbacks.call_count)
         self.assertEquals((1,), self.tx_vfo_callbacks.call_args_list[0].args)
+
+
+class InfoHandlerTest(unittest.TestCase):
+    DEFINITION = dict(protocol_config=dict(
+        ProtocolTest.DEFINITION['protocol_config'],
+        info={
+            'get': 'IF;',
+            'response': DecoderTest.IF_RESPONSE,
+        }))
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.msgbus = MsgBus()
+        self.protocol = ProtocolWrapper('Elecraft', None, self.msgbus, self.DEFINITION)
+        self.callbacks = unittest.mock.MagicMock()
+        for msgtype in (MsgType.VFO_FREQUENCY_RESULT, MsgType.VFO_MODE_RESULT,
+                        MsgType.RX_VFO_RESULT, MsgType.TX_VFO_RESULT,
+                        MsgType.TRANSMIT_RESULT):
+            self.msgbus[msgtype].connect(getattr(self.callbacks, msgtype.name))
+
+    def tearDown(self):
+        self.protocol._scheduler.reset()
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def run_once(self):
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+    def test_info_response(self):
+        self.protocol._dispatch(b'IF00014074000     -002010 0016001011 ;')
+        self.callbacks.VFO_FREQUENCY_RESULT.assert_called_once_with(0, 14074000)
+        self.callbacks.VFO_MODE_RESULT.assert_called_once_with(0, 'PKTUSB')
+        self.callbacks.RX_VFO_RESULT.assert_called_once_with(0)
+        self.callbacks.TX_VFO_RESULT.assert_called_once_with(1)
+        self.callbacks.TRANSMIT_RESULT.assert_called_once_with(PTT.TX)
+
+    def test_bad_info_response(self):
+        self.protocol._dispatch(b'IF000140X4000     -002010 0016001011 ;')
+        self.callbacks.VFO_FREQUENCY_RESULT.assert_not_called()
+        self.callbacks.VFO_MODE_RESULT.assert_not_called()
+        self.callbacks.RX_VFO_RESULT.assert_not_called()
+
+    def test_info_replaces_covered_queries(self):
+        self.msgbus[MsgType.VFO_FREQUENCY_QUERY](0)
+        self.msgbus[MsgType.VFO_FREQUENCY_QUERY](1)
+        self.msgbus[MsgType.VFO_MODE_QUERY](0)
+        self.msgbus[MsgType.RX_VFO_QUERY]()
+        self.msgbus[MsgType.TX_VFO_QUERY]()
+        self.run_once()
+        self.protocol._send.assert_called_once_with(b'FB;IF;')
+        scheduler = self.protocol._scheduler
+        self.assertEqual({b'FA;', b'MD;', b'FR;', b'FT;', b'FB;', b'IF;'},
+                         set(scheduler.outstanding))
+        # covered queries ride on the IF in flight
+        self.msgbus[MsgType.VFO_FREQUENCY_QUERY](0)
+        self.run_once()
+        self.protocol._send.assert_called_once()
+        self.protocol._dispatch(b'IF00014074000     -002010 0006001011 ;')
+        self.assertEqual((b'FB;',), scheduler.outstanding)
+
+    def test_single_query_not_replaced(self):
+        self.msgbus[MsgType.VFO_FREQUENCY_QUERY](0)
+        self.run_once()
+        self.protocol._send.assert_called_once_with(b'FA;')
+
+    def test_summary_follows_rx_vfo(self):
+        self.protocol._dispatch(b'FR1;')
+        self.msgbus[MsgType.VFO_FREQUENCY_QUERY](0)
+        self.msgbus[MsgType.VFO_FREQUENCY_QUERY](1)
+        self.msgbus[MsgType.VFO_MODE_QUERY](1)
+        self.run_once()
+        self.protocol._send.assert_called_once_with(b'FA;IF;')
+
+
+class OutputQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.write = unittest.mock.MagicMock()
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def run_once(self):
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+    def test_coalesced(self):
+        queue = OutputQueue(self.write)
+        for cmd in (b'FA;', b'FB;', b'MD;'):
+            queue.send(cmd)
+        self.write.assert_not_called()
+        self.run_once()
+        self.write.assert_called_once_with(b'FA;FB;MD;')
+        self.assertEqual(0, len(queue))
+
+    def test_priority_first(self):
+        queue = OutputQueue(self.write, priority=[b'RX;'])
+        queue.send(b'FA;')
+        queue.send(b'RX;')
+        queue.send(b'KY x;', priority=True)
+        self.run_once()
+        self.write.assert_called_once_with(b'RX;KY x;FA;')
+
+    def test_commands_paced(self):
+        queue = OutputQueue(self.write, commands_per_second=100)
+        # a burst of 25 commands goes out at once, the rest at 100/s
+        for i in range(30):
+            queue.send(b'FA%011d;' % i)
+        self.run_once()
+        self.assertEqual(25, self.write.call_args.args[0].count(b';'))
+        self.assertEqual(5, len(queue))
+        self.loop.run_until_complete(asyncio.sleep(0.07))
+        self.assertEqual(30, sum(call.args[0].count(b';')
+                                 for call in self.write.call_args_list))
+
+    def test_bytes_paced(self):
+        queue = OutputQueue(self.write, bytes_per_second=100)
+        queue.send(b'FA00007074000;FB00014074000;')
+        queue.send(b'MD;')
+        self.run_once()
+        # a write larger than the burst still goes out, then waits
+        self.write.assert_called_once_with(b'FA00007074000;FB00014074000;')
+        self.assertEqual((b'MD;',), queue.queued)
+        self.loop.run_until_complete(asyncio.sleep(0.02))
+        self.assertEqual((b'MD;',), queue.queued)
+        self.loop.run_until_complete(asyncio.sleep(0.04))
+        self.write.assert_called_with(b'MD;')
+
+    def test_priority_skips_pacing(self):
+        queue = OutputQueue(self.write, commands_per_second=4, priority=[b'RX;'])
+        for cmd in (b'FA;', b'FB;', b'MD;'):
+            queue.send(cmd)
+        self.run_once()
+        self.write.assert_called_once_with(b'FA;')
+        queue.send(b'RX;')
+        self.run_once()
+        self.write.assert_called_with(b'RX;')
+        self.assertEqual((b'FB;', b'MD;'), queue.queued)
+
+    def test_reset(self):
+        queue = OutputQueue(self.write, commands_per_second=1)
+        queue.send(b'FA;')
+        queue.send(b'FB;')
+        self.run_once()
+        queue.reset()
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+        self.write.assert_called_once_with(b'FA;')
+        self.assertEqual(0, len(queue))
+
+    def test_priority_after_reset(self):
+        queue = OutputQueue(self.write, commands_per_second=1, priority=[b'RX;'])
+        queue.send(b'FA;')
+        queue.send(b'FB;')
+        self.run_once()
+        queue.reset()
+        queue.send(b'RX;')
+        self.run_once()
+        self.write.assert_called_with(b'RX;')
+
+
+class ProtocolOutputTest(unittest.TestCase):
+    DEFINITION = dict(protocol_config=dict(
+        ProtocolTest.DEFINITION['protocol_config'],
+        pacing={'commands_per_second': 8},
+        cw={'mode': 'cat', 'cancel': 'RX;', 'length': 24, 'send': 'KY {text};'}))
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.msgbus = MsgBus()
+        self.protocol = Protocol('Elecraft', None, self.msgbus, self.DEFINITION)
+        self.transport = unittest.mock.MagicMock()
+        self.protocol.open(self.loop, self.transport)
+        self.run_once()
+        self.transport.write.reset_mock()
+
+    def tearDown(self):
+        self.protocol._connection_lost(None)
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def run_once(self):
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+    def test_sets_coalesced(self):
+        self.loop.run_until_complete(asyncio.sleep(0.3))
+        self.msgbus[MsgType.VFO_FREQUENCY_SET](0, 7074000)
+        self.msgbus[MsgType.VFO_MODE_SET](0, 'USB')
+        self.transport.write.assert_not_called()
+        self.run_once()
+        self.transport.write.assert_called_once_with(b'FA00007074000;MD2;')
+
+    def test_transmit_ahead_of_queries(self):
+        self.loop.run_until_complete(asyncio.sleep(0.3))
+        for index in (0, 1):
+            self.msgbus[MsgType.VFO_FREQUENCY_QUERY](index)
+            self.msgbus[MsgType.VFO_MODE_QUERY](index)
+        self.run_once()
+        self.run_once()
+        self.assertEqual(1, self.transport.write.call_count)
+        self.msgbus[MsgType.RECEIVE_SET]()
+        self.run_once()
+        self.transport.write.assert_called_with(b'RX;')
+
+    def test_abort_drops_paced_cw(self):
+        self.loop.run_until_complete(asyncio.sleep(0.3))
+        for index in (0, 1):
+            self.msgbus[MsgType.VFO_FREQUENCY_QUERY](index)
+            self.msgbus[MsgType.VFO_MODE_QUERY](index)
+        self.msgbus[MsgType.MORSE_SEND]('CQ')
+        self.run_once()
+        self.run_once()
+        self.assertIn(b'KY CQ;', self.protocol._output.queued)
+        self.msgbus[MsgType.MORSE_CANCEL]()
+        self.run_once()
+        self.transport.write.assert_called_with(b'RX;')
+        self.assertNotIn(b'KY CQ;', self.protocol._output.queued)
+        self.loop.run_until_complete(asyncio.sleep(0.6))
+        written = b''.join(call.args[0] for call in self.transport.write.call_args_list)
+        self.assertNotIn(b'KY CQ;', written)
+        self.assertIn(b'MD$;', written)
+
+    def test_dropped_when_closed(self):
+        self.msgbus[MsgType.VFO_FREQUENCY_SET](0, 7074000)
+        self.protocol._connection_lost(None)
+        self.loop.run_until_complete(asyncio.sleep(0.3))
+        self.transport.write.assert_not_called()
+
+
+class CatCWHandlerTest(unittest.TestCase):
+    DEFINITION = dict(protocol_config=dict(
+        ProtocolTest.DEFINITION['protocol_config'],
+        keyer_speed={
+            'get': 'KS;',
+            'response': 'KS(?P<speed>\\d+);',
+            'set': 'KS{speed:03d};',
+            'range': '8-50',
+        },
+        cw={
+            'mode': 'cat',
+            'cancel': 'RX;',
+            'length': 8,
+            'get': 'KY;',
+            'response': 'KY(?P<full>[01]);',
+            'send': 'KY {text};',
+        }))
+
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.msgbus = MsgBus()
+        self.protocol = ProtocolWrapper('Elecraft', None, self.msgbus, self.DEFINITION)
+        self.morse_task = self.protocol._handlers[b'KY'].morse_task
+
+    def tearDown(self):
+        self.msgbus[MsgType.MORSE_CANCEL]()
+        # let the cancelled sender finish before the loop closes
+        self.run_once()
+        self.protocol._scheduler.reset()
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def run_once(self):
+        self.loop.run_until_complete(asyncio.sleep(0))
+
+    def sent(self):
+        return [call.args[0] for call in self.protocol._send.call_args_list]
+
+    def test_keyer_speed_clamped(self):
+        self.msgbus[MsgType.KEYER_SPEED_SET](80)
+        self.msgbus[MsgType.KEYER_SPEED_SET](5)
+        self.run_once()
+        self.assertEqual([b'KS050;', b'KS008;', b'KS;'], self.sent())
+
+    def test_chunked(self):
+        self.protocol._dispatch(b'KS200;')
+        self.msgbus[MsgType.MORSE_SEND]('CQ TEST N0;CALL')
+        self.run_once()
+        self.run_once()
+        # the first chunk goes at once, then the buffer state is asked
+        self.assertEqual([b'KY CQ TEST ;', b'KY;'], self.sent())
+        self.assertEqual('N0;CALL', self.morse_task.queued)
+        self.protocol._dispatch(b'KY0;')
+        # 'CQ TEST ' takes 0.37s at 200 wpm
+        self.loop.run_until_complete(asyncio.sleep(0.02))
+        self.assertEqual(2, len(self.sent()))
+        self.loop.run_until_complete(asyncio.sleep(0.15))
+        self.assertEqual(b'KY N0CALL;', self.sent()[2])
+        self.assertEqual('', self.morse_task.queued)
+
+    def test_buffer_full(self):
+        self.protocol._dispatch(b'KS050;')
+        self.protocol._dispatch(b'KY1;')
+        self.msgbus[MsgType.MORSE_SEND]('CQ')
+        self.loop.run_until_complete(asyncio.sleep(0.15))
+        self.assertNotIn(b'KY CQ;', self.sent())
+        self.protocol._dispatch(b'KY0;')
+        self.run_once()
+        self.run_once()
+        self.assertIn(b'KY CQ;', self.sent())
+
+    def test_cancel(self):
+        self.msgbus[MsgType.MORSE_SEND]('CQ TEST CQ TEST')
+        self.run_once()
+        self.msgbus[MsgType.MORSE_CANCEL]()
+        self.protocol._send.assert_called_with(b'RX;')
+        self.assertEqual('', self.morse_task.queued)
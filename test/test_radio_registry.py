@@ -0,0 +1,161 @@
+from radioctl import radio_registry, rigloader
+from radioctl.radio_registry import load_all, radio_choices, radio_definition
+
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+
+
+RIGSDB = os.getenv('RIGSDB')
+
+
+class RigCacheTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.rigsdb = os.path.join(tmp.name, 'rigs')
+        self.cache_dir = os.path.join(tmp.name, 'cache')
+        shutil.copytree(RIGSDB, self.rigsdb)
+        # leave the registry as the other tests expect it
+        self.addCleanup(load_all)
+        self.addCleanup(radio_registry.clear)
+        environ = unittest.mock.patch.dict(os.environ, RIGSDB=self.rigsdb)
+        environ.start()
+        self.addCleanup(environ.stop)
+        self.parsed = []
+        load_file = rigloader.load_file
+
+        def counting_load_file(filename):
+            self.parsed.append(os.path.basename(filename))
+            return load_file(filename)
+        patch = unittest.mock.patch.object(rigloader, 'load_file', counting_load_file)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def reload(self, cache_dir=None):
+        radio_registry.clear()
+        self.parsed.clear()
+        load_all(cache_dir or self.cache_dir)
+
+    def test_loads_selected_rig_only(self):
+        self.reload()
+        self.assertEqual([], self.parsed)
+        self.assertIn('K3s', radio_choices())
+        self.assertIn('IC-7300', radio_choices())
+        self.assertIs(radio_definition('K3'), radio_definition('Elecraft K3'))
+        self.assertEqual(['elecraft_k3.yaml'], self.parsed)
+
+    def test_warm_cache_loads_lazily(self):
+        self.reload()
+        k3 = radio_definition('K3')
+        self.assertEqual(['elecraft_k3.yaml'], self.parsed)
+
+        self.reload()
+        self.assertEqual([], self.parsed)
+        self.assertIn('K3s', radio_choices())
+        self.assertIn('IC-7300', radio_choices())
+        self.assertEqual(k3, radio_definition('K3'))
+        # loaded from the cache, once for all its aliases
+        self.assertIs(radio_definition('K3'), radio_definition('Elecraft K3'))
+        self.assertEqual([], self.parsed)
+
+    def test_changed_file_reparsed(self):
+        self.reload()
+        radio_definition('K3')
+        filename = os.path.join(self.rigsdb, 'elecraft_k3.yaml')
+        with open(filename, 'a') as f:
+            f.write('\n# edited\n')
+        self.reload()
+        radio_definition('K3')
+        self.assertEqual(['elecraft_k3.yaml'], self.parsed)
+
+    def test_removed_file_forgotten(self):
+        self.reload()
+        os.unlink(os.path.join(self.rigsdb, 'icom_ic7300.yaml'))
+        self.reload()
+        self.assertNotIn('IC-7300', radio_choices())
+        with self.assertRaises(KeyError):
+            radio_definition('IC-7300')
+
+    def test_unwritable_cache(self):
+        blocker = os.path.join(os.path.dirname(self.cache_dir), 'file')
+        open(blocker, 'w').close()
+        self.reload(cache_dir=os.path.join(blocker, 'cache'))
+        radio_definition('K3')
+        self.reload(cache_dir=os.path.join(blocker, 'cache'))
+        self.assertEqual('Elecraft K3', radio_definition('K3')['name'])
+        self.assertEqual(['elecraft_k3.yaml'], self.parsed)
+
+    def edit(self, rig_file, old, new):
+        filename = os.path.join(self.rigsdb, rig_file)
+        with open(filename) as f:
+            text = f.read()
+        self.assertIn(old, text)
+        with open(filename, 'w') as f:
+            f.write(text.replace(old, new, 1))
+
+    def test_invalid_definition(self):
+        self.edit('elecraft_k3.yaml', "- range: '44000000-54000000'", '- range: 44000000')
+        self.reload()
+        with self.assertRaises(rigloader.RigDefinitionError) as cm:
+            radio_definition('K3')
+        self.assertEqual(
+            f"{self.rigsdb}/elecraft_k3.yaml: rx_bands[1].range: "
+            "expected low-high, got 44000000", str(cm.exception))
+        # the others are unaffected
+        self.assertEqual('Icom IC-7300', radio_definition('IC-7300')['name'])
+
+    def test_missing_name(self):
+        self.edit('elecraft_k3.yaml', "name: 'Elecraft K3'\n", '')
+        with self.assertLogs('radio_registry', 'ERROR') as cm:
+            self.reload()
+        self.assertIn('elecraft_k3.yaml: name: missing', cm.output[0])
+        self.assertNotIn('K3', radio_choices())
+        self.assertIn('IC-7300', radio_choices())
+
+
+class RigLoaderTest(unittest.TestCase):
+    def test_scan_header(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.yaml') as f:
+            f.write("# comment\n"
+                    "protocol: Kenwood\n"
+                    "aliases:\n"
+                    "    # several\n"
+                    "    - K3\n"
+                    "\n"
+                    "    - K3s\n"
+                    "modes: [CW]\n"
+                    "name: 'Elecraft K3'\n"
+                    "rx_bands: {not: valid\n")
+            f.flush()
+            self.assertEqual(('Elecraft K3', ['K3', 'K3s']), rigloader.scan_header(f.name))
+
+    def test_shipped_definitions_valid(self):
+        for rig_file in os.listdir(RIGSDB):
+            filename = os.path.join(RIGSDB, rig_file)
+            (name, aliases, definition) = rigloader.load_file(filename)
+            self.assertEqual((name, aliases), rigloader.scan_header(filename))
+
+    def test_validate(self):
+        (_, _, definition) = rigloader.load_file(os.path.join(RIGSDB, 'elecraft_k3.yaml'))
+        for (key, value, message) in (
+                ('vfos', 'ABC', "vfos: expected one of 'A/B', got 'ABC'"),
+                ('rf_power', '100-5', "rf_power: empty range '100-5'"),
+                ('modes', 'CW', "modes: expected a list, got 'CW'"),
+                ('levels', {'get': ['AF', 3]}, 'levels.get[1]: expected str, got 3'),
+                ('modes', ['USB', 'PKTUSBX'], "modes[1]: unknown mode 'PKTUSBX'"),
+                ('levels', ['AF', 'KEYSPDX'], "levels[1]: unknown level 'KEYSPDX'"),
+                ('funcs', {'set': ['NOPE']}, "funcs.set[0]: unknown function 'NOPE'"),
+                ('parms', ['NOPE'], "parms[0]: unknown parm 'NOPE'"),
+                ('tx_bands', ['20m', '11m'], "tx_bands[1]: unknown band '11m'"),
+                ('protocol_config', None, 'protocol_config: expected dict, got None')):
+            with self.subTest(key=key):
+                with self.assertRaises(rigloader.RigDefinitionError) as cm:
+                    rigloader.validate(dict(definition, **{key: value}), 'k3.yaml')
+                self.assertEqual(f'k3.yaml: {message}', str(cm.exception))
+        with self.assertRaises(rigloader.RigDefinitionError) as cm:
+            rigloader.validate({k: v for (k, v) in definition.items() if k != 'dialect'},
+                               'k3.yaml')
+        self.assertEqual('k3.yaml: dialect: missing', str(cm.exception))
@@ -0,0 +1,117 @@
+from radioctl.utils.signal_slots import Signal
+
+import gc
+import unittest
+import unittest.mock
+
+
+class Receiver:
+    def __init__(self):
+        self.received = []
+
+    def slot(self, *args, **kwargs):
+        self.received.append((args, kwargs))
+
+
+class SignalTest(unittest.TestCase):
+    def test_function_slot(self):
+        signal = Signal()
+        callback = unittest.mock.MagicMock()
+        signal.connect(callback)
+        signal(1, 2, key='value')
+        callback.assert_called_once_with(1, 2, key='value')
+
+    def test_method_slot(self):
+        signal = Signal()
+        receiver = Receiver()
+        signal.connect(receiver.slot)
+        signal(7074000)
+        self.assertEqual([((7074000,), {})], receiver.received)
+
+    def test_connect_twice(self):
+        signal = Signal()
+        receiver = Receiver()
+        callback = unittest.mock.MagicMock()
+        signal.connect(receiver.slot)
+        signal.connect(receiver.slot)
+        signal.connect(callback)
+        signal.connect(callback)
+        signal()
+        self.assertEqual(1, len(receiver.received))
+        self.assertEqual(1, callback.call_count)
+
+    def test_connect_order(self):
+        signal = Signal()
+        calls = []
+        first = lambda: calls.append('first')
+        second = lambda: calls.append('second')
+        signal.connect(first)
+        signal.connect(second)
+        signal()
+        signal.connect(first)
+        signal()
+        self.assertEqual(['first', 'second', 'second', 'first'], calls)
+
+    def test_disconnect(self):
+        signal = Signal()
+        receiver = Receiver()
+        callback = unittest.mock.MagicMock()
+        signal.connect(receiver.slot)
+        signal.connect(callback)
+        signal.disconnect(receiver.slot)
+        signal.disconnect(callback)
+        signal.disconnect(callback)
+        signal()
+        self.assertEqual([], receiver.received)
+        callback.assert_not_called()
+
+    def test_disconnect_all(self):
+        signal = Signal()
+        callback = unittest.mock.MagicMock()
+        signal.connect(callback)
+        signal.disconnectAll()
+        signal()
+        callback.assert_not_called()
+
+    def test_dead_method_removed(self):
+        signal = Signal()
+        receiver = Receiver()
+        signal.connect(receiver.slot)
+        self.assertEqual(1, len(signal._slots))
+        del receiver
+        gc.collect()
+        self.assertEqual(0, len(signal._slots))
+        signal()
+
+    def test_slot_dies_during_emit(self):
+        signal = Signal()
+        receivers = [Receiver(), Receiver()]
+        survivor = receivers[1]
+
+        def kill(*args):
+            del receivers[:]
+
+        signal.connect(kill)
+        for receiver in receivers:
+            signal.connect(receiver.slot)
+        signal('x')
+        self.assertEqual([(('x',), {})], survivor.received)
+        self.assertEqual(2, len(signal._slots))
+
+    def test_connect_during_emit(self):
+        signal = Signal()
+        late = unittest.mock.MagicMock()
+        signal.connect(lambda: signal.connect(late))
+        signal()
+        late.assert_not_called()
+        signal()
+        late.assert_called_once_with()
+
+    def test_signal_as_slot(self):
+        signal = Signal()
+        forwarded = Signal()
+        callback = unittest.mock.MagicMock()
+        forwarded.connect(callback)
+        signal.connect(forwarded)
+        signal(3)
+        callback.assert_called_once_with(3)
@@ -0,0 +1,143 @@
+from radioctl.hamlib.server import Server
+from radioctl.radio_registry import load_all, radio_definition
+from radioctl.rigfactory import create_rig
+from radioctl.simulator import create_simulator, IcomSimulator, KenwoodSimulator
+from radioctl.utils.morse import duration
+
+import asyncio
+import json
+import os
+import unittest
+
+
+load_all()
+
+
+@unittest.skipUnless(hasattr(os, 'openpty'), 'needs a pty')
+class EndToEndTest(unittest.TestCase):
+    # Rig, serial transport and rigctld session against a simulated rig
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(asyncio.set_event_loop, None)
+        self.addCleanup(self.loop.close)
+
+    def connect(self, name, **kwargs):
+        sim = create_simulator(radio_definition(name), **kwargs)
+        sim.start(self.loop)
+        self.addCleanup(sim.close)
+        rig = create_rig(name, {}, itu_region=2)
+        closed = self.loop.run_until_complete(
+            rig.connect_serial(self.loop, sim.port, 38400))
+        self.addCleanup(self.disconnect, rig, closed)
+        return (sim, rig)
+
+    def disconnect(self, rig, closed):
+        rig.close()
+        self.loop.run_until_complete(asyncio.wait_for(closed, 1))
+
+    def serve(self, rig):
+        server = self.loop.run_until_complete(
+            Server(rig, max_age=0).start('127.0.0.1', 0))
+        self.addCleanup(self.loop.run_until_complete, server.wait_closed())
+        self.addCleanup(server.close)
+        port = server.sockets[0].getsockname()[1]
+        (reader, writer) = self.loop.run_until_complete(
+            asyncio.open_connection('127.0.0.1', port))
+        self.addCleanup(writer.close)
+        return (reader, writer)
+
+    def command(self, client, line, replies=1):
+        (reader, writer) = client
+        writer.write(line.encode() + b'\n')
+
+        async def read():
+            return [(await reader.readline()).decode().rstrip('\n')
+                    for _ in range(replies)]
+        return self.loop.run_until_complete(asyncio.wait_for(read(), 2))
+
+    def test_k3_rigctld(self):
+        (sim, rig) = self.connect('K3', baudrate=38400)
+        self.assertTrue(isinstance(sim, KenwoodSimulator))
+        client = self.serve(rig)
+        self.assertEqual(['14074000'], self.command(client, 'f'))
+        self.assertEqual(['RPRT 0'], self.command(client, 'F 7040000'))
+        self.assertEqual(['7040000'], self.command(client, 'f'))
+        self.assertEqual(7040000, sim.get('vfo_0', 'freq'))
+        self.assertEqual(['USB', '0'], self.command(client, 'm', 2))
+
+    def test_k3_auto_info(self):
+        (sim, rig) = self.connect('K3', chatter_interval=0.01, chatter_step=100)
+        vfo = rig.model.get_vfo(0)
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+        # the startup string turned on AI2, so tuning is reported
+        # the latest report may still be on its way
+        self.assertIn(sim.get('vfo_0', 'freq') - vfo.frequency, (0, 100))
+        self.assertGreater(vfo.frequency, 14074000)
+
+    def test_k3_subscribe(self):
+        (sim, rig) = self.connect('K3', chatter_interval=0.01, chatter_step=100)
+        client = self.serve(rig)
+        (snapshot, reply) = self.command(client, '\\subscribe json', 2)
+        self.assertEqual('RPRT 0', reply)
+        self.assertEqual({'freq', 'mode', 'vfo', 'split_vfo', 'ptt', 'online'},
+                         set(json.loads(snapshot)))
+        # tuning reported through auto-info is pushed without polling
+        updates = [json.loads(line) for line in self.command(client, '', 3)]
+        frequencies = [update['freq']['VFOA'] for update in updates
+                       if 'VFOA' in update.get('freq', {})]
+        self.assertEqual(3, len(frequencies))
+        self.assertEqual(sorted(frequencies), frequencies)
+        self.assertGreater(frequencies[0], 14074000)
+        # updates already on their way may arrive before the reply
+        (reply,) = self.command(client, '\\unsubscribe')
+        while reply.startswith('{'):
+            (reply,) = self.command(client, '', 1)
+        self.assertEqual('RPRT 0', reply)
+
+    def until(self, condition, timeout=2):
+        async def wait():
+            while not condition():
+                await asyncio.sleep(0.001)
+        self.loop.run_until_complete(asyncio.wait_for(wait(), timeout))
+
+    def test_k3_cw(self):
+        (sim, rig) = self.connect('K3', baudrate=38400)
+        # faster than any real keyer, to keep the test short
+        sim.set('keyer_speed', 'speed', 800)
+        client = self.serve(rig)
+        text = 'CQ TEST N0CALL N0CALL TEST 5NN 599 TU'
+        self.assertEqual(['RPRT 0'], self.command(client, 'b ' + text))
+        self.until(lambda: sim.cw_keyed == text and sim.cw_finished)
+        # chunks arrived before the keyer ran dry, and without overflowing
+        self.assertEqual(1, sim.cw_starts)
+        self.assertEqual(0, sim.cw_overflows)
+        self.assertLess(sim.cw_finished - sim.cw_started,
+                        duration(text, 800) + 0.2)
+
+    def test_k3_cw_cancel(self):
+        (sim, rig) = self.connect('K3', baudrate=38400)
+        sim.set('keyer_speed', 'speed', 50)
+        client = self.serve(rig)
+        self.assertEqual(['RPRT 0'], self.command(client, 'b ' + 'CQ TEST ' * 10))
+        self.until(lambda: sim.cw_keyed)
+        start = self.loop.time()
+        self.assertEqual(['RPRT 0'], self.command(client, '\\cancel_morse'))
+        self.until(lambda: sim.cw_cancelled)
+        self.assertLess(sim.cw_cancelled - start, 0.1)
+        keyed = sim.cw_keyed
+        self.loop.run_until_complete(asyncio.sleep(0.1))
+        self.assertEqual(keyed, sim.cw_keyed)
+        self.assertLess(len(keyed), 10)
+
+    def test_icom(self):
+        (sim, rig) = self.connect('IC-7300', baudrate=19200, echo=True)
+        self.assertTrue(isinstance(sim, IcomSimulator))
+        vfo = rig.model.get_vfo(1)
+        self.loop.run_until_complete(vfo.refresh('frequency', 'mode'))
+        self.assertEqual(7074000, vfo.frequency)
+        self.assertEqual('USB', vfo.mode)
+        client = self.serve(rig)
+        self.assertEqual(['RPRT 0'], self.command(client, 'F 14250000'))
+        self.assertEqual(['14250000'], self.command(client, 'f'))
+        self.assertEqual(14250000, sim.frequencies[0])
@@ -0,0 +1,104 @@
+from radioctl.radio_registry import load_all, radio_definition
+from radioctl.simulator import create_simulator
+from radioctl.supervisor import Supervisor
+
+import asyncio
+import os
+import unittest
+
+
+load_all()
+
+
+@unittest.skipUnless(hasattr(os, 'openpty'), 'needs a pty')
+class SupervisorTest(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.addCleanup(asyncio.set_event_loop, None)
+        self.addCleanup(self.loop.close)
+        self.k3 = self.simulate('K3')
+        self.icom = self.simulate('IC-7300', echo=True)
+
+    def simulate(self, name, **kwargs):
+        sim = create_simulator(radio_definition(name), **kwargs)
+        sim.start(self.loop)
+        self.addCleanup(sim.close)
+        return sim
+
+    def start(self, config):
+        supervisor = Supervisor(config)
+        self.loop.run_until_complete(supervisor.start(self.loop))
+        self.addCleanup(self.loop.run_until_complete, supervisor.close())
+        return supervisor
+
+    def connect(self, server):
+        port = server.sockets[0].getsockname()[1]
+        (reader, writer) = self.loop.run_until_complete(
+            asyncio.open_connection('127.0.0.1', port))
+        self.addCleanup(writer.close)
+        return (reader, writer)
+
+    def command(self, client, line, replies=1):
+        (reader, writer) = client
+        writer.write(line.encode() + b'\n')
+
+        async def read():
+            return [(await reader.readline()).decode().rstrip('\n')
+                    for _ in range(replies)]
+        return self.loop.run_until_complete(asyncio.wait_for(read(), 2))
+
+    def test_port_per_rig(self):
+        supervisor = self.start({'rigs': [
+            {'name': 'run', 'radio': 'K3', 'serial_port': self.k3.port,
+             'baudrate': 38400, 'tcp_port': 0},
+            {'name': 'mult', 'radio': 'IC-7300', 'serial_port': self.icom.port,
+             'baudrate': 19200, 'tcp_port': 0},
+        ]})
+        (run, mult) = [self.connect(server) for server in supervisor.servers]
+        self.assertEqual(['RPRT 0'], self.command(run, 'F 7040000'))
+        self.assertEqual(['RPRT 0'], self.command(mult, 'F 21074000'))
+        self.assertEqual(['7040000'], self.command(run, 'f'))
+        self.assertEqual(['21074000'], self.command(mult, 'f'))
+        self.assertEqual(7040000, self.k3.get('vfo_0', 'freq'))
+        self.assertEqual(21074000, self.icom.frequencies[0])
+
+    def test_shared_port(self):
+        supervisor = self.start({'shared_port': 0, 'rigs': [
+            {'name': 'run', 'radio': 'K3', 'serial_port': self.k3.port,
+             'baudrate': 38400},
+            {'name': 'mult', 'radio': 'IC-7300', 'serial_port': self.icom.port,
+             'baudrate': 19200},
+        ]})
+        (client,) = [self.connect(server) for server in supervisor.servers]
+        self.assertEqual(['run', 'RPRT 0'], self.command(client, '\\get_rig F 7040000', 2))
+        self.assertEqual(['RPRT 0', '14074000'],
+                         self.command(client, '\\set_rig mult f', 2))
+        self.assertEqual(['RPRT 0', '7040000'],
+                         self.command(client, '\\set_rig run f', 2))
+        self.assertEqual(14074000, self.icom.frequencies[0])
+        self.assertEqual(['RPRT 0'], self.command(client, '\\set_rig mult'))
+        self.assertEqual(['RPRT -1'], self.command(client, '\\set_rig nope'))
+        self.assertEqual(['mult'], self.command(client, '\\get_rig'))
+
+    def test_rig_isolation(self):
+        supervisor = self.start({'rigs': [
+            {'name': 'broken', 'radio': 'K3', 'serial_port': '/nonexistent/tty',
+             'tcp_port': 0},
+            {'name': 'run', 'radio': 'K3', 'serial_port': self.k3.port,
+             'baudrate': 38400, 'tcp_port': 0},
+        ]})
+        self.assertFalse(supervisor.is_connected('broken'))
+        self.assertTrue(supervisor.is_connected('run'))
+        run = self.connect(supervisor.servers[1])
+        self.assertEqual(['14074000'], self.command(run, 'f'))
+
+    def test_config_errors(self):
+        with self.assertRaises(ValueError):
+            Supervisor({'rigs': []})
+        with self.assertRaises(ValueError):
+            Supervisor({'rigs': [{'name': 'a', 'radio': 'K3'},
+                                 {'name': 'a', 'radio': 'K3'}]})
+        with self.assertRaises(ValueError):
+            Supervisor({'shared_port': 4532,
+                        'rigs': [{'name': 'a', 'radio': 'K3', 'tcp_port': 4532}]})